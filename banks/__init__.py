@@ -1,12 +1,30 @@
-from .davibank import DavibankProcessor
-from .bac import BacProcessor
-from .bcr import BcrProcessor
-from .scotiabank import ScotiabankProcessor
-
-# Lista de procesadores activos
-BANK_PROCESSORS = [
-    DavibankProcessor(),
-    BacProcessor(),
-    BcrProcessor(),
-    ScotiabankProcessor(),
+from .registry import ProcessorRegistry, ProcessorSpec
+
+# Lista de procesadores activos, en orden de prioridad
+PROCESSOR_SPECS = [
+    # Its alerts can come from the Scotiabank domain, so it has no domains and
+    # is tried before Scotiabank
+    ProcessorSpec("Davibank", "banks.rules:DAVIBANK_RULE"),
+    ProcessorSpec(
+        "BAC",
+        "banks.rules:BAC_RULE",
+        sender_domains=("notificacionesbaccr.com",),
+    ),
+    ProcessorSpec(
+        "BCR",
+        "banks.bcr:BcrProcessor",
+        sender_domains=("bancobcr.com",),
+    ),
+    ProcessorSpec(
+        "Scotiabank",
+        "banks.rules:SCOTIABANK_RULE",
+        sender_domains=("scotiabank.com",),
+    ),
 ]
+
+BANK_REGISTRY = ProcessorRegistry(PROCESSOR_SPECS)
+
+
+def find_processor(email):
+    """Returns the bank processor of the email, None if it is not a bank email"""
+    return BANK_REGISTRY.find(email)
@@ -2,7 +2,7 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
 from models.email import Email
-from models.transaction import Transaction
+from models.transaction import Transaction, TransactionType
 
 
 class BaseBankProcessor(ABC):
@@ -21,6 +21,17 @@ class BaseBankProcessor(ABC):
     def process(self, email: Email) -> Transaction | None:
         """Parses the email and returns a Transaction if applicable."""
 
+    @abstractmethod
+    def _identify_transaction_type(self, email: Email) -> TransactionType | None:
+        """Returns the type of transaction of the email, None if it is not supported."""
+
+    def supports(self, email: Email) -> bool:
+        """
+        Returns True if process can extract a Transaction from the email.
+        Only the sender and subject are used, so the body is not needed.
+        """
+        return self._identify_transaction_type(email) is not None
+
     @staticmethod
     def to_price(raw_price : str) -> float:
         """
@@ -5,6 +5,14 @@ from banks.base_bank_processor import BaseBankProcessor
 from models.transaction import Transaction, TransactionType
 from models.email import Email
 
+DATETIME_PATTERN = re.compile(r"(\d{2}/\d{2}/\d{4}) (\d{1,2}:\d{2})")
+SINPE_DEST_PATTERN = re.compile(r"Tel.fono Destino:\s*(\d+)")
+SINPE_AMOUNT_PATTERN = re.compile(r"Monto:\s*([\d.,]+)")
+SINPE_DATETIME_PATTERN = re.compile(
+    r"el (\d{2}/\d{2}/\d{4}) a las (\d{1,2}:\d{2}\s*[AP]M)"
+)
+SINPE_DESCRIPTION_PATTERN = re.compile(r"Motivo:(.*)")
+
 
 class BcrProcessor(BaseBankProcessor):
     @property
@@ -32,11 +40,10 @@ class BcrProcessor(BaseBankProcessor):
 
     @staticmethod
     def _get_datetime(text: str, email_dt_str) -> "datetime":
-        DATETIME_PATTERN = r"(\d{2}/\d{2}/\d{4}) (\d{1,2}:\d{2})"
         dt = BaseBankProcessor.get_default_date_time(email_dt_str)
 
         try:
-            date_time_match = re.search(DATETIME_PATTERN, text)
+            date_time_match = DATETIME_PATTERN.search(text)
             if date_time_match:
                 date_str, time_str = date_time_match.groups()
                 full_str = f"{date_str} {time_str}"
@@ -52,21 +59,19 @@ class BcrProcessor(BaseBankProcessor):
         dt = BaseBankProcessor.get_default_date_time(email.date_str)
 
         # Buscar número de referencia
-        dest_match = re.search(r"Tel.fono Destino:\s*(\d+)", email.body)
+        dest_match = SINPE_DEST_PATTERN.search(email.body)
         dest_num = dest_match.group(1) if dest_match else None
 
-        amount_match = re.search(r"Monto:\s*([\d.,]+)", email.body)
+        amount_match = SINPE_AMOUNT_PATTERN.search(email.body)
         amount_raw = amount_match.group(1) if amount_match else None
         amount_crc: float = BaseBankProcessor.to_price(amount_raw)
 
-        datetime_match = re.search(
-            r"el (\d{2}/\d{2}/\d{4}) a las (\d{1,2}:\d{2}\s*[AP]M)", email.body
-        )
+        datetime_match = SINPE_DATETIME_PATTERN.search(email.body)
         if datetime_match:
             date_str, time_str = datetime_match.groups()
             dt = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %I:%M %p")
 
-        desc_match = re.search(r"Motivo:(.*)", email.body)
+        desc_match = SINPE_DESCRIPTION_PATTERN.search(email.body)
         description = desc_match.group(1) if desc_match else None
         description = description.strip() + f" | SINPE → {dest_num}"
         ts = Transaction(
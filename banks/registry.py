@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from email.utils import parseaddr
+from functools import lru_cache
+from importlib import import_module
+
+from banks.base_bank_processor import BaseBankProcessor
+from banks.rule_engine import BankRule, RuleBasedProcessor
+from models.email import Email
+
+
+@dataclass(frozen=True)
+class ProcessorSpec:
+    """
+    Declares a bank processor without importing it.
+
+    - target: 'module:attribute', either a BaseBankProcessor subclass or a BankRule
+    - sender_domains: domains of the sender addresses used by the bank, empty
+      when it can use any domain. Whether an email belongs to the bank is still
+      decided by the identify method of the processor
+    """
+
+    name: str
+    target: str
+    sender_domains: tuple[str, ...] = ()
+
+
+@lru_cache(maxsize=1024)
+def sender_domain(sender: str) -> str:
+    """Returns the normalized domain of a From header ('Bank <a@Bank.com>' -> 'bank.com')"""
+    address = parseaddr(sender)[1] or sender
+    return address.rpartition("@")[2].strip().lower()
+
+
+class ProcessorRegistry:
+    """
+    Routes the emails to their bank processor.
+
+    The processors are tried in the order of the specs. An index from sender
+    domain to processors is built once from the specs, so the processors whose
+    domains do not include the domain of the email are skipped, and most emails
+    only reach the processor of their bank. Unknown domains are tried with
+    every processor. Processors are only imported and created the first time
+    an email is routed to them.
+    """
+
+    def __init__(self, specs: list[ProcessorSpec]):
+        self.specs = specs
+        self._processors: dict[int, BaseBankProcessor] = {}
+        self._by_domain: dict[str, list[int]] = {}
+        for position, spec in enumerate(specs):
+            for domain in spec.sender_domains:
+                self._by_domain.setdefault(domain.lower(), []).append(position)
+
+    def _get(self, position: int) -> BaseBankProcessor:
+        processor = self._processors.get(position)
+        if processor is None:
+            module_name, _, attribute = self.specs[position].target.partition(":")
+            target = getattr(import_module(module_name), attribute)
+            if isinstance(target, BankRule):
+                processor = RuleBasedProcessor(target)
+            else:
+                processor = target()
+            self._processors[position] = processor
+        return processor
+
+    def _domain_candidates(self, domain: str) -> list[int]:
+        # Subdomains are routed to the processors of their parent domain
+        while domain:
+            candidates = self._by_domain.get(domain)
+            if candidates:
+                return candidates
+            domain = domain.partition(".")[2]
+        return []
+
+    def find(self, email: Email) -> BaseBankProcessor | None:
+        """Returns the processor of the email, None if no processor identifies it"""
+        candidates = self._domain_candidates(sender_domain(email.sender))
+        for position, spec in enumerate(self.specs):
+            if candidates and spec.sender_domains and position not in candidates:
+                continue
+            processor = self._get(position)
+            if processor.identify(email):
+                return processor
+        return None
+
+    def processors(self) -> list[BaseBankProcessor]:
+        """Returns every processor, importing the ones not loaded yet"""
+        return [self._get(position) for position in range(len(self.specs))]
@@ -0,0 +1,159 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from banks.base_bank_processor import BaseBankProcessor
+from models.transaction import Transaction, TransactionType
+from models.email import Email
+
+
+@dataclass(frozen=True)
+class FieldRule:
+    """Regex with one group extracting a field from the text of the email"""
+
+    pattern: str
+    strip: bool = False
+
+
+@dataclass(frozen=True)
+class DateRule:
+    """
+    Regex extracting the date of the transaction. The groups are joined with
+    a space, remove_chars are deleted and the result is parsed with date_format.
+    month_map translates the first word (month name) before parsing.
+    """
+
+    pattern: str
+    date_format: str
+    remove_chars: str = ""
+    month_map: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class BankRule:
+    """
+    Declarative description of the notification emails of a bank.
+
+    - sender_keywords: the email belongs to the bank if any is in the sender
+    - subject_keywords: the email is a transaction if any is in the subject
+    - dates: tried in order, the email date is used when none matches
+    - currencies: (marker, currency) pairs, the first marker found in the
+      amount is removed and the rest is the amount in that currency ('usd'/'crc')
+    """
+
+    name: str
+    sender_keywords: tuple[str, ...]
+    subject_keywords: tuple[str, ...]
+    description: FieldRule
+    amount: FieldRule
+    card: FieldRule
+    dates: tuple[DateRule, ...]
+    transaction_type: TransactionType = TransactionType.CARD_MOVEMENT
+    replacements: tuple[tuple[str, str], ...] = ()
+    collapse_newlines: bool = False
+    currencies: tuple[tuple[str, str], ...] = (("USD", "usd"), ("CRC", "crc"))
+
+
+NEWLINES = re.compile(r"\n+")
+
+
+class RuleBasedProcessor(BaseBankProcessor):
+    """
+    Processor driven by a BankRule. All the patterns of the rule are compiled
+    once when the processor is created.
+    """
+
+    def __init__(self, rule: BankRule):
+        self.rule = rule
+        self._sender_keywords = tuple(k.lower() for k in rule.sender_keywords)
+        self._subject_keywords = tuple(k.lower() for k in rule.subject_keywords)
+        self._description = re.compile(rule.description.pattern)
+        self._amount = re.compile(rule.amount.pattern)
+        self._card = re.compile(rule.card.pattern)
+        self._dates = [(re.compile(d.pattern), d) for d in rule.dates]
+
+    @property
+    def name(self) -> str:
+        return self.rule.name
+
+    def identify(self, email: Email):
+        sender = email.sender.lower()
+        return any(keyword in sender for keyword in self._sender_keywords)
+
+    def process(self, email):
+        if self._identify_transaction_type(email) == self.rule.transaction_type:
+            return self._process_transaction(email)
+        return None
+
+    def _identify_transaction_type(self, email: Email) -> TransactionType | None:
+        subject = email.subject.lower()
+        if any(keyword in subject for keyword in self._subject_keywords):
+            return self.rule.transaction_type
+        return None
+
+    def _normalize(self, text: str) -> str:
+        for old, new in self.rule.replacements:
+            text = text.replace(old, new)
+        if self.rule.collapse_newlines:
+            text = NEWLINES.sub("\n", text)
+        return text
+
+    def _get_datetime(self, text: str, email_dt_str) -> "datetime":
+        dt = BaseBankProcessor.get_default_date_time(email_dt_str)
+
+        try:
+            for regex, date_rule in self._dates:
+                match = regex.search(text)
+                if match:
+                    date_str = " ".join(match.groups())
+                    for char in date_rule.remove_chars:
+                        date_str = date_str.replace(char, "")
+                    if date_rule.month_map:
+                        parts = date_str.split()
+                        parts[0] = date_rule.month_map.get(parts[0], parts[0])
+                        date_str = " ".join(parts)
+                    dt = datetime.strptime(date_str, date_rule.date_format)
+                    return dt
+        except Exception as e:
+            print(f"Error parsing datetime of {self.name} email. Args: \n"
+                  f"text: {text}, email_dt_str: {email_dt_str}")
+            print(e)
+
+        return dt
+
+    @staticmethod
+    def _get_field(regex: re.Pattern, field_rule: FieldRule, text: str) -> str:
+        match = regex.search(text)
+        if not match:
+            return ""
+        value = match.group(1)
+        return value.strip() if field_rule.strip else value
+
+    def _process_transaction(self, email: Email) -> Transaction:
+        rule = self.rule
+        text = self._normalize(email.body)
+
+        dt = self._get_datetime(text, email.date_str)
+        description = self._get_field(self._description, rule.description, text)
+        amount_raw = self._get_field(self._amount, rule.amount, text)
+        card = self._get_field(self._card, rule.card, text)
+
+        amounts = {"usd": 0.0, "crc": 0.0}
+        for marker, currency in rule.currencies:
+            if marker in amount_raw:
+                val = amount_raw.replace(marker, "")
+                amounts[currency] = BaseBankProcessor.to_price(val)
+                break
+
+        ts = Transaction(
+            type=rule.transaction_type,
+            amount_raw=amount_raw,
+            amount_crc=amounts["crc"],
+            amount_usd=amounts["usd"],
+            description=description,
+            date_time=dt,
+            bank_name=self.name,
+            card_num=card,
+        )
+        ts.set_category()
+        return ts
@@ -0,0 +1,69 @@
+"""
+Rules of the banks whose notifications are parsed from the text of the email.
+To support a new bank of this kind add its BankRule here and its ProcessorSpec
+to PROCESSOR_SPECS in banks/__init__.py.
+"""
+
+from banks.rule_engine import BankRule, DateRule, FieldRule
+
+SPANISH_MONTHS = {
+    "Ene": "Jan",
+    "Feb": "Feb",
+    "Mar": "Mar",
+    "Abr": "Apr",
+    "May": "May",
+    "Jun": "Jun",
+    "Jul": "Jul",
+    "Ago": "Aug",
+    "Sep": "Sep",
+    "Oct": "Oct",
+    "Nov": "Nov",
+    "Dic": "Dec",
+}
+
+BAC_RULE = BankRule(
+    name="BAC",
+    sender_keywords=("notificacionesbaccr",),
+    subject_keywords=("notificación de transacción",),
+    replacements=(("\r", ""),),
+    collapse_newlines=True,
+    description=FieldRule(r"Comercio:\n(.*)\n", strip=True),
+    amount=FieldRule(r"Monto:\n(.*)\n", strip=True),
+    card=FieldRule(r"\*(\d+)\nAutorizaci", strip=True),
+    dates=(
+        DateRule(
+            r"Fecha:\s*\n?\s*([A-Za-z]{3} \d{1,2}, \d{4}, \d{1,2}:\d{2})",
+            "%b %d %Y %H:%M",
+            remove_chars=",",
+            month_map=SPANISH_MONTHS,
+        ),
+        DateRule(
+            r"Fecha:\s*\n?\s*([A-Za-z]{3} \d{1,2}, \d{4})",
+            "%b %d %Y",
+            remove_chars=",",
+            month_map=SPANISH_MONTHS,
+        ),
+    ),
+)
+
+# Scotiabank and Davibank send the same alert format
+_CARD_ALERT = dict(
+    subject_keywords=("alerta transacción tarjeta",),
+    replacements=(("&nbsp", " "),),
+    description=FieldRule(r"le notifica que la transacción realizada en (.*), el día"),
+    amount=FieldRule(r"referencia \d* por (.*), fue "),
+    card=FieldRule(r"terminada en (\d*) ", strip=True),
+    dates=(
+        DateRule(
+            r"el día (\d{2}/\d{2}/\d{4}) a las (\d{1,2}:\d{2} [AP]M)",
+            "%d/%m/%Y %I:%M %p",
+        ),
+        DateRule(r"el día (.*) a las", "%d/%m/%Y"),
+    ),
+)
+
+SCOTIABANK_RULE = BankRule(
+    name="Scotiabank", sender_keywords=("scotiabank",), **_CARD_ALERT
+)
+
+DAVIBANK_RULE = BankRule(name="Davibank", sender_keywords=("davibank",), **_CARD_ALERT)
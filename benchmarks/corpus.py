@@ -0,0 +1,281 @@
+"""
+Synthetic corpus of bank notification emails as Gmail API message resources,
+and a local fake of the Gmail service serving them.
+
+Every message is generated from its id, so a corpus of any size needs no
+memory: message i is always the same email. The corpus mixes the formats of
+every processor (BAC card notifications, BCR card tables and SINPE Movil,
+Scotiabank and Davibank alerts) with emails of other senders, with single part
+and multipart/alternative payloads and base64url encoded bodies like Gmail.
+"""
+
+import base64
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+SPANISH_MONTHS = ["Ene", "Feb", "Mar", "Abr", "May", "Jun"]
+SPANISH_MONTHS += ["Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
+MERCHANTS = [
+    "AUTO MERCADO ESCAZU",
+    "UBER TRIP",
+    "AMAZON MKTPLACE PMTS",
+    "SODA LA TIA",
+    "NETFLIX.COM",
+    "WALMART CURRIDABAT",
+    "GASOLINERA LA GALERA",
+    "FARMACIA FISCHEL",
+]
+START_DATE = datetime(2023, 1, 1, 8, 0)
+
+# Share of each kind of email in the corpus
+KINDS = [
+    ("bac", 30),
+    ("bcr_card", 15),
+    ("bcr_sinpe", 10),
+    ("scotiabank", 15),
+    ("davibank", 10),
+    ("other", 20),
+]
+
+
+def _encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def received_header(date_time: datetime) -> str:
+    """X-Received header of an email received at date_time"""
+    date = date_time.strftime("%a, %d %b %Y %H:%M:%S -0600")
+    return f"by 2002:a05:6a10:1234 with SMTP id x12csp; {date} (CST)"
+
+
+def _amount(rng: random.Random) -> str:
+    return f"{rng.uniform(500, 150_000):,.2f}"
+
+
+def bac_email(rng: random.Random, date_time: datetime) -> tuple[str, str, str]:
+    month = SPANISH_MONTHS[date_time.month - 1]
+    date = f"{month} {date_time.day}, {date_time.year}, {date_time:%H:%M}"
+    currency = rng.choice(["CRC", "USD"])
+    html = (
+        "<html><body><table>\n"
+        "<tr><td>Hola, a continuación el detalle de la transacción</td></tr>\n"
+        f"<tr><td>Comercio:</td>\n<td>{rng.choice(MERCHANTS)}</td></tr>\n"
+        f"<tr><td>Ciudad y país:</td>\n<td>SAN JOSE, Costa Rica</td></tr>\n"
+        f"<tr><td>Fecha:</td>\n<td>{date}</td></tr>\n"
+        # The card number line is followed by Autorización in the text
+        f"<tr><td>VISA</td>\n<td>************{rng.randint(1000, 9999)}\n"
+        f"Autorización:</td>\n<td>{rng.randint(100000, 999999)}</td></tr>\n"
+        f"<tr><td>Monto:</td>\n<td>{currency} {_amount(rng)}</td></tr>\n"
+        "</table></body></html>"
+    )
+    return (
+        "Notificación de transacción BAC <notificacionesbaccr@baccredomatic.com>",
+        "Notificación de transacción PURCHASE",
+        html,
+    )
+
+
+def bcr_card_email(rng: random.Random, date_time: datetime) -> tuple[str, str, str]:
+    currency = rng.choice(["COLON COSTA RICA", "US DOLLAR"])
+    status = "Negada" if rng.random() < 0.05 else "Aprobada"
+    html = (
+        "<html><body><table>"
+        "<tr><th>Fecha</th><th>Tarjeta</th><th>Autorización</th><th>Monto</th>"
+        "<th>Moneda</th><th>Comercio</th><th>Estado</th></tr>"
+        f"<tr><td>{date_time:%d/%m/%Y %H:%M}</td><td>****{rng.randint(1000, 9999)}</td>"
+        f"<td>{rng.randint(100000, 999999)}</td><td>{_amount(rng)}</td>"
+        f"<td>{currency}</td><td>{rng.choice(MERCHANTS)}</td><td>{status}</td></tr>"
+        "</table></body></html>"
+    )
+    return (
+        "BCR Tarjetas <bcrtarjestcta@bancobcr.com>",
+        "Notificación de Transacciones",
+        html,
+    )
+
+
+def bcr_sinpe_email(rng: random.Random, date_time: datetime) -> tuple[str, str, str]:
+    html = (
+        "<html><body>\n"
+        "<p>Le informamos que se realizó una transferencia SINPE Móvil</p>\n"
+        f"<p>Teléfono Destino: 8{rng.randint(1000000, 9999999)}</p>\n"
+        f"<p>Monto: {_amount(rng)}</p>\n"
+        f"<p>Realizada el {date_time:%d/%m/%Y} a las {date_time:%I:%M %p}</p>\n"
+        f"<p>Motivo: {rng.choice(['almuerzo', 'alquiler', 'cafe', 'regalo'])}</p>\n"
+        "</body></html>"
+    )
+    return (
+        "BCR Mensajero <mensajero@bancobcr.com>",
+        "Comprobante SINPEMOVIL",
+        html,
+    )
+
+
+def card_alert_email(
+    rng: random.Random, date_time: datetime, bank: str
+) -> tuple[str, str, str]:
+    currency = rng.choice(["CRC", "USD"])
+    html = (
+        "<html><body><p>"
+        f"{bank.title()} le notifica que la transacción realizada en "
+        f"{rng.choice(MERCHANTS)}, el día {date_time:%d/%m/%Y} a las "
+        f"{date_time:%I:%M %p}, con la tarjeta terminada en {rng.randint(1000, 9999)} "
+        f"con referencia {rng.randint(100000, 999999)} por {currency} {_amount(rng)}, "
+        "fue aprobada.</p>"
+        "<p>Si no reconoce esta transacción comuníquese con nosotros.</p>"
+        "</body></html>"
+    )
+    return (
+        f"Alertas {bank.title()} <alertas@{bank}.com>",
+        "Alerta transacción tarjeta",
+        html,
+    )
+
+
+def other_email(rng: random.Random, date_time: datetime) -> tuple[str, str, str]:
+    html = "<html><body>" + "<p>Newsletter content</p>" * rng.randint(5, 40)
+    html += "</body></html>"
+    return ("News <news@example.com>", "Weekly newsletter", html)
+
+
+def synthetic_message(msg_id: str, message_format: str = "full") -> dict:
+    """Gmail message resource of the corpus with the given id"""
+    index = int(msg_id)
+    rng = random.Random(index)
+    date_time = START_DATE + timedelta(minutes=37 * index)
+    kind = rng.choices([k for k, _ in KINDS], weights=[w for _, w in KINDS])[0]
+    if kind == "bac":
+        sender, subject, html = bac_email(rng, date_time)
+    elif kind == "bcr_card":
+        sender, subject, html = bcr_card_email(rng, date_time)
+    elif kind == "bcr_sinpe":
+        sender, subject, html = bcr_sinpe_email(rng, date_time)
+    elif kind in ("scotiabank", "davibank"):
+        sender, subject, html = card_alert_email(rng, date_time, kind)
+    else:
+        sender, subject, html = other_email(rng, date_time)
+
+    headers = [
+        {"name": "Delivered-To", "value": "user@gmail.com"},
+        {"name": "X-Received", "value": received_header(date_time)},
+        {"name": "From", "value": sender},
+        {"name": "Subject", "value": subject},
+        {"name": "Message-ID", "value": f"<{msg_id}.bench@mail.example.com>"},
+    ]
+    payload: dict = {"mimeType": "text/html", "headers": headers}
+    if message_format == "metadata":
+        return {"id": msg_id, "payload": payload}
+
+    if rng.random() < 0.5:
+        payload["body"] = {"size": len(html), "data": _encode(html)}
+    else:
+        payload["mimeType"] = "multipart/alternative"
+        payload["body"] = {"size": 0}
+        text = "Este mensaje requiere un cliente de correo con soporte de HTML"
+        payload["parts"] = [
+            {
+                "mimeType": "text/plain",
+                "body": {"size": len(text), "data": _encode(text)},
+            },
+            {
+                "mimeType": "text/html",
+                "body": {"size": len(html), "data": _encode(html)},
+            },
+        ]
+    return {"id": msg_id, "payload": payload, "sizeEstimate": len(html)}
+
+
+class _Request:
+    def __init__(self, service: "FakeGmailService", method: str, function):
+        self.service = service
+        self.method = method
+        self.function = function
+
+    def execute(self):
+        return self.service._round_trip(self.method, self.function)
+
+
+class _BatchRequest:
+    def __init__(self, service: "FakeGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # A batch is a single round trip answering every request
+        responses = self.service._round_trip(
+            "batch", lambda: [request.function() for _, request in self.requests]
+        )
+        for (request_id, _), response in zip(self.requests, responses):
+            self.callback(request_id, response, None)
+
+
+class FakeGmailService:
+    """
+    Local stand-in for the object returned by googleapiclient build() with the
+    methods used by gmail_client, serving a corpus of size messages.
+
+    latency is the seconds added to every round trip (a page of the list, a
+    batch request or a batchModify). stats has the amount of round trips of
+    each method and the seconds they took, including the generation of the
+    responses. It is thread safe, so the same object can be returned by the
+    service_factory of every worker.
+    """
+
+    def __init__(self, size: int, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.stats: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self, method: str, function):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        result = function()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            calls = self.stats.setdefault(method, [0, 0.0])
+            calls[0] += 1
+            calls[1] += elapsed
+        return result
+
+    # users().messages() and users().history() return the service itself
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId="me", q=None, maxResults=100, pageToken=None, **kwargs):
+        start = int(pageToken or 0)
+        end = min(self.size, start + maxResults)
+
+        def page():
+            result = {
+                "messages": [
+                    {"id": str(i), "threadId": str(i)} for i in range(start, end)
+                ]
+            }
+            if end < self.size:
+                result["nextPageToken"] = str(end)
+            return result
+
+        return _Request(self, "list", page)
+
+    def get(self, userId="me", id=None, format="full", **kwargs):
+        return _Request(self, "get", lambda: synthetic_message(id, format))
+
+    def batchModify(self, userId="me", body=None):
+        return _Request(self, "batchModify", lambda: {})
+
+    def getProfile(self, userId="me"):
+        return _Request(self, "getProfile", lambda: {"historyId": "1"})
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
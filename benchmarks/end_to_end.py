@@ -0,0 +1,210 @@
+"""
+End to end throughput of process_messages (or the asyncio pipeline) against a
+local fake Gmail service serving the synthetic corpus of benchmarks/corpus.py.
+
+    python benchmarks/end_to_end.py [--sizes 1000 10000 100000] [--json out.json]
+        [--pipeline] [--latency seconds] [-b n] [-w n] [-p n]
+
+Every size runs in its own process so the peak RSS is not shared between runs.
+Reports emails/sec, the time spent in each stage and the peak RSS, and with
+--json writes them together with the settings and the date, to keep track of
+the results over time.
+
+The stages are measured with the timers of the instrumentation module: list,
+fetch, decode, dispatch, html_parse, classify, extract (the rest of the bank
+processors) and export. With -p the times of the worker processes are added
+up. With --pipeline the stages run concurrently, so stage_seconds has the
+time of every stage of the pipeline and the timers are reported apart.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+def timer_seconds(timings: dict, name: str) -> float:
+    """Total seconds of the timer name and its details (name.detail)"""
+    return sum(
+        values[1]
+        for timer, values in timings.items()
+        if timer == name or timer.startswith(name + ".")
+    )
+
+
+def timer_stages(timings: dict) -> dict[str, float]:
+    """Seconds of every stage from the timers, which are inclusive"""
+    html_parse = timer_seconds(timings, "html_parse")
+    classify = timer_seconds(timings, "classify")
+    process = timer_seconds(timings, "process")
+    return {
+        "list": timer_seconds(timings, "list"),
+        "fetch": timer_seconds(timings, "fetch"),
+        "decode": timer_seconds(timings, "decode"),
+        "dispatch": timer_seconds(timings, "dispatch"),
+        "html_parse": html_parse,
+        "classify": classify,
+        # The bank processors without the html parse and classification
+        "extract": max(0.0, process - html_parse - classify),
+        "export": timer_seconds(timings, "export"),
+    }
+
+
+def run_once(size: int, settings: dict) -> dict:
+    import instrumentation
+    from corpus import FakeGmailService
+    from gmail_client import list_messages
+    from main import OperationMode, process_messages
+    from models.transaction_store import TransactionStore
+    from pipeline import Pipeline
+
+    service = FakeGmailService(size, settings["latency"])
+    store = TransactionStore()
+    instrumentation.configure(True)
+    instrumentation.reset()
+    started = time.perf_counter()
+    messages = list_messages(service, "label:Bancos")
+    # The progress messages are not part of the measure
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if settings["pipeline"]:
+            stats = Pipeline(
+                lambda: service,
+                messages,
+                store,
+                batch_size=settings["batch_size"],
+                fetch_workers=settings["workers"],
+                processes=settings["processes"],
+            ).run()
+            stages = dict(stats.stage_seconds)
+        else:
+            process_messages(
+                service,
+                store,
+                messages,
+                OperationMode.DEV,
+                settings["batch_size"],
+                settings["workers"],
+                lambda: service,
+                processes=settings["processes"],
+            )
+    elapsed = time.perf_counter() - started
+
+    round_trips = {
+        method: {"calls": calls, "seconds": round(seconds, 4)}
+        for method, (calls, seconds) in service.stats.items()
+    }
+    timings = instrumentation.snapshot()["timings"]
+    timers = timer_stages(timings)
+    if not settings["pipeline"]:
+        stages = timers
+    # Everything done with a fetched email until its transaction is appended
+    parse_seconds = (
+        timers["decode"] + timers["dispatch"] + timer_seconds(timings, "process")
+    )
+    batches = round_trips.get("batch", {}).get("calls", 0)
+    return {
+        "messages": size,
+        "transactions": len(store),
+        "seconds": round(elapsed, 3),
+        "emails_per_second": round(size / elapsed, 1) if elapsed else None,
+        "stage_seconds": {stage: round(s, 3) for stage, s in stages.items()},
+        "latency_ms": {
+            "batch": (
+                round(1000 * round_trips["batch"]["seconds"] / batches, 3)
+                if batches
+                else None
+            ),
+            "parse_per_email": round(1000 * parse_seconds / size, 3),
+        },
+        "timers": {stage: round(s, 3) for stage, s in timers.items()},
+        "round_trips": round_trips,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--json", help="file where the results are written")
+    parser.add_argument("--pipeline", action="store_true")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per round trip"
+    )
+    parser.add_argument("-b", dest="batch_size", type=int, default=50)
+    parser.add_argument("-w", dest="workers", type=int, default=1)
+    parser.add_argument("-p", dest="processes", type=int, default=1)
+    # Internal: runs a single size and prints its result as json
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    settings = {
+        "pipeline": args.pipeline,
+        "latency": args.latency,
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "processes": args.processes,
+    }
+
+    if args.run_one is not None:
+        print(json.dumps(run_once(args.run_one, settings)))
+        return
+
+    results = []
+    for size in args.sizes:
+        command = [sys.executable, os.path.abspath(__file__), "--run-one", str(size)]
+        command += ["--latency", str(args.latency), "-b", str(args.batch_size)]
+        command += ["-w", str(args.workers), "-p", str(args.processes)]
+        if args.pipeline:
+            command.append("--pipeline")
+        output = subprocess.run(
+            command, capture_output=True, text=True, check=True, cwd=ROOT
+        )
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        results.append(result)
+        stages = ", ".join(f"{k} {v:.2f}s" for k, v in result["stage_seconds"].items())
+        print(
+            f"{size:>8} emails: {result['emails_per_second']:>9.1f} emails/s, "
+            f"{result['seconds']:.2f}s ({stages}), "
+            f"peak RSS {result['peak_rss_mb'] or 0:.1f}MB"
+        )
+
+    if args.json:
+        report = {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": settings,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares the export of synthetic transactions with the streaming .xlsx sink and
+the legacy xlwt .xls export: wall time and peak python memory (tracemalloc).
+The time includes generating the transactions.
+
+    python benchmarks/export_benchmark.py [rows]
+
+The .xls export is measured both as before the streaming sinks, building the
+whole workbook and saving it once (export_to_xls), and with XlsSink, which
+saves it again every XLS_FLUSH_EVERY rows. xlwt is limited to 65536 rows per
+sheet, so they are measured with at most 65535 transactions, and skipped when
+xlwt is not installed.
+
+With 65535 rows on a shared single CPU VM: xlsx 2.3s and 1MB of peak memory,
+xls.save 5.9s and 111MB, xls.sink 10.3s and 111MB.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exporter  # noqa: E402
+from exporter import XlsSink, XlsxSink  # noqa: E402
+from models.transaction import Transaction, TransactionType  # noqa: E402
+
+DEFAULT_ROWS = 100_000
+XLS_MAX_ROWS = 65_535
+MERCHANTS = ["AUTO MERCADO", "UBER TRIP", "AMAZON MKTPLACE", "SODA TIA", "NETFLIX"]
+
+
+def synthetic_transactions(rows: int):
+    start = datetime(2024, 1, 1)
+    rng = random.Random(0)
+    for i in range(rows):
+        amount = round(rng.uniform(500, 90_000), 2)
+        yield Transaction(
+            type=TransactionType.CARD_MOVEMENT,
+            amount_crc=amount,
+            amount_usd=0.0,
+            description=f"{rng.choice(MERCHANTS)} {i % 97}",
+            date_time=start + timedelta(minutes=7 * i),
+            card_num=str(1000 + i % 4),
+            bank_name=rng.choice(["BAC", "BCR", "Scotiabank", "Davibank"]),
+            amount_raw=f"CRC {amount:,.2f}",
+            category="Food",
+        )
+
+
+def export(new_sink, file_name: str, rows: int) -> None:
+    with new_sink(file_name, rows) as sink:
+        for transaction in synthetic_transactions(rows):
+            sink.append(transaction)
+
+
+def measure(name: str, new_sink, rows: int, directory: str) -> None:
+    """
+    Exports once for the time and once more under tracemalloc for the memory.
+    new_sink is called with the file name and the amount of rows
+    """
+    file_name = os.path.join(directory, name)
+    started = time.perf_counter()
+    export(new_sink, file_name, rows)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    export(new_sink, file_name, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = os.path.getsize(file_name)
+    print(
+        f"{name:<10} rows={rows:>8} time={elapsed:7.2f}s "
+        f"peak={peak / 2**20:7.1f}MB file={size / 2**20:6.1f}MB"
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    with tempfile.TemporaryDirectory() as directory:
+        measure("xlsx", lambda name, rows: XlsxSink(name), rows, directory)
+        if exporter.xlwt is None:
+            print("xlwt is not installed, skipping the .xls export")
+            return
+        xls_rows = min(rows, XLS_MAX_ROWS)
+        # A single save at the end, like export_to_xls
+        measure(
+            "xls.save",
+            lambda name, rows: XlsSink(name, flush_every=rows + 1),
+            xls_rows,
+            directory,
+        )
+        measure("xls.sink", lambda name, rows: XlsSink(name), xls_rows, directory)
+
+
+if __name__ == "__main__":
+    main()
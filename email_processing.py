@@ -0,0 +1,102 @@
+"""
+Processing of a single email into a transaction, shared by the Gmail and the
+offline sources. It does not depend on the Gmail API so it can run in worker
+processes.
+"""
+
+from typing import Iterable, Iterator
+
+import instrumentation
+from banks import find_processor
+from models.email import Email, has_gmail_body
+from models.transaction import Transaction
+from models.transaction_store import TransactionStore
+from parse_pool import DEFAULT_CHUNK_SIZE, map_in_processes
+
+
+def process_email(
+    email: Email, processed_transactions: list[Transaction] | TransactionStore
+) -> bool:
+    try:
+        instrumentation.count("emails")
+        with instrumentation.timer("dispatch"):
+            processor = find_processor(email)
+        if processor is not None:
+            instrumentation.count("bank_emails")
+            with instrumentation.timer("process", processor.name):
+                transaction = processor.process(email)
+            if transaction:
+                instrumentation.count("transactions")
+                transaction.message_id = email.message_id
+                processed_transactions.append(transaction)
+            return True
+        return False
+    except Exception as e:
+        print(f"Error processing email. Skiping email: {email}. Error: {e}")
+        return False
+
+
+def needs_body(email: Email) -> bool:
+    """
+    Returns True if the body of the email is needed to process it, this is when
+    the bank processor identifying it supports its type of transaction.
+    """
+    processor = find_processor(email)
+    return processor is not None and processor.supports(email)
+
+
+def parse_gmail_message(msg_data: dict) -> tuple[bool, list[Transaction]]:
+    """
+    Decodes and processes a Gmail message resource.
+    Returns if it was a bank email and its transactions.
+    """
+    # Only the headers are available when the body was not needed
+    current_email = Email.from_gmail_message(msg_data, has_gmail_body(msg_data))
+    transactions: list[Transaction] = []
+    success = process_email(current_email, transactions)
+    return success, transactions
+
+
+def parse_gmail_chunk(
+    items: list[tuple[str, dict | None]],
+) -> list[tuple[bool | None, list[tuple]]]:
+    """
+    parse_gmail_message for a chunk of (message_id, msg_data), runs in the
+    worker processes. The transactions are returned as records (to_record) to
+    keep the results small. success is None for the messages without data.
+    """
+    results = []
+    for _, msg_data in items:
+        if msg_data is None:
+            results.append((None, []))
+            continue
+        success, transactions = parse_gmail_message(msg_data)
+        results.append((success, [ts.to_record() for ts in transactions]))
+    return results
+
+
+def parse_gmail_messages(
+    fetched: Iterable[tuple[str, dict | None]],
+    processes: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple[str, bool | None, list[Transaction]]]:
+    """
+    Parses the fetched (message_id, msg_data) and yields (message_id, success,
+    transactions) in the same order. With more than one process the parsing
+    runs in a process pool, while the fetch keeps running on its own threads.
+    success is None for the messages that could not be downloaded.
+    """
+    if processes <= 1:
+        for msg_id, msg_data in fetched:
+            if msg_data is None:
+                yield msg_id, None, []
+                continue
+            success, transactions = parse_gmail_message(msg_data)
+            yield msg_id, success, transactions
+        return
+
+    for chunk, results in map_in_processes(
+        parse_gmail_chunk, fetched, chunk_size, processes
+    ):
+        for (msg_id, _), (success, records) in zip(chunk, results):
+            yield msg_id, success, [Transaction.from_record(r) for r in records]
@@ -3,86 +3,341 @@ Exporter module of transactions to xlsx or csv formats
 """
 
 import csv
+import io
+import os
+from abc import ABC, abstractmethod
 from datetime import datetime
+from typing import Iterable, Sequence
 
-import xlwt
-
+import instrumentation
 from models.transaction import Transaction
+from xlsx_writer import STYLE_AMOUNT, STYLE_DATE, STYLE_DEFAULT, XlsxWriter
 
+# Only needed for the legacy .xls export
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
 
-def export_to_csv(transaction_list: list[Transaction]) -> None:
-    print("Exporting", len(transaction_list), "transaction emails")
-    headers = [
-        "Date",
-        "Description",
-        "Category",
-        "Price",
-        "Price USD",
-        "Price CRC",
-        "Bank",
-        "Card",
+HEADERS = [
+    "Date",
+    "Description",
+    "Category",
+    "Price",
+    "Price USD",
+    "Price CRC",
+    "Bank",
+    "Card",
+]
+# Cell format of every column of HEADERS in the xlsx export
+XLSX_STYLES = [
+    STYLE_DATE,
+    STYLE_DEFAULT,
+    STYLE_DEFAULT,
+    STYLE_DEFAULT,
+    STYLE_AMOUNT,
+    STYLE_AMOUNT,
+    STYLE_DEFAULT,
+    STYLE_DEFAULT,
+]
+DEFAULT_CSV_FILE = "Emails_output.csv"
+# Rows written between each flush of the streaming sinks
+CSV_FLUSH_EVERY = 100
+# Each flush of the xls sink saves the whole workbook again
+XLS_FLUSH_EVERY = 10_000
+
+
+def transaction_row(ts: Transaction) -> list:
+    return [
+        ts.date,
+        ts.description,
+        ts.category,
+        ts.amount_raw,
+        ts.amount_usd,
+        ts.amount_crc,
+        ts.bank_name,
+        ts.card_num,
     ]
-    if transaction_list == []:
+
+
+def typed_transaction_row(ts: Transaction) -> list:
+    """Same as transaction_row with the date as a datetime instead of a string"""
+    return [
+        ts.date_time,
+        ts.description,
+        ts.category,
+        ts.amount_raw,
+        ts.amount_usd,
+        ts.amount_crc,
+        ts.bank_name,
+        ts.card_num,
+    ]
+
+
+def default_xls_file() -> str:
+    timestamp = datetime.today().strftime("%Y-%m-%d")
+    return f"Finance-{timestamp}.xls"
+
+
+def default_xlsx_file() -> str:
+    return default_xls_file() + "x"
+
+
+class TransactionSink(ABC):
+    """
+    Destination where the transactions are written as soon as they are processed.
+
+    Sinks can be used wherever a list of transactions is expected to be
+    appended to (like process_email). The file is only created when the first
+    transaction is written, and it is flushed every flush_every transactions so
+    a crash leaves a valid file with the rows written until the last flush.
+    """
+
+    def __init__(self, file_name: str, flush_every: int):
+        self.file_name = file_name
+        self.flush_every = flush_every
+        self.count = 0
+        self._pending = 0
+        self._opened = False
+
+    def append(self, ts: Transaction) -> None:
+        with instrumentation.timer("export"):
+            if not self._opened:
+                self._open()
+                self._opened = True
+            self._write(ts)
+            self.count += 1
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self.flush()
+
+    def extend(self, transactions: Iterable[Transaction]) -> None:
+        for ts in transactions:
+            self.append(ts)
+
+    def flush(self) -> None:
+        if self._opened and self._pending:
+            self._flush()
+        self._pending = 0
+
+    def close(self) -> None:
+        """Flushes the pending rows and closes the file"""
+        if self._opened:
+            with instrumentation.timer("export", "close"):
+                self._flush()
+                self._close()
+            self._opened = False
+        self._pending = 0
+
+    def __enter__(self) -> "TransactionSink":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    @abstractmethod
+    def _open(self) -> None:
+        """Creates the file, called before the first transaction is written"""
+
+    @abstractmethod
+    def _write(self, ts: Transaction) -> None:
+        """Writes a transaction, it may stay buffered until the next _flush"""
+
+    @abstractmethod
+    def _flush(self) -> None:
+        """Writes the buffered transactions to the file"""
+
+    def _close(self) -> None:
+        pass
+
+
+class CsvSink(TransactionSink):
+    """
+    Streams the transactions to a csv file. The rows are buffered in memory and
+    written as whole rows on each flush, so the file never ends with half a row.
+    """
+
+    def __init__(
+        self, file_name: str = DEFAULT_CSV_FILE, flush_every: int = CSV_FLUSH_EVERY
+    ):
+        super().__init__(file_name, flush_every)
+        self._file = None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _open(self) -> None:
+        self._file = open(self.file_name, "w", newline="", encoding="utf-8")
+        self._writer.writerow(HEADERS)
+
+    def _write(self, ts: Transaction) -> None:
+        self._writer.writerow(transaction_row(ts))
+
+    def _flush(self) -> None:
+        self._file.write(self._buffer.getvalue())
+        self._file.flush()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def _close(self) -> None:
+        self._file.close()
+        self._file = None
+
+
+class XlsSink(TransactionSink):
+    """
+    Writes the transactions to a legacy .xls workbook with xlwt. xlwt can only
+    save the whole workbook, so each flush saves it again, to a temporary file
+    that then replaces the previous save. A crash during a save leaves the
+    previous one.
+    """
+
+    def __init__(
+        self, file_name: str | None = None, flush_every: int = XLS_FLUSH_EVERY
+    ):
+        super().__init__(file_name or default_xls_file(), flush_every)
+        self._wb = None
+        self._ws = None
+        self._reports = []
+
+    def add_reports(self, reports) -> None:
+        """
+        reports are ReportTable objects from the reporting module, each one is
+        written to an extra sheet when the sink is closed
+        """
+        self._reports.extend(reports)
+
+    def _open(self) -> None:
+        if xlwt is None:
+            raise ImportError("xlwt is required for the .xls export")
+        self._wb = xlwt.Workbook()
+        self._ws = self._wb.add_sheet("Email Data")
+        for j, val in enumerate(HEADERS):
+            self._ws.write(0, j, val)
+
+    def _write(self, ts: Transaction) -> None:
+        for j, val in enumerate(transaction_row(ts)):
+            self._ws.write(self.count + 1, j, val)
+
+    def _flush(self) -> None:
+        self._save()
+
+    def _save(self) -> None:
+        temporary_file = self.file_name + ".tmp"
+        self._wb.save(temporary_file)
+        os.replace(temporary_file, self.file_name)
+
+    def _close(self) -> None:
+        if self._reports:
+            for report in self._reports:
+                report_ws = self._wb.add_sheet(report.name)
+                for j, val in enumerate(report.headers):
+                    report_ws.write(0, j, val)
+                for i, row in enumerate(report.rows):
+                    for j, val in enumerate(row):
+                        report_ws.write(i + 1, j, val)
+            self._save()
+        self._wb = None
+        self._ws = None
+
+
+class XlsxSink(TransactionSink):
+    """
+    Streams the transactions to an .xlsx workbook in constant memory, with the
+    dates and amounts as typed cells. When the sheet is full the rows continue
+    on a new sheet. The workbook is only valid once closed, so it is written to
+    a temporary file that replaces file_name on close. A crash leaves the
+    previous workbook untouched.
+    """
+
+    def __init__(self, file_name: str | None = None, max_rows: int | None = None):
+        # Rows go straight to the compressed file, there is nothing to flush
+        super().__init__(file_name or default_xlsx_file(), flush_every=1_000_000)
+        self.max_rows = max_rows
+        self._writer = None
+        self._reports = []
+
+    def add_reports(self, reports) -> None:
+        """
+        reports are ReportTable objects from the reporting module, each one is
+        written to an extra sheet when the sink is closed
+        """
+        self._reports.extend(reports)
+
+    def _open(self) -> None:
+        temporary_file = self.file_name + ".tmp"
+        if self.max_rows is None:
+            self._writer = XlsxWriter(temporary_file)
+        else:
+            self._writer = XlsxWriter(temporary_file, self.max_rows)
+        self._writer.add_sheet("Email Data", HEADERS, XLSX_STYLES)
+
+    def _write(self, ts: Transaction) -> None:
+        self._writer.write_row(typed_transaction_row(ts))
+
+    def _flush(self) -> None:
+        pass
+
+    def _close(self) -> None:
+        for report in self._reports:
+            self._writer.add_sheet(report.name, report.headers)
+            self._writer.write_rows(report.rows)
+        self._writer.close()
+        os.replace(self._writer.file_name, self.file_name)
+        self._writer = None
+
+
+class MultiSink:
+    """Appends every transaction to several destinations (lists, stores or sinks)"""
+
+    def __init__(self, *targets):
+        self.targets = targets
+
+    def append(self, ts: Transaction) -> None:
+        for target in self.targets:
+            target.append(ts)
+
+
+def export_to_csv(transaction_list: Sequence[Transaction]) -> None:
+    print("Exporting", len(transaction_list), "transaction emails")
+    if len(transaction_list) == 0:
         print("No data to export")
         return
-    with open("Emails_output.csv", "w", newline="", encoding="utf-8") as f:
-        csv_writer = csv.writer(f)
-        csv_writer.writerow(headers)
-        for ts in transaction_list:
-            temp_row = [
-                ts.date,
-                ts.description,
-                ts.category,
-                ts.amount_raw,
-                ts.amount_usd,
-                ts.amount_crc,
-                ts.bank_name,
-                ts.card_num,
-            ]
-            csv_writer.writerow(temp_row)
+    with CsvSink() as sink:
+        sink.extend(transaction_list)
 
     print("Finished exporting!\n")
     return
 
 
-def export_to_xlsx(transaction_list: list[Transaction]) -> None:
+def export_to_xlsx(transaction_list: Sequence[Transaction], reports=None) -> None:
+    """
+    Exports the transactions to an .xlsx workbook. reports are ReportTable
+    objects from the reporting module, each written to an extra sheet.
+    """
     print("Exporting", len(transaction_list), "transaction emails")
 
-    if transaction_list == []:
+    if len(transaction_list) == 0:
         print("No data to export")
         return
 
-    wb = xlwt.Workbook()
-    ws = wb.add_sheet("Email Data")
-
-    headers = [
-        "Date",
-        "Description",
-        "Category",
-        "Price",
-        "Price USD",
-        "Price CRC",
-        "Bank",
-        "Card",
-    ]
-    for j, val in enumerate(headers):
-        ws.write(0, j, val)
-
-    for i, ts in enumerate(transaction_list):
-        temp_row = [
-            ts.date,
-            ts.description,
-            ts.category,
-            ts.amount_raw,
-            ts.amount_usd,
-            ts.amount_crc,
-            ts.bank_name,
-            ts.card_num,
-        ]
-        for j, val in enumerate(temp_row):
-            ws.write(i + 1, j, val)
+    with XlsxSink() as sink:
+        sink.add_reports(reports or [])
+        sink.extend(transaction_list)
+    print("Finished exporting!\n")
+    return
 
-    timestamp = datetime.today().strftime("%Y-%m-%d")
-    wb.save(f"Finance-{timestamp}.xls")
+
+def export_to_xls(transaction_list: Sequence[Transaction], reports=None) -> None:
+    """Same as export_to_xlsx in the legacy .xls format, limited to 65536 rows"""
+    print("Exporting", len(transaction_list), "transaction emails")
+
+    if len(transaction_list) == 0:
+        print("No data to export")
+        return
+
+    # The workbook is saved once at the end
+    with XlsSink(flush_every=len(transaction_list) + 1) as sink:
+        sink.add_reports(reports or [])
+        sink.extend(transaction_list)
     print("Finished exporting!\n")
     return
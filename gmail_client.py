@@ -0,0 +1,435 @@
+"""
+Helpers around the Gmail API to reduce the number of round trips needed to
+retrieve the bank emails
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from googleapiclient.errors import HttpError
+
+import instrumentation
+
+# Maximum page size accepted by users.messages.list
+MAX_PAGE_SIZE = 500
+# Gmail rejects batches bigger than 100 requests and recommends to keep them
+# at 50 or less to avoid rate limit errors
+DEFAULT_BATCH_SIZE = 50
+MAX_BATCH_SIZE = 100
+DEFAULT_WORKERS = 1
+
+# Formats of users.messages.get. The metadata format only returns the headers
+# needed to identify the bank and the type of transaction
+FORMAT_FULL = "full"
+FORMAT_METADATA = "metadata"
+METADATA_HEADERS = ["From", "Subject", "X-Received", "Message-ID"]
+# Maximum amount of ids accepted by users.messages.batchModify
+MAX_BATCH_MODIFY_IDS = 1000
+
+# Gmail per-user quota and the cost in quota units of each method used.
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS_PER_SECOND = 250
+QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "history.list": 2,
+    "labels.list": 1,
+    "users.getProfile": 1,
+}
+
+# Errors worth retrying: rate limit exceeded and transient server errors
+RETRIABLE_STATUS = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 32
+
+
+class RateLimiter:
+    """
+    Token bucket that limits the Gmail quota units spent per second.
+    It is shared between threads, acquire blocks until enough units are available.
+    """
+
+    def __init__(self, units_per_second: float = QUOTA_UNITS_PER_SECOND):
+        self.units_per_second = units_per_second
+        self.capacity = units_per_second
+        self._tokens = float(units_per_second)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float) -> None:
+        # Requests bigger than the bucket are consumed in several refills
+        while units > 0:
+            step = min(units, self.capacity)
+            self._acquire_step(step)
+            units -= step
+
+    def _acquire_step(self, units: float) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._last
+                self._tokens = min(
+                    self.capacity, self._tokens + elapsed * self.units_per_second
+                )
+                self._last = now
+                if self._tokens >= units:
+                    self._tokens -= units
+                    return
+                wait = (units - self._tokens) / self.units_per_second
+            time.sleep(wait)
+
+
+def is_retriable(error: Exception) -> bool:
+    """Returns True for rate limit and transient server errors of the Gmail API"""
+    return isinstance(error, HttpError) and int(error.resp.status) in RETRIABLE_STATUS
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given retry attempt (starting at 0)"""
+    return min(2**attempt, MAX_BACKOFF_SECONDS) + random.random()
+
+
+def execute_with_backoff(
+    request, units: int = 0, limiter: RateLimiter | None = None
+) -> dict:
+    """
+    Executes a single Gmail API request, retrying it with exponential backoff
+    when it fails with a 429 or 5xx error.
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(units)
+        try:
+            return request.execute()
+        except HttpError as error:
+            if not is_retriable(error) or attempt >= MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+def list_messages(
+    service,
+    query: str,
+    limit: int | None = None,
+    page_size: int = MAX_PAGE_SIZE,
+    limiter: RateLimiter | None = None,
+) -> Iterator[dict]:
+    """
+    Lists the messages matching the search query following the nextPageToken of
+    every page, so the results are not capped by the page size.
+
+    Each message reference ({"id": ..., "threadId": ...}) is yielded as soon as
+    its page arrives. When limit is given no more than limit messages are yielded
+    and no extra pages are requested.
+    """
+    page_token = None
+    listed = 0
+    while True:
+        max_results = page_size
+        if limit is not None:
+            if listed >= limit:
+                return
+            max_results = min(page_size, limit - listed)
+
+        request = (
+            service.users()
+            .messages()
+            .list(userId="me", q=query, maxResults=max_results, pageToken=page_token)
+        )
+        with instrumentation.timer("list"):
+            result = execute_with_backoff(
+                request, QUOTA_UNITS["messages.list"], limiter
+            )
+        for msg in result.get("messages", []):
+            yield msg
+            listed += 1
+
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def get_history_id(service, limiter: RateLimiter | None = None) -> str:
+    """Returns the current history id of the mailbox"""
+    request = service.users().getProfile(userId="me")
+    profile = execute_with_backoff(request, QUOTA_UNITS["users.getProfile"], limiter)
+    return profile["historyId"]
+
+
+def get_label_id(
+    service, name: str, limiter: RateLimiter | None = None
+) -> str | None:
+    """Returns the id of the label with the given name, or None if it does not exist"""
+    request = service.users().labels().list(userId="me")
+    labels = execute_with_backoff(request, QUOTA_UNITS["labels.list"], limiter)
+    for label in labels.get("labels", []):
+        if label["name"].lower() == name.lower():
+            return label["id"]
+    return None
+
+
+def is_history_expired(error: Exception) -> bool:
+    """Gmail answers 404 when the start history id is too old or invalid"""
+    return isinstance(error, HttpError) and int(error.resp.status) == 404
+
+
+def list_history_messages(
+    service,
+    start_history_id: str,
+    label_id: str | None = None,
+    limiter: RateLimiter | None = None,
+) -> Iterator[dict]:
+    """
+    Lists the messages added to the mailbox (or that got the label label_id)
+    since start_history_id, following the nextPageToken of every page.
+
+    The first page is requested before returning, so an expired history id
+    raises the HttpError right away (see is_history_expired) instead of when
+    the messages are consumed. Each message is yielded once.
+    """
+
+    def request_page(page_token: str | None) -> dict:
+        request = (
+            service.users()
+            .history()
+            .list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded", "labelAdded"],
+                labelId=label_id,
+                pageToken=page_token,
+            )
+        )
+        with instrumentation.timer("list"):
+            return execute_with_backoff(request, QUOTA_UNITS["history.list"], limiter)
+
+    def messages(page: dict) -> Iterator[dict]:
+        seen: set[str] = set()
+        while True:
+            for record in page.get("history", []):
+                added = record.get("messagesAdded", [])
+                # Only the records adding label_id, not other labels of the message
+                added += [
+                    change
+                    for change in record.get("labelsAdded", [])
+                    if label_id is None or label_id in change.get("labelIds", [])
+                ]
+                for change in added:
+                    msg = change["message"]
+                    if msg["id"] not in seen:
+                        seen.add(msg["id"])
+                        yield {"id": msg["id"], "threadId": msg.get("threadId")}
+
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return
+            page = request_page(page_token)
+
+    return messages(request_page(None))
+
+
+def _fetch_batch(
+    service,
+    chunk: list[str],
+    limiter: RateLimiter | None = None,
+    message_format: str = FORMAT_FULL,
+) -> list[dict | None]:
+    """
+    Retrieves the messages of chunk with one batch request, in the given format.
+    Items failing with a retriable error are sent again in a new batch after
+    an exponential backoff, other failures are reported and returned as None.
+    """
+    responses: list[dict | None] = [None] * len(chunk)
+    pending = list(range(len(chunk)))
+    attempt = 0
+
+    while pending:
+        retry: list[int] = []
+
+        def callback(request_id, response, exception):
+            position = int(request_id)
+            if exception is None:
+                responses[position] = response
+            elif is_retriable(exception) and attempt < MAX_RETRIES:
+                retry.append(position)
+            else:
+                print(
+                    f"Error fetching email {chunk[position]}. Skiping email. Error: {exception}"
+                )
+
+        if limiter is not None:
+            limiter.acquire(QUOTA_UNITS["messages.get"] * len(pending))
+        batch = service.new_batch_http_request(callback=callback)
+        for position in pending:
+            # The position is used as request id since message ids could repeat
+            batch.add(
+                _get_request(service, chunk[position], message_format),
+                request_id=str(position),
+            )
+        instrumentation.count("fetched_messages", len(pending))
+        try:
+            with instrumentation.timer("fetch"):
+                batch.execute()
+        except HttpError as error:
+            # The whole batch request failed, every pending item is retried
+            if not is_retriable(error) or attempt >= MAX_RETRIES:
+                raise
+            retry = pending
+
+        pending = sorted(retry)
+        if pending:
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    return responses
+
+
+def _get_request(service, msg_id: str, message_format: str):
+    if message_format == FORMAT_METADATA:
+        return (
+            service.users()
+            .messages()
+            .get(
+                userId="me",
+                id=msg_id,
+                format=FORMAT_METADATA,
+                metadataHeaders=METADATA_HEADERS,
+            )
+        )
+    return service.users().messages().get(userId="me", id=msg_id)
+
+
+def fetch_messages(
+    service,
+    message_ids: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    limiter: RateLimiter | None = None,
+    message_format: str = FORMAT_FULL,
+) -> Iterator[tuple[str, dict | None]]:
+    """
+    Retrieves the messages for the given ids using the Gmail batch endpoint.
+    With FORMAT_METADATA only the METADATA_HEADERS are retrieved.
+
+    Yields (message_id, msg_data) in the same order as message_ids. When a single
+    request of the batch fails msg_data is None and the error is reported, the
+    rest of the batch is not affected. message_ids is consumed lazily, so a
+    batch is sent as soon as enough ids are available.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    message_ids = iter(message_ids)
+
+    while True:
+        chunk = list(islice(message_ids, batch_size))
+        if not chunk:
+            return
+        yield from zip(chunk, _fetch_batch(service, chunk, limiter, message_format))
+
+
+def fetch_messages_concurrently(
+    service_factory: Callable[[], object],
+    message_ids: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    limiter: RateLimiter | None = None,
+    message_format: str = FORMAT_FULL,
+) -> Iterator[tuple[str, dict | None]]:
+    """
+    Same as fetch_messages but the batches are requested by a pool of worker
+    threads, so the caller can parse the emails already received while the
+    next batches are downloaded.
+
+    The Gmail service object is not thread safe, service_factory is called once
+    per worker thread to build its own service. The results are yielded in the
+    same order as message_ids.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    message_ids = iter(message_ids)
+    thread_data = threading.local()
+
+    def fetch_chunk(chunk: list[str]) -> list[dict | None]:
+        if not hasattr(thread_data, "service"):
+            thread_data.service = service_factory()
+        return _fetch_batch(thread_data.service, chunk, limiter, message_format)
+
+    # Only a bounded amount of batches is requested ahead of the consumer
+    max_in_flight = workers * 2
+    in_flight: deque = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(in_flight) < max_in_flight:
+                chunk = list(islice(message_ids, batch_size))
+                if not chunk:
+                    break
+                in_flight.append((chunk, executor.submit(fetch_chunk, chunk)))
+            if not in_flight:
+                return
+            chunk, future = in_flight.popleft()
+            yield from zip(chunk, future.result())
+
+
+def fetch_messages_two_phase(
+    message_ids: Iterable[str],
+    fetch: Callable[[Iterable[str], str], Iterator[tuple[str, dict | None]]],
+    needs_body: Callable[[dict], bool],
+    window: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[tuple[str, dict | None]]:
+    """
+    Retrieves first only the metadata of the messages, and then the full message
+    of the ones where needs_body(metadata) is True. fetch is one of the fetch
+    functions above receiving the ids and the format.
+
+    Yields (message_id, msg_data) in the same order as message_ids, where
+    msg_data is the full message or only the metadata when the body was not needed.
+    The full messages are requested together for every window of messages.
+    """
+    metadata = fetch(message_ids, FORMAT_METADATA)
+    while True:
+        items = list(islice(metadata, window))
+        if not items:
+            return
+        to_download = [
+            msg_id
+            for msg_id, msg_data in items
+            if msg_data is not None and needs_body(msg_data)
+        ]
+        full = dict(fetch(to_download, FORMAT_FULL)) if to_download else {}
+        for msg_id, msg_data in items:
+            yield msg_id, full.get(msg_id, msg_data)
+
+
+def mark_as_read(
+    service, message_ids: list[str], limiter: RateLimiter | None = None
+) -> list[str]:
+    """
+    Removes the UNREAD label of the given messages with batchModify requests of
+    up to MAX_BATCH_MODIFY_IDS ids. Each chunk is retried on its own with
+    exponential backoff. Returns the ids that could not be updated.
+    """
+    failed: list[str] = []
+    for start in range(0, len(message_ids), MAX_BATCH_MODIFY_IDS):
+        chunk = message_ids[start : start + MAX_BATCH_MODIFY_IDS]
+        request = (
+            service.users()
+            .messages()
+            .batchModify(
+                userId="me", body={"ids": chunk, "removeLabelIds": ["UNREAD"]}
+            )
+        )
+        try:
+            with instrumentation.timer("mark_as_read"):
+                execute_with_backoff(
+                    request, QUOTA_UNITS["messages.batchModify"], limiter
+                )
+        except Exception as e:
+            print(f"Error marking {len(chunk)} emails as READ. Error: {e}")
+            failed.extend(chunk)
+    return failed
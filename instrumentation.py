@@ -0,0 +1,287 @@
+"""
+Timers and counters around the stages of a run (list, fetch, decode, html
+parse, processor dispatch, each bank's process, classification, mark as read
+and export), to find where a slow run spends its time.
+
+Disabled by default: timer returns a shared no-op context manager and count
+returns right away, so the instrumented code only pays a function call. When
+enabled, every timer keeps its calls, total and a histogram of durations in
+power of two buckets, printed by print_summary. With tracing every timed span
+is also kept and can be written as a Chrome trace (chrome://tracing, Perfetto).
+
+The timers are inclusive: the process of a bank includes the html parse and
+the classification done inside it.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+
+# Timed spans kept for the trace, at most this many
+MAX_TRACE_EVENTS = 2_000_000
+PROFILE_TOP_FUNCTIONS = 25
+# ASCII levels of the histogram bars, from empty to the most populated bucket
+HISTOGRAM_LEVELS = " .:-=+*#%@"
+
+enabled = False
+tracing = False
+
+_NULL_TIMER = nullcontext()
+_lock = threading.Lock()
+_timings: dict[str, "TimingStat"] = {}
+_counters: dict[str, int] = {}
+_events: list[tuple] = []
+_profiler: cProfile.Profile | None = None
+
+
+class TimingStat:
+    """Calls, total seconds and histogram of the durations of a timer"""
+
+    __slots__ = ("calls", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        # Bucket b has the durations in [2^(b-1), 2^b) microseconds
+        self.buckets: dict[int, int] = {}
+
+    def add(self, seconds: float) -> None:
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1_000_000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: "TimingStat") -> None:
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for bucket, calls in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + calls
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in seconds of the bucket holding the percentile"""
+        target = fraction * self.calls
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(2**bucket / 1_000_000, self.max)
+        return self.max
+
+    def to_tuple(self) -> tuple:
+        return self.calls, self.total, self.max, self.buckets
+
+    @classmethod
+    def from_tuple(cls, values: tuple) -> "TimingStat":
+        stat = cls()
+        stat.calls, stat.total, stat.max, stat.buckets = values
+        return stat
+
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        ended = time.perf_counter()
+        seconds = ended - self.started
+        with _lock:
+            stat = _timings.get(self.name)
+            if stat is None:
+                stat = _timings[self.name] = TimingStat()
+            stat.add(seconds)
+            if tracing and len(_events) < MAX_TRACE_EVENTS:
+                _events.append(
+                    (
+                        self.name,
+                        self.started,
+                        seconds,
+                        os.getpid(),
+                        threading.get_native_id(),
+                    )
+                )
+
+
+def timer(name: str, detail: str | None = None):
+    """
+    Context manager timing its block under name, or name.detail (the detail is
+    only joined when enabled)
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(name if detail is None else f"{name}.{detail}")
+
+
+def count(name: str, amount: int = 1) -> None:
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def configure(enable: bool, trace: bool = False) -> None:
+    global enabled, tracing
+    enabled = enable
+    tracing = enable and trace
+
+
+def settings() -> tuple[bool, bool]:
+    """Arguments of configure reproducing the current settings"""
+    return enabled, tracing
+
+
+def reset() -> None:
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _events.clear()
+
+
+def snapshot() -> dict:
+    """Picklable copy of the timers, counters and trace events"""
+    with _lock:
+        return {
+            "timings": {name: s.to_tuple() for name, s in _timings.items()},
+            "counters": dict(_counters),
+            "events": list(_events),
+        }
+
+
+def merge(data: dict) -> None:
+    """Adds a snapshot, usually taken in a worker process, to this process"""
+    with _lock:
+        for name, values in data["timings"].items():
+            stat = TimingStat.from_tuple(values)
+            if name in _timings:
+                _timings[name].merge(stat)
+            else:
+                _timings[name] = stat
+        for name, amount in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + amount
+        free = MAX_TRACE_EVENTS - len(_events)
+        _events.extend(data["events"][:free])
+
+
+def collect(function, *args):
+    """
+    Calls function in a worker process and returns (result, snapshot) with
+    only the measures taken during the call, to be merged by the parent
+    """
+    reset()
+    result = function(*args)
+    return result, snapshot()
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 0.001:
+        return f"{seconds * 1000:.2f}ms"
+    return f"{seconds * 1_000_000:.0f}us"
+
+
+def _histogram(stat: TimingStat) -> str:
+    first, last = min(stat.buckets), max(stat.buckets)
+    most = max(stat.buckets.values())
+    bars = ""
+    for bucket in range(first, last + 1):
+        calls = stat.buckets.get(bucket, 0)
+        level = 0 if calls == 0 else 1 + (len(HISTOGRAM_LEVELS) - 2) * calls // most
+        bars += HISTOGRAM_LEVELS[level]
+    low = _format_seconds(2 ** (first - 1) / 1_000_000 if first else 0)
+    high = _format_seconds(2**last / 1_000_000)
+    return f"{low:>7} [{bars}] {high}"
+
+
+def print_summary() -> None:
+    """Prints a table with the timers, their histograms and the counters"""
+    with _lock:
+        timings = sorted(_timings.items(), key=lambda item: -item[1].total)
+        counters = sorted(_counters.items())
+    if not timings and not counters:
+        return
+    print("Instrumentation summary (inclusive times)")
+    print(
+        f"{'timer':<28}{'calls':>9}{'total':>10}{'mean':>10}"
+        f"{'p50':>10}{'p95':>10}{'max':>10}  histogram"
+    )
+    for name, stat in timings:
+        print(
+            f"{name:<28}{stat.calls:>9}{_format_seconds(stat.total):>10}"
+            f"{_format_seconds(stat.total / stat.calls):>10}"
+            f"{_format_seconds(stat.percentile(0.5)):>10}"
+            f"{_format_seconds(stat.percentile(0.95)):>10}"
+            f"{_format_seconds(stat.max):>10}  {_histogram(stat)}"
+        )
+    if counters:
+        print("Counters: " + ", ".join(f"{name} {value}" for name, value in counters))
+    print()
+
+
+def write_trace(path: str) -> None:
+    """Writes the timed spans in the Chrome trace event format"""
+    with _lock:
+        events = list(_events)
+    origin = min((event[1] for event in events), default=0.0)
+    trace = [
+        {
+            "name": name,
+            "ph": "X",
+            "ts": round((started - origin) * 1_000_000, 1),
+            "dur": round(seconds * 1_000_000, 1),
+            "pid": pid,
+            "tid": tid,
+        }
+        for name, started, seconds, pid, tid in events
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    print(f"Trace with {len(trace)} events written to {path}\n")
+
+
+def is_trace_file(path: str) -> bool:
+    return path.lower().endswith(".json")
+
+
+def start(profile_file: str | None = None) -> None:
+    """
+    Enables the timers. profile_file ending in .json also keeps the spans for
+    a trace, any other name runs cProfile on this thread
+    """
+    global _profiler
+    trace = profile_file is not None and is_trace_file(profile_file)
+    configure(True, trace)
+    if profile_file is not None and not trace:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def finish(profile_file: str | None = None) -> None:
+    """Prints the summary and writes the trace or the cProfile stats"""
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+    print_summary()
+    if profile_file is None:
+        return
+    if is_trace_file(profile_file):
+        write_trace(profile_file)
+    elif _profiler is not None:
+        _profiler.dump_stats(profile_file)
+        stats = pstats.Stats(_profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+        stats.print_stats(PROFILE_TOP_FUNCTIONS)
+        print(f"cProfile stats written to {profile_file}\n")
+        _profiler = None
@@ -0,0 +1,321 @@
+"""
+Persistent ledger of every processed transaction in a local SQLite database,
+so the runs add to the same history instead of each one writing a standalone
+file, and the exports can be made from it without processing the emails again.
+"""
+
+import hashlib
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator
+
+from models.transaction import Transaction, TransactionType
+
+DEFAULT_LEDGER_PATH = "ledger.db"
+# Transactions written to the database with each executemany
+WRITE_EVERY = 500
+# Wall clock time of the transaction, sortable as text
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+COLUMNS = (
+    "message_id",
+    "fingerprint",
+    "date_time",
+    "utc_offset",
+    "type",
+    "amount_crc",
+    "amount_usd",
+    "amount_raw",
+    "description",
+    "category",
+    "bank_name",
+    "card_num",
+    "version",
+    "updated_at",
+)
+# Columns that can change for the same message and fingerprint, like the
+# category after editing classification.txt or a fix of a bank processor
+UPDATABLE_COLUMNS = (
+    "utc_offset",
+    "type",
+    "amount_raw",
+    "description",
+    "category",
+)
+SELECT_COLUMNS = (
+    "message_id, date_time, utc_offset, type, amount_crc, amount_usd, "
+    "amount_raw, description, category, bank_name, card_num"
+)
+
+
+def fingerprint(ts: Transaction) -> str:
+    """
+    Identifies a transaction inside its email by the bank, card, wall clock
+    time and amounts, the fields that do not change when it is processed again
+    """
+    key = (
+        f"{ts.bank_name}|{ts.card_num}|{ts.date_time:{DATE_FORMAT}}"
+        f"|{float(ts.amount_crc)!r}|{float(ts.amount_usd)!r}"
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _utc_offset(date_time: datetime) -> int | None:
+    offset = date_time.utcoffset()
+    if offset is None:
+        return None
+    return int(offset.total_seconds() // 60)
+
+
+def _to_transaction(row: tuple) -> Transaction:
+    (
+        message_id,
+        date_str,
+        utc_offset,
+        transaction_type,
+        amount_crc,
+        amount_usd,
+        amount_raw,
+        description,
+        category,
+        bank_name,
+        card_num,
+    ) = row
+    date_time = datetime.strptime(date_str, DATE_FORMAT)
+    if utc_offset is not None:
+        date_time = date_time.replace(tzinfo=timezone(timedelta(minutes=utc_offset)))
+    try:
+        transaction_type = TransactionType(transaction_type)
+    except ValueError:
+        pass
+    return Transaction(
+        type=transaction_type,
+        amount_crc=amount_crc,
+        amount_usd=amount_usd,
+        description=description,
+        date_time=date_time,
+        card_num=card_num,
+        bank_name=bank_name,
+        amount_raw=amount_raw,
+        category=category,
+        message_id=message_id,
+    )
+
+
+class Ledger:
+    """
+    SQLite table of transactions with indexes on date, bank, category and card.
+
+    Used as a sink (append/close): each transaction is upserted by its message
+    id and fingerprint, so processing the same emails again does not add
+    duplicates. The rows of a message with fingerprints it no longer produces,
+    like after a fix of its bank processor, are deleted. Every run has a new
+    version, and the rows inserted or changed by the run get it. The exports
+    keep the last version they emitted, so changes_since can return only the
+    new or changed rows.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        # Rows inserted or changed by this run
+        self.changed = 0
+        # Rows of the processed messages replaced by other fingerprints
+        self.removed = 0
+        self._pending: list[tuple] = []
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                message_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                date_time TEXT NOT NULL,
+                utc_offset INTEGER,
+                type TEXT,
+                amount_crc REAL NOT NULL,
+                amount_usd REAL NOT NULL,
+                amount_raw TEXT,
+                description TEXT,
+                category TEXT,
+                bank_name TEXT,
+                card_num TEXT,
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (message_id, fingerprint)
+            );
+            CREATE INDEX IF NOT EXISTS idx_transactions_date
+                ON transactions (date_time);
+            CREATE INDEX IF NOT EXISTS idx_transactions_bank
+                ON transactions (bank_name, date_time);
+            CREATE INDEX IF NOT EXISTS idx_transactions_category
+                ON transactions (category, date_time);
+            CREATE INDEX IF NOT EXISTS idx_transactions_card
+                ON transactions (card_num, date_time);
+            CREATE INDEX IF NOT EXISTS idx_transactions_version
+                ON transactions (version);
+            CREATE TABLE IF NOT EXISTS exports (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                exported_at REAL NOT NULL
+            );
+            """)
+        self._conn.commit()
+        (last_version,) = self._conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM transactions"
+        ).fetchone()
+        self.version = last_version + 1
+
+        placeholders = ", ".join("?" * len(COLUMNS))
+        updates = ", ".join(
+            f"{column} = excluded.{column}"
+            for column in UPDATABLE_COLUMNS + ("version", "updated_at")
+        )
+        current = ", ".join(UPDATABLE_COLUMNS)
+        new = ", ".join(f"excluded.{column}" for column in UPDATABLE_COLUMNS)
+        # The rows that did not change keep their version
+        self._upsert = f"""
+            INSERT INTO transactions ({", ".join(COLUMNS)})
+            VALUES ({placeholders})
+            ON CONFLICT (message_id, fingerprint) DO UPDATE SET {updates}
+            WHERE ({current}) IS NOT ({new})
+        """
+
+    def append(self, ts: Transaction) -> None:
+        # All the transactions of a message are written together, see flush
+        if (
+            len(self._pending) >= WRITE_EVERY
+            and self._pending[-1][0] != ts.message_id
+        ):
+            self.flush()
+        self._pending.append(
+            (
+                ts.message_id,
+                fingerprint(ts),
+                ts.date_time.strftime(DATE_FORMAT),
+                _utc_offset(ts.date_time),
+                getattr(ts.type, "value", ts.type),
+                ts.amount_crc,
+                ts.amount_usd,
+                ts.amount_raw,
+                ts.description,
+                ts.category,
+                ts.bank_name,
+                ts.card_num,
+                self.version,
+                time.time(),
+            )
+        )
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        fingerprints: dict[str, list[str]] = {}
+        for row in self._pending:
+            if row[0]:
+                fingerprints.setdefault(row[0], []).append(row[1])
+        for message_id, kept in fingerprints.items():
+            cursor = self._conn.execute(
+                "DELETE FROM transactions WHERE message_id = ?"
+                f" AND fingerprint NOT IN ({', '.join('?' * len(kept))})",
+                (message_id, *kept),
+            )
+            self.removed += cursor.rowcount
+        cursor = self._conn.executemany(self._upsert, self._pending)
+        self.changed += cursor.rowcount
+        self._conn.commit()
+        self._pending = []
+
+    def reclassify(self, classify: Callable[[str], str]) -> int:
+        """
+        Sets the category of every row to classify(description). The rows that
+        change get the version of this run, so the next changes_since returns
+        them. Returns the amount of rows whose category changed
+        """
+        self.flush()
+        rows = self._conn.execute(
+            "SELECT rowid, description, category FROM transactions"
+        ).fetchall()
+        updates = []
+        for rowid, description, category in rows:
+            new_category = classify(description or "")
+            if new_category != category:
+                updates.append((new_category, self.version, time.time(), rowid))
+        self._conn.executemany(
+            "UPDATE transactions SET category = ?, version = ?, updated_at = ?"
+            " WHERE rowid = ?",
+            updates,
+        )
+        self._conn.commit()
+        self.changed += len(updates)
+        return len(updates)
+
+    def query(
+        self,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        bank_name: str | None = None,
+        category: str | None = None,
+        card_num: str | None = None,
+    ) -> Iterator[Transaction]:
+        """
+        Transactions with start <= date_time < end (wall clock time) and the
+        given bank, category and card, ordered by date_time
+        """
+        self.flush()
+        conditions = []
+        params: list = []
+        if start is not None:
+            conditions.append("date_time >= ?")
+            params.append(start.strftime(DATE_FORMAT))
+        if end is not None:
+            conditions.append("date_time < ?")
+            params.append(end.strftime(DATE_FORMAT))
+        for column, value in (
+            ("bank_name", bank_name),
+            ("category", category),
+            ("card_num", card_num),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._conn.execute(
+            f"SELECT {SELECT_COLUMNS} FROM transactions {where} ORDER BY date_time",
+            params,
+        )
+        for row in rows:
+            yield _to_transaction(row)
+
+    def exported_version(self, name: str) -> int:
+        """Last version emitted by the export name, 0 if it never ran"""
+        row = self._conn.execute(
+            "SELECT version FROM exports WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, name: str) -> tuple[Iterator[Transaction], int]:
+        """
+        Transactions inserted or changed since the last export name, ordered
+        by date_time, and the version to pass to mark_exported once written
+        """
+        self.flush()
+        (version,) = self._conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM transactions"
+        ).fetchone()
+        rows = self._conn.execute(
+            f"SELECT {SELECT_COLUMNS} FROM transactions"
+            " WHERE version > ? AND version <= ? ORDER BY date_time",
+            (self.exported_version(name), version),
+        )
+        return (_to_transaction(row) for row in rows), version
+
+    def mark_exported(self, name: str, version: int) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO exports (name, version, exported_at)"
+            " VALUES (?, ?, ?)",
+            (name, version, time.time()),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
@@ -4,26 +4,63 @@ different bank transactions, extract their metadata, classify and tabulate them.
 """
 
 import os.path
-import base64
+import json
 import time
 import traceback
 import sys
 from enum import Enum
+from typing import Callable, Iterable, Iterator
 from datetime import datetime, timedelta
 
-from bs4 import BeautifulSoup
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from select_calendar import select_date
 
-from exporter import export_to_xlsx
-from banks import BANK_PROCESSORS
+import instrumentation
+from exporter import CsvSink, MultiSink, XlsSink, XlsxSink
+from ledger import Ledger
+from offline_source import process_offline
+from parquet_export import export_to_parquet
+from parse_pool import DEFAULT_PROCESSES
+from pipeline import Pipeline
+from reporting import build_reports, export_reports_csv
+from gmail_client import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    FORMAT_FULL,
+    MAX_BATCH_MODIFY_IDS,
+    RateLimiter,
+    fetch_messages,
+    fetch_messages_concurrently,
+    fetch_messages_two_phase,
+    get_history_id,
+    get_label_id,
+    is_history_expired,
+    list_history_messages,
+    list_messages,
+    mark_as_read,
+)
+from message_cache import (
+    OUTCOME_IGNORED,
+    OUTCOME_PROCESSED,
+    MessageCache,
+    fetch_messages_cached,
+)
+from email_processing import needs_body, parse_gmail_messages
 from models.email import Email
-from models.transaction import Transaction
+from models.html_parsing import set_text_backend
+from models.transaction import Transaction, classifier
+from models.transaction_store import TransactionStore
 
 DATETIME_FORMATER = "%Y/%m/%d"
+# Label used to filter the bank emails
+BANK_LABEL = "Bancos"
+# Stores the mailbox history id of the last run for the incremental mode
+SYNC_STATE_FILE = "sync_state.json"
+# Stores the categories of the descriptions already classified
+CATEGORY_CACHE_FILE = "category_cache.json"
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -39,7 +76,7 @@ class OperationMode(Enum):
     MANUAL = 3
 
 
-def define_query(operation_mode: int) -> tuple[int, str]:
+def define_query(operation_mode: int) -> tuple[int | None, str]:
     """
     Defines the query to be used to search for bank emails. Depending on the operation mode.
 
@@ -49,6 +86,7 @@ def define_query(operation_mode: int) -> tuple[int, str]:
     - Manual : Asks the user to manually write a search query to search the desired emails
 
     Note: In GUI and DEV mode filters using the label 'Bancos'
+    The limit is None when every matching email should be retrieved.
     """
     if operation_mode == OperationMode.GUI:
         print("Using Script in GUI mode")
@@ -56,7 +94,7 @@ def define_query(operation_mode: int) -> tuple[int, str]:
         select_date(selected_date)
         if selected_date:
             result = (
-                300,
+                None,
                 f"label:Bancos after:{selected_date[0]}  before:{selected_date[1]}",
             )
             print(f"Search Query:\n - limit={result[0]}\n - query={result[1]}")
@@ -79,27 +117,31 @@ def define_query(operation_mode: int) -> tuple[int, str]:
 
     if operation_mode == OperationMode.DEV:
         # Default options are:
-        #       results: 300
+        #       results: no limit
         #       query: "label:Bancos after:YYYY/MM/DD"
         print("Using Script in DEV mode")
         today = datetime.today()
         start_date = today - timedelta(days=30)
         start_date_str = start_date.strftime(DATETIME_FORMATER)
-        result = 300, f"label:Bancos after:{start_date_str}"
+        result = None, f"label:Bancos after:{start_date_str}"
         print(f"Search Query:\n - limit={result[0]}\n - query={result[1]}")
         return result
 
 
-def define_query_manually() -> tuple[int, str]:
+def define_query_manually() -> tuple[int | None, str]:
     """
     Asks the users to input a custom search query to identify the desired emails
     """
-    max_results: int = 100
+    max_results: int | None = None
     while True:
         try:
-            max_results = int(input("Max results [max=500]:").strip())
-            if max_results < 1 or max_results > 500:
-                raise ValueError("Must be between 1 and 500")
+            value = input("Max results [empty=no limit]:").strip()
+            if not value:
+                max_results = None
+                break
+            max_results = int(value)
+            if max_results < 1:
+                raise ValueError("Must be greater than 0")
             else:
                 break
         except Exception:
@@ -135,126 +177,469 @@ def get_credentials():
     return creds
 
 
-def get_messages(service, operation_mode):
-    """Request a list of all the messages"""
-    # messages is a list of dictionaries where each dictionary contains a message id.
-    max_emails, search_query = define_query(operation_mode)
-    result = (
-        service.users()
-        .messages()
-        .list(maxResults=max_emails, userId="me", q=search_query)
-        .execute()
-    )
-    messages = result.get("messages")
-    return messages
-
-
-def process_email(email: Email, processed_transactions: list[Transaction]) -> bool:
+def load_history_id() -> str | None:
+    """Returns the history id saved by the last run, if any"""
+    if not os.path.exists(SYNC_STATE_FILE):
+        return None
     try:
-        for processor in BANK_PROCESSORS:
-            if processor.identify(email):
-                transaction = processor.process(email)
-                if transaction:
-                    processed_transactions.append(transaction)
-                return True
-        return False
+        with open(SYNC_STATE_FILE, "r") as f:
+            return json.load(f).get("historyId")
     except Exception as e:
-        print(f"Error processing email. Skiping email: {email}. Error: {e}")
-        return False
+        print(f"Error reading {SYNC_STATE_FILE}. Error: {e}")
+        return None
+
+
+def save_history_id(history_id: str) -> None:
+    with open(SYNC_STATE_FILE, "w") as f:
+        json.dump({"historyId": history_id}, f)
+
+
+def get_messages(
+    service,
+    operation_mode,
+    limiter: RateLimiter | None = None,
+    label_id: str | None = None,
+):
+    """
+    Request a list of all the messages.
+
+    With label_id (incremental mode) only the messages added with the bank
+    label since the last run are listed, using the saved mailbox history id.
+    When there is no saved history id or it already expired, the query from
+    define_query is used.
+    """
+    if label_id is not None:
+        history_id = load_history_id()
+        if history_id:
+            try:
+                messages = list_history_messages(service, history_id, label_id, limiter)
+                print(f"Using incremental sync since history id {history_id}\n")
+                return messages
+            except HttpError as error:
+                if not is_history_expired(error):
+                    raise
+                print("The saved history id expired. Using the full search query\n")
+        else:
+            print("No saved history id. Using the full search query\n")
+
+    # messages is a generator of dictionaries where each dictionary contains a message id.
+    # The pages are requested while the messages are consumed.
+    max_emails, search_query = define_query(operation_mode)
+    return list_messages(service, search_query, limit=max_emails, limiter=limiter)
 
 
 def process_messages(
     service,
-    transactions_to_export: list[Email],
-    messages: dict,
+    transactions_to_export: list[Transaction] | TransactionStore | MultiSink,
+    messages: Iterable[dict],
     operation_mode: OperationMode,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    service_factory: Callable[[], object] | None = None,
+    limiter: RateLimiter | None = None,
+    cache: MessageCache | None = None,
+    metadata_first: bool = False,
+    processes: int = 1,
 ):
-    messages_len = len(messages)
-    print("Found", messages_len, "messages that match the search query\n")
-    # messages is a list of dictionaries where each dictionary contains a message id.
-    # iterate through all the messages
-    for i, msg in enumerate(messages):
-        print(f"Parsing emails: {i+1}/{messages_len}", end="\r", flush=True)
-        # Get the message from its id
-        msg_data = service.users().messages().get(userId="me", id=msg["id"]).execute()
-
-        headers = msg_data["payload"]["headers"]
-        current_email = Email()
-        # Look for Subject and Sender Email in the headers
-        for d in headers:
-            if d["name"] == "Subject":
-                current_email.subject = d["value"]
-            if d["name"] == "From":
-                current_email.sender = d["value"]
-            if d["name"] == "X-Received":
-                current_email.date_str = d["value"]
-                current_email.date_str = current_email.date_str[
-                    current_email.date_str.rfind(";") + 1 :
-                ].strip()
-                current_email.date_str = current_email.date_str[
-                    : current_email.date_str.rfind("(")
-                ].strip()
-
-        current_email.body = "Not decrypted"
+    """
+    Fetches, decodes and processes every message. With more than one worker the
+    batches are downloaded by a thread pool (each thread using its own service
+    from service_factory) while the emails already received are processed.
+    When a cache is given only the messages missing from it are requested.
+    With metadata_first only the headers are requested first, and the full
+    message only for the emails where needs_body is True.
+    With more than one process the emails are decoded and processed in a
+    process pool while the downloads continue.
+    The emails are always processed in the same order as messages.
+    """
+    # messages is an iterable of dictionaries where each dictionary contains a message id.
+    # The messages are requested in batches to avoid one round trip per email
+    # and the first batch is sent before the listing finishes.
+    message_ids = (msg["id"] for msg in messages)
+
+    def fetch_format(
+        ids: Iterable[str], message_format: str = FORMAT_FULL
+    ) -> Iterator[tuple[str, dict | None]]:
+        if workers > 1 and service_factory is not None:
+            return fetch_messages_concurrently(
+                service_factory, ids, batch_size, workers, limiter, message_format
+            )
+        return fetch_messages(service, ids, batch_size, limiter, message_format)
+
+    def fetch(ids: Iterable[str]) -> Iterator[tuple[str, dict | None]]:
+        if metadata_first:
+            return fetch_messages_two_phase(
+                ids,
+                fetch_format,
+                lambda msg_data: needs_body(
+                    Email.from_gmail_message(msg_data, decode_body=False)
+                ),
+                batch_size * workers,
+            )
+        return fetch_format(ids)
+
+    if cache is not None:
+        fetched = fetch_messages_cached(cache, message_ids, fetch)
+    else:
+        fetched = fetch(message_ids)
+    messages_len = 0
+    # Ids of the processed emails, they are marked as READ in bulk
+    to_mark_as_read: list[str] = []
+    unmarked: list[str] = []
+    parsed = parse_gmail_messages(fetched, processes)
+    for i, (msg_id, success, transactions) in enumerate(parsed):
+        messages_len = i + 1
+        print(f"Parsing emails: {messages_len}", end="\r", flush=True)
+        if success is None:
+            continue
+
+        for transaction in transactions:
+            transactions_to_export.append(transaction)
+        if cache is not None:
+            cache.set_outcome(msg_id, OUTCOME_PROCESSED if success else OUTCOME_IGNORED)
+        if success and operation_mode == OperationMode.GUI:
+            to_mark_as_read.append(msg_id)
+            if len(to_mark_as_read) >= MAX_BATCH_MODIFY_IDS:
+                unmarked.extend(mark_as_read(service, to_mark_as_read, limiter))
+                to_mark_as_read = []
 
-        try:
-            # The Body of the message is in Encrypted format. So, we have to decode it.
-            # Get the data and decode it with base 64 decoder.
-            encoded_body = ""
-            if msg_data["payload"]["body"]["size"] > 0:
-                encoded_body = msg_data["payload"]["body"]["data"]
-            elif len(msg_data["payload"]["parts"]) > 0:
-                part_no = 0
-                if msg_data["payload"]["parts"][0]["mimeType"] == "text/html":
-                    part_no = 0
-                elif msg_data["payload"]["parts"][1]["mimeType"] == "text/html":
-                    part_no = 1
-                encoded_body = msg_data["payload"]["parts"][part_no]["body"]["data"]
-
-            decoded_body = base64.urlsafe_b64decode(encoded_body.encode("UTF-8"))
-            current_email.html_body = BeautifulSoup(decoded_body, "html.parser")
-            current_email.body = current_email.html_body.text
-            current_email.body = current_email.body.replace("&nbsp", "\n")
-        except Exception as e:
-            print(f"Error: {e}")
-        finally:
-            success = process_email(current_email, transactions_to_export)
-            # Mark email as READ
-            try:
-                if success and operation_mode == OperationMode.GUI:
-                    service.users().messages().modify(
-                        userId="me",
-                        id=msg["id"],
-                        body={"removeLabelIds": ["UNREAD"]},
-                    ).execute()
-            except Exception as e:
-                print(
-                    f"Error marking email as READ. Skiping email: {current_email}. Error: {e}"
-                )
     print(f"Finished parsing {messages_len} emails\n")
+    if cache is not None:
+        print(f"Cached emails used: {cache.hits}, downloaded: {cache.misses}\n")
+
+    # Mark emails as READ
+    if to_mark_as_read:
+        unmarked.extend(mark_as_read(service, to_mark_as_read, limiter))
+    if unmarked:
+        print(f"Could not mark {len(unmarked)} emails as READ: {', '.join(unmarked)}\n")
+
+
+def run_pipeline(
+    service_factory: Callable[[], object],
+    transactions_to_export: list[Transaction] | TransactionStore | MultiSink,
+    messages: Iterable[dict],
+    operation_mode: OperationMode,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    limiter: RateLimiter | None = None,
+    cache: MessageCache | None = None,
+    metadata_first: bool = False,
+    processes: int = 1,
+):
+    """Same as process_messages with the stages running concurrently (pipeline.py)"""
+    stats = Pipeline(
+        service_factory,
+        messages,
+        transactions_to_export,
+        batch_size=batch_size,
+        fetch_workers=workers,
+        processes=processes,
+        limiter=limiter,
+        cache=cache,
+        metadata_first=metadata_first,
+        mark_read=operation_mode == OperationMode.GUI,
+    ).run()
+
+    print(
+        f"Finished parsing {stats.messages} emails,"
+        f" {stats.transactions} transactions\n"
+    )
+    if stats.first_transaction is not None:
+        print(f"First transaction exported after {stats.first_transaction:.2f}s\n")
+    if cache is not None:
+        print(f"Cached emails used: {cache.hits}, downloaded: {cache.misses}\n")
+    if stats.unmarked:
+        unmarked = ", ".join(stats.unmarked)
+        print(f"Could not mark {len(stats.unmarked)} emails as READ: {unmarked}\n")
+
+
+def finish_export(
+    sink: CsvSink | XlsSink | XlsxSink,
+    store: TransactionStore | None,
+    report: bool,
+    export_parquet: bool,
+    keep_category_cache: bool,
+):
+    """Adds the reports, closes the export file and writes the other outputs"""
+    if report:
+        with instrumentation.timer("export", "reports"):
+            reports = build_reports(store)
+    if report and isinstance(sink, CsvSink):
+        export_reports_csv(reports)
+    elif report:
+        sink.add_reports(reports)
+    sink.close()
+    if sink.count == 0:
+        print("No data to export")
+    else:
+        print(f"Exported {sink.count} transaction emails to {sink.file_name}\n")
+    if export_parquet:
+        export_to_parquet(store)
+    cache_stats = classifier.cache
+    print(f"Category cache hits: {cache_stats.hits}, misses: {cache_stats.misses}\n")
+    if keep_category_cache:
+        classifier.cache.save(CATEGORY_CACHE_FILE)
+
+
+def export_from_ledger(
+    ledger: Ledger,
+    transactions_to_export: MultiSink,
+    export_name: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> int | None:
+    """
+    Sends the transactions of the ledger between start and end to the export.
+    Without a range only the ones new or changed since the last export_name
+    are sent, and the version to mark as exported is returned.
+    """
+    if start is not None or end is not None:
+        transactions = ledger.query(start, end)
+        version = None
+    else:
+        transactions, version = ledger.changes_since(export_name)
+    for transaction in transactions:
+        transactions_to_export.append(transaction)
+    return version
+
+
+def close_ledger(ledger: Ledger | None) -> None:
+    if ledger is None:
+        return
+    ledger.close()
+    if ledger.changed or ledger.removed:
+        print(
+            f"Ledger: {ledger.changed} new or changed and {ledger.removed} removed"
+            f" transactions in {ledger.path}\n"
+        )
 
 
 def main():
     operation_mode = OperationMode.DEV
-    for arg in sys.argv:
+    batch_size = DEFAULT_BATCH_SIZE
+    workers = DEFAULT_WORKERS
+    use_cache = True
+    incremental = False
+    metadata_first = False
+    keep_category_cache = False
+    report = False
+    export_csv = False
+    export_xls = False
+    export_parquet = False
+    offline_paths: list[str] = []
+    processes: int | None = None
+    use_pipeline = False
+    show_stats = False
+    profile_file: str | None = None
+    use_ledger = False
+    ledger_export = False
+    reclassify = False
+    start: datetime | None = None
+    end: datetime | None = None
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
         if arg == "-g":
             operation_mode = OperationMode.GUI
         if arg == "-m":
             operation_mode = OperationMode.MANUAL
+        # -b <n> : amount of emails requested on each Gmail batch request
+        if arg == "-b" and i + 1 < len(args):
+            batch_size = int(args[i + 1])
+        # -w <n> : amount of threads downloading batches concurrently
+        if arg == "-w" and i + 1 < len(args):
+            workers = max(1, int(args[i + 1]))
+        # --no-cache : ignore the local message cache and download every email
+        if arg == "--no-cache":
+            use_cache = False
+        # -i : only look for the emails received since the last run
+        if arg == "-i":
+            incremental = True
+        # --metadata-first : download the body only of the supported bank emails
+        if arg == "--metadata-first":
+            metadata_first = True
+        # --report : add the summary reports as extra sheets of the export
+        if arg == "--report":
+            report = True
+        # --csv : export to a csv file instead of an Excel workbook. Keeps the
+        # rows written before a crash, the .xlsx only replaces the previous
+        # workbook once closed
+        if arg == "--csv":
+            export_csv = True
+        # --xls : export to a legacy .xls workbook (limited to 65536 rows)
+        if arg == "--xls":
+            export_xls = True
+        # --parquet : also write the transactions to the Parquet dataset
+        if arg == "--parquet":
+            export_parquet = True
+        # --category-cache : keep the classified descriptions between runs
+        if arg == "--category-cache":
+            keep_category_cache = True
+        # --offline <path> : process an mbox file, Maildir or .eml files instead
+        # of Gmail. Can be used several times
+        if arg == "--offline" and i + 1 < len(args):
+            offline_paths.append(args[i + 1])
+        # -p <n> : amount of processes parsing the emails
+        if arg == "-p" and i + 1 < len(args):
+            processes = max(1, int(args[i + 1]))
+        # --pipeline : run the list, fetch, parse and export stages concurrently
+        if arg == "--pipeline":
+            use_pipeline = True
+        # --html-parser <name> : backend to extract the text of the emails
+        if arg == "--html-parser" and i + 1 < len(args):
+            set_text_backend(args[i + 1])
+        # --stats : time every stage and print a summary at the end
+        if arg == "--stats":
+            show_stats = True
+        # --profile <file> : same as --stats, also writes a cProfile dump or a
+        # trace of every timed call when the file ends in .json
+        if arg == "--profile" and i + 1 < len(args):
+            profile_file = args[i + 1]
+        # --ledger : also store the transactions in the ledger database
+        if arg == "--ledger":
+            use_ledger = True
+        # --ledger-export : export from the ledger without reading emails, only
+        # the transactions new or changed since the last export of this format
+        if arg == "--ledger-export":
+            ledger_export = True
+        # --reclassify : classify again the transactions of the ledger with the
+        # current classification.txt, the next --ledger-export sends the changes
+        if arg == "--reclassify":
+            reclassify = True
+        # --from <YYYY-MM-DD> / --to <YYYY-MM-DD> : with --ledger-export, export
+        # every transaction from that date and until that date (not included)
+        if arg == "--from" and i + 1 < len(args):
+            start = datetime.fromisoformat(args[i + 1])
+        if arg == "--to" and i + 1 < len(args):
+            end = datetime.fromisoformat(args[i + 1])
+
+    if show_stats or profile_file is not None:
+        instrumentation.start(profile_file)
+
+    # The transactions are written to the export file as they are processed
+    if export_csv:
+        sink, export_name = CsvSink(), "csv"
+    elif export_xls:
+        sink, export_name = XlsSink(), "xls"
+    else:
+        sink, export_name = XlsxSink(), "xlsx"
+    # Columnar storage, the transactions are only kept for the reports and
+    # the Parquet export
+    store = TransactionStore() if report or export_parquet else None
+    targets = [sink] if store is None else [sink, store]
+    ledger = Ledger() if use_ledger or ledger_export or reclassify else None
+    if use_ledger and not ledger_export:
+        targets.append(ledger)
+    transactions_to_export = MultiSink(*targets)
+    if keep_category_cache:
+        classifier.cache.load(CATEGORY_CACHE_FILE)
+
+    if reclassify:
+        changed = classifier.reclassify(ledger)
+        print(f"Reclassified {changed} transactions of {ledger.path}\n")
+        if not ledger_export:
+            close_ledger(ledger)
+            if instrumentation.enabled:
+                instrumentation.finish(profile_file)
+            return
+
+    if ledger_export:
+        try:
+            version = export_from_ledger(
+                ledger, transactions_to_export, export_name, start, end
+            )
+            finish_export(sink, store, report, export_parquet, keep_category_cache)
+            # Only once the file is written, a failed export is sent again
+            if version is not None:
+                ledger.mark_exported(export_name, version)
+        finally:
+            sink.close()
+            close_ledger(ledger)
+            if instrumentation.enabled:
+                instrumentation.finish(profile_file)
+        return
+
+    if offline_paths:
+        try:
+            process_offline(
+                offline_paths, transactions_to_export, processes or DEFAULT_PROCESSES
+            )
+            finish_export(sink, store, report, export_parquet, keep_category_cache)
+        finally:
+            sink.close()
+            close_ledger(ledger)
+            if instrumentation.enabled:
+                instrumentation.finish(profile_file)
+        return
 
-    transactions_to_export: list[Transaction] = []
     creds = get_credentials()
     # Call the Gmail API
     service = build("gmail", "v1", credentials=creds)
+    # Every worker thread needs its own service since they are not thread safe
+    service_factory = lambda: build("gmail", "v1", credentials=creds)
+    # Shared by all the requests to stay below the per-user quota
+    limiter = RateLimiter()
+    cache = MessageCache() if use_cache else None
 
     try:
-        messages = get_messages(service, operation_mode)
-        process_messages(service, transactions_to_export, messages, operation_mode)
-        export_to_xlsx(transactions_to_export)
+        label_id = None
+        if incremental:
+            # Without the label the history would list every email of the mailbox
+            label_id = get_label_id(service, BANK_LABEL, limiter)
+            if label_id is None:
+                print(
+                    f"There is no '{BANK_LABEL}' label, incremental mode disabled."
+                    " Using the full search query\n"
+                )
+                incremental = False
+        if incremental:
+            # Taken before listing so the emails received during the run are
+            # included in the next incremental run
+            history_id = get_history_id(service, limiter)
+        messages = get_messages(service, operation_mode, limiter, label_id)
+        if use_pipeline:
+            run_pipeline(
+                service_factory,
+                transactions_to_export,
+                messages,
+                operation_mode,
+                batch_size,
+                workers,
+                limiter,
+                cache,
+                metadata_first,
+                processes or 1,
+            )
+        else:
+            process_messages(
+                service,
+                transactions_to_export,
+                messages,
+                operation_mode,
+                batch_size,
+                workers,
+                service_factory,
+                limiter,
+                cache,
+                metadata_first,
+                processes or 1,
+            )
+        finish_export(sink, store, report, export_parquet, keep_category_cache)
+        # Only once the export is written, a failed run is listed again. The
+        # other runs may not list every labeled email since the saved one
+        if incremental:
+            save_history_id(history_id)
 
     except HttpError as error:
         # TODO(developer) - Handle errors from gmail API.
         print(f"An error occurred: {error}")
+    finally:
+        # Keeps the transactions processed before an error
+        sink.close()
+        close_ledger(ledger)
+        if cache is not None:
+            cache.close()
+        if instrumentation.enabled:
+            instrumentation.finish(profile_file)
 
 
 def countdown(n: int):
@@ -0,0 +1,216 @@
+"""
+Local cache of the Gmail messages already downloaded, keyed by message id, so
+the same emails are not requested again on every run
+"""
+
+import json
+import sqlite3
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from models.email import Email, has_gmail_body
+
+DEFAULT_CACHE_PATH = "message_cache.db"
+DEFAULT_MAX_AGE_DAYS = 90
+DEFAULT_MAX_SIZE_MB = 200
+# Amount of ids looked up in the cache with a single query
+LOOKUP_WINDOW = 100
+
+OUTCOME_PROCESSED = "processed"
+OUTCOME_IGNORED = "ignored"
+
+
+class MessageCache:
+    """
+    SQLite cache storing for each message id the raw Gmail payload (compressed),
+    the extracted Subject/From/X-Received headers and the processing outcome.
+
+    Entries older than max_age_days are evicted, and the least recently used
+    entries are evicted while the stored payloads exceed max_size_mb.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+        max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+    ):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                subject TEXT,
+                sender TEXT,
+                date_str TEXT,
+                outcome TEXT,
+                cached_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_accessed ON messages (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get_many(self, message_ids: list[str]) -> dict[str, dict]:
+        """Returns the cached payloads of the given ids that are in the cache"""
+        if not message_ids:
+            return {}
+        placeholders = ",".join("?" * len(message_ids))
+        rows = self._conn.execute(
+            f"SELECT id, payload FROM messages WHERE id IN ({placeholders})",
+            message_ids,
+        ).fetchall()
+        result = {
+            msg_id: json.loads(zlib.decompress(payload)) for msg_id, payload in rows
+        }
+
+        if result:
+            self._conn.executemany(
+                "UPDATE messages SET accessed_at = ? WHERE id = ?",
+                [(time.time(), msg_id) for msg_id in result],
+            )
+            self._conn.commit()
+        self.hits += len(result)
+        self.misses += len(set(message_ids)) - len(result)
+        return result
+
+    def put(self, msg_id: str, msg_data: dict, email: Email | None = None) -> None:
+        """Stores the payload of a message together with its extracted headers"""
+        if email is None:
+            email = Email.from_gmail_message(msg_data, decode_body=False)
+        payload = zlib.compress(json.dumps(msg_data).encode("utf-8"))
+        now = time.time()
+        self._conn.execute(
+            """
+            INSERT OR REPLACE INTO messages
+                (id, payload, size, subject, sender, date_str, outcome, cached_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)
+            """,
+            (
+                msg_id,
+                payload,
+                len(payload),
+                email.subject,
+                email.sender,
+                email.date_str,
+                now,
+                now,
+            ),
+        )
+        self._conn.commit()
+
+    def set_outcome(self, msg_id: str, outcome: str) -> None:
+        self._conn.execute(
+            "UPDATE messages SET outcome = ? WHERE id = ?", (outcome, msg_id)
+        )
+        self._conn.commit()
+
+    def evict(self) -> int:
+        """Removes the expired entries and the least recently used ones over the size limit"""
+        removed = 0
+        if self.max_age_days is not None:
+            limit = time.time() - self.max_age_days * 24 * 60 * 60
+            removed += self._conn.execute(
+                "DELETE FROM messages WHERE cached_at < ?", (limit,)
+            ).rowcount
+
+        if self.max_size_mb is not None:
+            max_bytes = self.max_size_mb * 1024 * 1024
+            total = 0
+            to_remove = []
+            rows = self._conn.execute(
+                "SELECT id, size FROM messages ORDER BY accessed_at DESC"
+            )
+            for msg_id, size in rows:
+                total += size
+                if total > max_bytes:
+                    to_remove.append((msg_id,))
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", to_remove)
+            removed += len(to_remove)
+
+        self._conn.commit()
+        return removed
+
+    def close(self) -> None:
+        self.evict()
+        self._conn.close()
+
+
+def fetch_messages_cached(
+    cache: MessageCache,
+    message_ids: Iterable[str],
+    fetch: Callable[[Iterable[str]], Iterator[tuple[str, dict | None]]],
+) -> Iterator[tuple[str, dict | None]]:
+    """
+    Wraps one of the gmail_client fetch functions so only the ids missing from
+    the cache are requested. The new full payloads are stored in the cache,
+    metadata only payloads are not.
+
+    Yields (message_id, msg_data) in the same order as message_ids, and like
+    fetch, the ids are consumed lazily.
+    """
+    message_ids = iter(message_ids)
+    # Every id in input order, with its cached payload or the position of the
+    # id among the requested ones
+    order: deque = deque()
+    arrived: dict[int, tuple[str, dict | None]] = {}
+
+    def missing_ids() -> Iterator[str]:
+        requested = 0
+        while True:
+            chunk = list(islice(message_ids, LOOKUP_WINDOW))
+            if not chunk:
+                return
+            cached = cache.get_many(chunk)
+            for msg_id in chunk:
+                if msg_id in cached:
+                    order.append((msg_id, cached[msg_id], None))
+                else:
+                    order.append((msg_id, None, requested))
+                    requested += 1
+                    yield msg_id
+
+    fetched = enumerate(fetch(missing_ids()))
+    fetch_finished = False
+    while True:
+        if order:
+            msg_id, msg_data, position = order[0]
+            if position is None:
+                order.popleft()
+                yield msg_id, msg_data
+                continue
+            if position in arrived:
+                order.popleft()
+                yield arrived.pop(position)
+                continue
+        elif fetch_finished:
+            return
+
+        if fetch_finished:
+            # fetch did not return a result for every requested id
+            msg_id, _, _ = order.popleft()
+            yield msg_id, None
+            continue
+
+        # The next message in order has not been downloaded yet
+        try:
+            position, (msg_id, msg_data) = next(fetched)
+        except StopIteration:
+            fetch_finished = True
+            continue
+        if msg_data is not None and has_gmail_body(msg_data):
+            cache.put(msg_id, msg_data)
+        arrived[position] = (msg_id, msg_data)
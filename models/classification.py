@@ -0,0 +1,391 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+DEFAULT_CATEGORY_CACHE_SIZE = 4096
+# classification.txt at the root of the repository, independent of the cwd
+DEFAULT_CLASSIFICATION_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "classification.txt"
+)
+# Minimum seconds between checks of the classification file for changes
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+def _trie_pattern(words: set[str]) -> str:
+    """
+    Builds a regex matching any of the words, structured as a trie so the regex
+    engine does not try every word at every position
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        is_end = "" in node
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if is_end else pattern
+
+    return build(trie)
+
+
+def parse_classification(lines: Iterable[str]) -> dict[str, list[list[str]]]:
+    """
+    Parses the lines of a classification file into a dict mapping each
+    category to its [include_words, exclude_words]
+    """
+    classification_list: dict[str, list[list[str]]] = {}
+    current_class = ""
+    for line in lines:
+        line = line.strip().lower().replace("\n", "")
+        if len(line) == 0:
+            pass
+        elif line[0] == "#":
+            pass
+        elif line.startswith("class:"):
+            current_class = f"temp{len(classification_list)+1}"
+            if len(line) > 6:
+                line = line[6:].strip()
+                if (len(line) != 0) and (line not in classification_list):
+                    current_class = line.title()
+
+            classification_list[current_class] = [[], []]
+
+        elif line.startswith("include:"):
+            include_list = []
+            if len(line) > 8:
+                line = line[8:].strip()
+                if len(line) != 0:
+                    include_list = line.split(",")
+                    include_list = [i.strip() for i in include_list]
+
+            classification_list[current_class][0].extend(include_list)
+
+        elif line.startswith("exclude:"):
+            exclude_list = []
+            if len(line) > 8:
+                line = line[8:].strip()
+                if len(line) != 0:
+                    exclude_list = line.split(",")
+                    exclude_list = [i.strip() for i in exclude_list]
+
+            classification_list[current_class][1].extend(exclude_list)
+        else:
+            pass
+
+    return classification_list
+
+
+def read_classification(
+    path: str = DEFAULT_CLASSIFICATION_FILE,
+) -> dict[str, list[list[str]]]:
+    with open(path, "r") as f:
+        return parse_classification(f.readlines())
+
+
+def normalize_description(description: str) -> str:
+    """
+    Lower case description surrounded by spaces, with '.', '*' and '-' replaced
+    by spaces, so the keywords can be matched as ' keyword '
+    """
+    description = " " + description.lower() + " "
+    description = description.replace(".", " ").replace("*", " ").replace("-", " ")
+    description = description.replace("   ", " ").replace("  ", " ")
+    return description
+
+
+class CompiledClassification:
+    """
+    Classification rules compiled to find every keyword in a single pass.
+
+    classification_list maps each category to its [include_words, exclude_words],
+    as loaded by read_classification. Instances are not modified once built,
+    so they can be shared between threads. The category of a description is the first
+    one (in file order) with an include word in the description and none of its
+    exclude words. Words are matched as ' word ' substrings of the normalized
+    description.
+    """
+
+    def __init__(self, classification_list: dict[str, list[list[str]]]):
+        # Identifies the rule set, used to invalidate the cached categories
+        self.fingerprint = hashlib.sha1(
+            json.dumps(list(classification_list.items())).encode("utf-8")
+        ).hexdigest()
+        self.categories: list[tuple[str, frozenset[str], frozenset[str]]] = []
+        # keyword -> positions of the categories including it
+        self._included_in: dict[str, list[int]] = {}
+        keywords: set[str] = set()
+
+        for position, (category, (include_words, exclude_words)) in enumerate(
+            classification_list.items()
+        ):
+            include = frozenset(" " + word + " " for word in include_words)
+            exclude = frozenset(" " + word + " " for word in exclude_words)
+            self.categories.append((category, include, exclude))
+            for word in include:
+                self._included_in.setdefault(word, []).append(position)
+            keywords |= include | exclude
+
+        # keyword -> the keywords that are prefixes of it (including itself)
+        self._prefixes: dict[str, list[str]] = {
+            word: [other for other in keywords if word.startswith(other)]
+            for word in keywords
+        }
+        self._regex = None
+        if keywords:
+            # Zero width lookahead, so it reports every position where a keyword
+            # starts, even when the keywords overlap. The group captures the
+            # longest keyword starting at that position.
+            self._regex = re.compile(f"(?=({_trie_pattern(keywords)}))")
+
+    def find_keywords(self, description: str) -> set[str]:
+        """Returns every keyword contained in the normalized description"""
+        hits: set[str] = set()
+        if self._regex is None:
+            return hits
+        for match in self._regex.finditer(description):
+            # The shorter keywords starting at the same position are its prefixes
+            hits.update(self._prefixes[match.group(1)])
+        return hits
+
+    def classify(self, description: str) -> str:
+        """Returns the category of the description, or '' if none matches"""
+        return self.classify_normalized(normalize_description(description))
+
+    def classify_normalized(self, description: str) -> str:
+        """Same as classify for a description already normalized"""
+        hits = self.find_keywords(description)
+        if not hits:
+            return ""
+
+        candidates = sorted(
+            {position for word in hits for position in self._included_in.get(word, ())}
+        )
+        for position in candidates:
+            category, _, exclude = self.categories[position]
+            if exclude.isdisjoint(hits):
+                return category
+        return ""
+
+
+class CategoryCache:
+    """
+    Bounded LRU cache from normalized description to category.
+
+    The entries belong to the rule set identified by fingerprint, they are
+    dropped as soon as a classification with different rules is used. The cache
+    can be saved to and loaded from a json file to keep it between runs.
+
+    It is shared by the worker threads: the entries are read and written with
+    a lock, while the descriptions missing in the cache are classified without
+    holding it. In the worker processes track_added keeps the new entries, so
+    take_added can send them to the cache of the main process (add_entries).
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CATEGORY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.fingerprint: str | None = None
+        self.hits = 0
+        self.misses = 0
+        # File given to load, the worker processes load it too
+        self.path: str | None = None
+        self.track_added = False
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._added: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def add_counts(self, hits: int, misses: int) -> None:
+        """Adds the hits and misses of a cache used in a worker process"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def take_added(self) -> tuple[str | None, dict[str, str]]:
+        """Fingerprint and entries added since the last call, with track_added"""
+        with self._lock:
+            added, self._added = self._added, {}
+            return self.fingerprint, added
+
+    def add_entries(self, fingerprint: str | None, entries: dict[str, str]) -> None:
+        """Adds the entries taken from a cache used in a worker process"""
+        if not entries:
+            return
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self._entries.clear()
+                self.fingerprint = fingerprint
+            self._entries.update(entries)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def classify(
+        self, classification: CompiledClassification, description: str
+    ) -> str:
+        """Returns the category of the description using the cached value if any"""
+        key = normalize_description(description)
+        with self._lock:
+            if classification.fingerprint != self.fingerprint:
+                self._entries.clear()
+                self.fingerprint = classification.fingerprint
+            category = self._entries.get(key)
+            if category is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return category
+            self.misses += 1
+
+        category = classification.classify_normalized(key)
+        with self._lock:
+            # Not stored if another thread switched to the rules of a reload
+            if classification.fingerprint == self.fingerprint:
+                self._entries[key] = category
+                if self.track_added:
+                    self._added[key] = category
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return category
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {"rules": self.fingerprint, "entries": dict(self._entries)}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def load(self, path: str) -> None:
+        """Loads the entries saved in path, they are dropped if the rules changed"""
+        self.path = path
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Error reading {path}. Error: {e}")
+            return
+        entries = OrderedDict(data.get("entries", {}))
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        with self._lock:
+            self.fingerprint = data.get("rules")
+            self._entries = entries
+
+
+class Classifier:
+    """
+    Classifies descriptions with the rules of a classification file.
+
+    The file is read the first time a description is classified, not on import.
+    Afterwards its mtime and size are checked at most once every check_interval
+    seconds, and when its content changed the rules are compiled again and
+    swapped in. Classifications running during a reload keep using the previous
+    snapshot of the rules, only the reloads are serialized.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CLASSIFICATION_FILE,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+        cache_size: int = DEFAULT_CATEGORY_CACHE_SIZE,
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        self.cache = CategoryCache(cache_size)
+        self._snapshot: CompiledClassification | None = None
+        self._file_state: tuple[int, int] | None = None
+        self._digest: str | None = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    @property
+    def rules(self) -> CompiledClassification:
+        """Current snapshot of the rules, reloaded if the file changed"""
+        now = time.monotonic()
+        if self._snapshot is None or now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self._reload_if_changed()
+        return self._snapshot
+
+    def _is_current(self, file_state: tuple[int, int] | None) -> bool:
+        return self._snapshot is not None and file_state == self._file_state
+
+    def _reload_if_changed(self, force: bool = False) -> None:
+        try:
+            stat = os.stat(self.path)
+            file_state = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            file_state = None
+        if not force and self._is_current(file_state):
+            return
+
+        with self._reload_lock:
+            # Another thread could have reloaded it while waiting for the lock
+            if not force and self._is_current(file_state):
+                return
+            try:
+                with open(self.path, "r") as f:
+                    content = f.read()
+            except OSError as e:
+                if self._snapshot is None:
+                    print(f"Error reading the classification file. Error: {e}")
+                    self._snapshot = CompiledClassification({})
+                self._file_state = file_state
+                return
+
+            digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            if digest != self._digest or self._snapshot is None:
+                rules = CompiledClassification(
+                    parse_classification(content.splitlines())
+                )
+                self._snapshot = rules
+                self._digest = digest
+            self._file_state = file_state
+
+    def reload(self) -> None:
+        """Reads the classification file again even if it did not change"""
+        self._reload_if_changed(force=True)
+
+    def classify(self, description: str) -> str:
+        return self.cache.classify(self.rules, description)
+
+    def reclassify(self, transactions: Iterable) -> int:
+        """
+        Sets again the category of every transaction with the current rules.
+        transactions is an iterable of Transaction objects, or a store with its
+        own reclassify (TransactionStore, Ledger) whose categories are written
+        back. Returns the amount of transactions whose category changed.
+        """
+        rules = self.rules
+        if hasattr(transactions, "reclassify"):
+            return transactions.reclassify(
+                lambda description: self.cache.classify(rules, description)
+            )
+        changed = 0
+        for transaction in transactions:
+            category = self.cache.classify(rules, transaction.description)
+            if category != transaction.category:
+                transaction.category = category
+                changed += 1
+        return changed
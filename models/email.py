@@ -1,13 +1,206 @@
-from datetime import datetime
+import base64
+import email
+import hashlib
+import email.policy
+from datetime import datetime, timezone
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+import instrumentation
+from models.html_parsing import html_to_soup, html_to_text
+
+NOT_DECRYPTED = "Not decrypted"
+
+
+def has_gmail_body(msg_data: dict) -> bool:
+    """
+    Returns False for the Gmail message resources requested with the 'metadata'
+    format, which only contain the headers
+    """
+    payload = msg_data.get("payload", {})
+    return "body" in payload or "parts" in payload
+
+
+def received_date(value: str) -> str:
+    """
+    Date of an X-Received header: 'by ... with SMTP id ...; <date> (<zone>)'
+    """
+    value = value[value.rfind(";") + 1 :].strip()
+    return value[: value.rfind("(")].strip()
+
+
+def header_date(value: str) -> str:
+    """
+    Date of a Date header in the format of received_date. The header can use
+    any RFC 2822 form (no weekday, obsolete zone names, comments), the value is
+    returned as is when it can not be parsed
+    """
+    try:
+        date_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return value.strip()
+    if date_time.tzinfo is None:
+        # -0000: the zone is unknown, the time is in UTC
+        date_time = date_time.replace(tzinfo=timezone.utc)
+    return date_time.strftime("%a, %d %b %Y %H:%M:%S %z")
+
+
+def _decode_header(value: str) -> str:
+    """Decodes the RFC 2047 encoded words of a raw header ('=?UTF-8?Q?...?=')"""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
 
 
 class Email:
+    """
+    Bank email. The html of the body is kept as raw bytes and it is only parsed
+    the first time body (text) or html_body (BeautifulSoup tree) are accessed.
+    Most banks only need the text, so the tree is not built for them.
+    """
+
     def __init__(self):
+        self.message_id: str = ""
         self.sender: str = ""
         self.subject: str = ""
         self.date_str: str = ""
-        self.html_body: str = ""
-        self.body: str = ""
+        self.raw_body: bytes | None = None
+        self._html_body = None
+        self._body: str | None = None
+
+    @property
+    def body(self) -> str:
+        if self._body is None:
+            if self.raw_body is None:
+                return ""
+            try:
+                self._body = html_to_text(self.raw_body).replace("&nbsp", "\n")
+            except Exception as e:
+                print(f"Error: {e}")
+                self._body = NOT_DECRYPTED
+        return self._body
+
+    @body.setter
+    def body(self, value: str | None) -> None:
+        self._body = value
+
+    @property
+    def html_body(self):
+        if self._html_body is None:
+            if self.raw_body is None:
+                return ""
+            try:
+                self._html_body = html_to_soup(self.raw_body)
+            except Exception as e:
+                print(f"Error: {e}")
+                self._html_body = ""
+        return self._html_body
+
+    @html_body.setter
+    def html_body(self, value) -> None:
+        self._html_body = value
+
+    @classmethod
+    def from_gmail_message(cls, msg_data: dict, decode_body: bool = True) -> "Email":
+        """
+        Builds an Email from a message resource returned by the Gmail API
+        (users.messages.get with the default 'full' format).
+        When decode_body is False only the headers are extracted.
+        """
+        headers = msg_data["payload"]["headers"]
+        current_email = cls()
+        # The Message-ID header replaces it, the same id as from_mime, so the
+        # messages read offline and from the API are the same in the ledger
+        current_email.message_id = msg_data.get("id", "")
+        # Look for Subject and Sender Email in the headers
+        for d in headers:
+            if d["name"].lower() == "message-id" and d["value"].strip():
+                current_email.message_id = d["value"].strip()
+            if d["name"] == "Subject":
+                current_email.subject = d["value"]
+            if d["name"] == "From":
+                current_email.sender = d["value"]
+            if d["name"] == "X-Received":
+                current_email.date_str = received_date(d["value"])
+
+        current_email.body = NOT_DECRYPTED
+        if not decode_body:
+            return current_email
+
+        try:
+            # The Body of the message is in Encrypted format. So, we have to decode it.
+            # Get the data and decode it with base 64 decoder.
+            encoded_body = ""
+            if msg_data["payload"]["body"]["size"] > 0:
+                encoded_body = msg_data["payload"]["body"]["data"]
+            elif len(msg_data["payload"]["parts"]) > 0:
+                part_no = 0
+                if msg_data["payload"]["parts"][0]["mimeType"] == "text/html":
+                    part_no = 0
+                elif msg_data["payload"]["parts"][1]["mimeType"] == "text/html":
+                    part_no = 1
+                encoded_body = msg_data["payload"]["parts"][part_no]["body"]["data"]
+
+            # The html is parsed when the body is accessed
+            with instrumentation.timer("decode", "base64"):
+                current_email.raw_body = base64.urlsafe_b64decode(
+                    encoded_body.encode("UTF-8")
+                )
+            current_email.body = None
+        except Exception as e:
+            print(f"Error: {e}")
+
+        return current_email
+
+    @classmethod
+    def from_mime(cls, raw_message: bytes) -> "Email":
+        """
+        Builds an Email from a raw RFC 822 message, as stored in mbox files,
+        Maildir directories or .eml files. The body is the first text/html
+        part, or the first text/plain part when there is no html.
+        """
+        # compat32 leaves the headers as raw strings, much faster than the
+        # default policy. The encoded words are decoded only for the used ones
+        with instrumentation.timer("decode", "mime"):
+            message = email.message_from_bytes(
+                raw_message, policy=email.policy.compat32
+            )
+        current_email = cls()
+        # Digest of the message for the ones without Message-ID
+        message_id = message.get("Message-ID")
+        if message_id:
+            current_email.message_id = str(message_id).strip()
+        else:
+            current_email.message_id = hashlib.sha1(raw_message).hexdigest()
+        current_email.subject = _decode_header(message.get("Subject", ""))
+        current_email.sender = _decode_header(message.get("From", ""))
+        # Same date as the Gmail messages, with the Date header as fallback
+        received = message.get_all("X-Received")
+        if received:
+            current_email.date_str = received_date(str(received[-1]))
+        else:
+            current_email.date_str = header_date(str(message.get("Date", "")))
+
+        current_email.body = NOT_DECRYPTED
+        try:
+            html_part = None
+            text_part = None
+            for part in message.walk():
+                content_type = part.get_content_type()
+                if content_type == "text/html" and html_part is None:
+                    html_part = part
+                elif content_type == "text/plain" and text_part is None:
+                    text_part = part
+            part = html_part if html_part is not None else text_part
+            if part is not None:
+                # The html is parsed when the body is accessed
+                current_email.raw_body = part.get_payload(decode=True)
+                current_email.body = None
+        except Exception as e:
+            print(f"Error: {e}")
+
+        return current_email
 
     @property
     def datetime(self):
@@ -0,0 +1,115 @@
+"""
+Backends to extract the text of the html emails. The fastest available one is
+used: selectolax, lxml or BeautifulSoup with the builtin html.parser as fallback.
+"""
+
+from bs4 import BeautifulSoup, UnicodeDammit
+
+import instrumentation
+
+try:
+    # The Modest parser (selectolax.parser) was removed in selectolax 1.0
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+AUTO = "auto"
+SELECTOLAX = "selectolax"
+LXML = "lxml"
+HTML_PARSER = "html.parser"
+
+# Their contents are not part of the text, same as BeautifulSoup.get_text
+NON_TEXT_TAGS = ["script", "style", "template"]
+# Tried in order when the html does not declare its charset. The parsers guess
+# latin-1 instead, and charset detection is slow and picks rare code pages
+FALLBACK_ENCODINGS = ["utf-8", "windows-1252"]
+
+_text_backend = AUTO
+
+
+def decode_html(raw_html: bytes | str) -> str:
+    """Decodes the html with its declared charset, else utf-8 or windows-1252"""
+    if isinstance(raw_html, str):
+        return raw_html
+    return UnicodeDammit(raw_html, FALLBACK_ENCODINGS, is_html=True).unicode_markup
+
+
+def _selectolax_text(raw_html: str) -> str:
+    tree = HTMLParser(raw_html)
+    tree.strip_tags(NON_TEXT_TAGS)
+    if tree.root is None:
+        return ""
+    return tree.root.text(deep=True)
+
+
+def _lxml_text(raw_html: str) -> str:
+    tree = lxml.html.fromstring(raw_html)
+    etree.strip_elements(tree, *NON_TEXT_TAGS, with_tail=False)
+    return tree.text_content()
+
+
+def _html_parser_text(raw_html: str) -> str:
+    return BeautifulSoup(raw_html, HTML_PARSER).text
+
+
+TEXT_BACKENDS = {
+    SELECTOLAX: _selectolax_text,
+    LXML: _lxml_text,
+    HTML_PARSER: _html_parser_text,
+}
+
+
+def available_backends() -> list[str]:
+    """Names of the text backends that can be used, fastest first"""
+    backends = []
+    if HTMLParser is not None:
+        backends.append(SELECTOLAX)
+    if lxml is not None:
+        backends.append(LXML)
+    backends.append(HTML_PARSER)
+    return backends
+
+
+def set_text_backend(name: str) -> None:
+    """Selects the backend used by html_to_text, AUTO picks the fastest available"""
+    global _text_backend
+    if name != AUTO and name not in available_backends():
+        raise ValueError(
+            f"HTML backend '{name}' is not available. Options: {available_backends()}"
+        )
+    _text_backend = name
+
+
+def get_text_backend() -> str:
+    return _text_backend
+
+
+def html_to_text(raw_html: bytes) -> str:
+    """Returns the text of the html document without building a BeautifulSoup tree"""
+    name = _text_backend
+    if name == AUTO:
+        name = available_backends()[0]
+    with instrumentation.timer("html_parse", "text"):
+        return TEXT_BACKENDS[name](decode_html(raw_html))
+
+
+def soup_builder() -> str:
+    """
+    Parser of the BeautifulSoup trees: html.parser when it is the selected
+    backend, else lxml when installed (selectolax can not build them)
+    """
+    if lxml is None or _text_backend == HTML_PARSER:
+        return HTML_PARSER
+    return LXML
+
+
+def html_to_soup(raw_html: bytes) -> BeautifulSoup:
+    """Returns the BeautifulSoup tree of the html, used to navigate html tables"""
+    with instrumentation.timer("html_parse", "tree"):
+        return BeautifulSoup(decode_html(raw_html), soup_builder())
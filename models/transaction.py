@@ -2,6 +2,9 @@ from enum import Enum
 from dataclasses import dataclass
 from datetime import datetime
 
+import instrumentation
+from models.classification import Classifier
+
 
 class TransactionType(Enum):
     CARD_MOVEMENT = "card_movement"
@@ -11,56 +14,11 @@ class TransactionType(Enum):
     DEPOSIT = "deposit"
 
 
-classification_list = {}
-
-
-def read_classification():
-    global classification_list
-    with open("classification.txt", "r") as f:
-        lines = f.readlines()
-
-    current_class = ""
-    for line in lines:
-        line = line.strip().lower().replace("\n", "")
-        if len(line) == 0:
-            pass
-        elif line[0] == "#":
-            pass
-        elif line.startswith("class:"):
-            current_class = f"temp{len(classification_list)+1}"
-            if len(line) > 6:
-                line = line[6:].strip()
-                if (len(line) != 0) and (line not in classification_list):
-                    current_class = line.title()
-
-            classification_list[current_class] = [[], []]
-
-        elif line.startswith("include:"):
-            include_list = []
-            if len(line) > 8:
-                line = line[8:].strip()
-                if len(line) != 0:
-                    include_list = line.split(",")
-                    include_list = [i.strip() for i in include_list]
+# Loaded lazily from classification.txt the first time a transaction is classified
+classifier = Classifier()
 
-            classification_list[current_class][0].extend(include_list)
 
-        elif line.startswith("exclude:"):
-            exclude_list = []
-            if len(line) > 8:
-                line = line[8:].strip()
-                if len(line) != 0:
-                    exclude_list = line.split(",")
-                    exclude_list = [i.strip() for i in exclude_list]
-
-            classification_list[current_class][1].extend(exclude_list)
-        else:
-            pass
-
-    return
-
-
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     type: TransactionType
     amount_crc: float
@@ -71,14 +29,49 @@ class Transaction:
     bank_name: str
     amount_raw: str = ""
     category: str = ""
+    # Message-ID header of the email of the transaction, else the Gmail id
+    message_id: str = ""
 
     @property
     def datetime(self):
-        return self.date_time.strftime("%Y-%m-%d_T%H-%M-%S")
+        # Same as strftime("%Y-%m-%d_T%H-%M-%S") without parsing the format
+        dt = self.date_time
+        return (
+            f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+            f"_T{dt.hour:02d}-{dt.minute:02d}-{dt.second:02d}"
+        )
 
     @property
     def date(self):
-        return self.date_time.strftime("%Y-%m-%d")
+        dt = self.date_time
+        return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+
+    def to_record(self) -> tuple:
+        """
+        Compact picklable form of the transaction, a plain tuple of the fields
+        with the type as its value, used to send it between processes
+        """
+        return (
+            self.type.value if isinstance(self.type, TransactionType) else self.type,
+            self.amount_crc,
+            self.amount_usd,
+            self.description,
+            self.date_time,
+            self.card_num,
+            self.bank_name,
+            self.amount_raw,
+            self.category,
+            self.message_id,
+        )
+
+    @classmethod
+    def from_record(cls, record: tuple) -> "Transaction":
+        transaction = cls(*record)
+        try:
+            transaction.type = TransactionType(transaction.type)
+        except ValueError:
+            pass
+        return transaction
 
     def __repr__(self) -> str:
         text: str = ""
@@ -90,27 +83,7 @@ class Transaction:
 
 
     def set_category(self) -> None:
-        description = " " + self.description.lower() + " "
-        description = description.replace(".", " ").replace("*", " ").replace("-", " ")
-        description = description.replace("   ", " ").replace("  ", " ")
-        for category, (include_words, exclude_words) in classification_list.items():
-            excluded = False
-            for word in exclude_words:
-                word = " " + word + " "
-                if excluded:
-                    break
-                if word in description:
-                    excluded = True
-                    break
-            if not excluded:
-                for word in include_words:
-                    word = " " + word + " "
-                    if word in description:
-                        self.category = category
-                        return
-        self.category = ""
+        with instrumentation.timer("classify"):
+            self.category = classifier.classify(self.description)
         return
 
-
-if not classification_list:
-    read_classification()
@@ -0,0 +1,192 @@
+"""
+Columnar container of transactions for big exports and backfills
+"""
+
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator
+
+from models.transaction import Transaction
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EPOCH = datetime(1970, 1, 1)
+# utc_offset value of the datetimes without timezone
+NO_OFFSET = -(2**31)
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+class Categorical:
+    """Interned column: every distinct value is stored once and rows keep its code"""
+
+    def __init__(self):
+        self.values: list = []
+        self.codes = array("I")
+        self._index: dict = {}
+
+    def code(self, value) -> int:
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self._index[value] = code
+            self.values.append(value)
+        return code
+
+    def append(self, value) -> None:
+        self.codes.append(self.code(value))
+
+    def extend(self, values: Iterable) -> None:
+        self.codes.extend([self.code(value) for value in values])
+
+    def __getitem__(self, row: int):
+        return self.values[self.codes[row]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class TransactionStore:
+    """
+    Stores the transactions as columns instead of one object per transaction.
+
+    - amount_crc / amount_usd: typed float arrays
+    - timestamp: wall clock time of date_time as seconds since the epoch, and
+      utc_offset its timezone offset in minutes (NO_OFFSET when it has none)
+    - bank_name, category, card_num and type: interned categorical columns
+    - description, amount_raw and message_id: plain lists
+
+    Supports append/extend like a list of Transaction, and indexing or iterating
+    returns Transaction objects built from the row (the datetimes keep second
+    precision). Changes to those objects are not written back to the store,
+    the categories are changed with reclassify.
+    """
+
+    def __init__(self):
+        self.amount_crc = array("d")
+        self.amount_usd = array("d")
+        self.timestamp = array("q")
+        self.utc_offset = array("i")
+        self.bank_name = Categorical()
+        self.category = Categorical()
+        self.card_num = Categorical()
+        self.type = Categorical()
+        self.description: list[str] = []
+        self.amount_raw: list[str] = []
+        self.message_id: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @staticmethod
+    def _split_datetime(date_time: datetime) -> tuple[int, int]:
+        offset = date_time.utcoffset()
+        wall_clock = date_time.replace(tzinfo=None) - EPOCH
+        seconds = wall_clock.days * 86400 + wall_clock.seconds
+        if offset is None:
+            return seconds, NO_OFFSET
+        return seconds, int(offset.total_seconds() // 60)
+
+    def append(self, transaction: Transaction) -> None:
+        self.extend((transaction,))
+
+    def extend(
+        self, transactions: Iterable[Transaction], chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> None:
+        """Appends the transactions, converting them to columns chunk by chunk"""
+        chunk: list[Transaction] = []
+        for transaction in transactions:
+            chunk.append(transaction)
+            if len(chunk) >= chunk_size:
+                self._append_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._append_chunk(chunk)
+
+    def _append_chunk(self, chunk: list[Transaction]) -> None:
+        datetimes = [self._split_datetime(ts.date_time) for ts in chunk]
+        self.timestamp.extend([seconds for seconds, _ in datetimes])
+        self.utc_offset.extend([offset for _, offset in datetimes])
+        self.amount_crc.extend([float(ts.amount_crc) for ts in chunk])
+        self.amount_usd.extend([float(ts.amount_usd) for ts in chunk])
+        self.bank_name.extend([ts.bank_name for ts in chunk])
+        self.category.extend([ts.category for ts in chunk])
+        self.card_num.extend([ts.card_num for ts in chunk])
+        self.type.extend([ts.type for ts in chunk])
+        self.description.extend([ts.description for ts in chunk])
+        self.amount_raw.extend([ts.amount_raw for ts in chunk])
+        self.message_id.extend([ts.message_id for ts in chunk])
+
+    def date_time(self, row: int) -> datetime:
+        date_time = EPOCH + timedelta(seconds=self.timestamp[row])
+        offset = self.utc_offset[row]
+        if offset == NO_OFFSET:
+            return date_time
+        return date_time.replace(tzinfo=timezone(timedelta(minutes=offset)))
+
+    def __getitem__(self, row: int) -> Transaction:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("TransactionStore index out of range")
+        return Transaction(
+            type=self.type[row],
+            amount_crc=self.amount_crc[row],
+            amount_usd=self.amount_usd[row],
+            description=self.description[row],
+            date_time=self.date_time(row),
+            card_num=self.card_num[row],
+            bank_name=self.bank_name[row],
+            amount_raw=self.amount_raw[row],
+            category=self.category[row],
+            message_id=self.message_id[row],
+        )
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def reclassify(self, classify: Callable[[str], str]) -> int:
+        """
+        Sets the category of every row to classify(description). Returns the
+        amount of rows whose category changed
+        """
+        codes = self.category.codes
+        changed = 0
+        for row, description in enumerate(self.description):
+            code = self.category.code(classify(description))
+            if code != codes[row]:
+                codes[row] = code
+                changed += 1
+        return changed
+
+    def as_numpy(self) -> dict:
+        """
+        Returns the numeric and categorical columns as numpy arrays sharing the
+        memory of the store (no copy). The categorical values are in
+        <column>_values. Requires numpy.
+        The store cannot grow while the returned arrays are alive.
+        """
+        if numpy is None:
+            raise ImportError("numpy is required for TransactionStore.as_numpy")
+        columns = {
+            "amount_crc": numpy.frombuffer(self.amount_crc, dtype=numpy.float64),
+            "amount_usd": numpy.frombuffer(self.amount_usd, dtype=numpy.float64),
+            "timestamp": numpy.frombuffer(self.timestamp, dtype=numpy.int64),
+            "utc_offset": numpy.frombuffer(self.utc_offset, dtype=numpy.int32),
+        }
+        for name in ("bank_name", "category", "card_num", "type"):
+            column: Categorical = getattr(self, name)
+            columns[name] = numpy.frombuffer(column.codes, dtype=numpy.uint32)
+            columns[name + "_values"] = list(column.values)
+        return columns
+
+    @classmethod
+    def from_transactions(
+        cls, transactions: Iterable[Transaction]
+    ) -> "TransactionStore":
+        store = cls()
+        store.extend(transactions)
+        return store
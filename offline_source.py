@@ -0,0 +1,189 @@
+"""
+Offline source of emails: Google Takeout mbox files, Maildir directories and
+.eml files. The emails go through the same process_email path as the ones
+downloaded from Gmail, without credentials, and are parsed in a pool of worker
+processes to backfill years of history at CPU speed.
+"""
+
+import mmap
+import os
+import re
+from multiprocessing.util import Finalize
+from typing import Iterable, Iterator
+
+from email_processing import process_email
+from models.email import Email
+from models.transaction import Transaction
+from models.transaction_store import TransactionStore
+from parse_pool import DEFAULT_CHUNK_SIZE, DEFAULT_PROCESSES, map_in_processes
+
+MBOX_SEPARATOR = b"\nFrom "
+# Lines of the messages starting with 'From ' are quoted with '>' in the mbox
+# files (mboxrd), and a line already quoted gets one more '>'
+QUOTED_FROM = re.compile(rb"^>(>*From )", re.MULTILINE)
+EML_EXTENSION = ".eml"
+MAILDIR_SUBDIRS = ("new", "cur")
+
+# Location of a message: (path, start, end) where start and end are the byte
+# offsets of the message inside an mbox file, end is -1 for a whole file
+MessageRef = tuple[str, int, int]
+
+# Memory maps of the mbox files opened by this process
+_mboxes: dict[str, mmap.mmap] = {}
+# Process that registered the closing of _mboxes at exit, the forked workers
+# inherit the module state but not the registration
+_close_registered_pid: int | None = None
+
+
+def _map_file(path: str) -> mmap.mmap | None:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        # The map stays valid after closing the file
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def mbox_offsets(path: str) -> Iterator[tuple[int, int]]:
+    """
+    Yields the (start, end) offsets of every message of the mbox file, without
+    its 'From ' separator line. The file is memory mapped, so only the pages
+    around the separators are read.
+    """
+    mbox = _map_file(path)
+    if mbox is None:
+        return
+    with mbox:
+        size = len(mbox)
+        if mbox[:5] == b"From ":
+            position = 0
+        else:
+            position = mbox.find(MBOX_SEPARATOR) + 1
+            if position == 0:
+                return
+        while True:
+            start = mbox.find(b"\n", position) + 1
+            if start == 0:
+                return
+            separator = mbox.find(MBOX_SEPARATOR, start - 1)
+            end = size if separator == -1 else separator + 1
+            if end > start:
+                yield start, end
+            if separator == -1:
+                return
+            position = separator + 1
+
+
+def _maildir_files(path: str) -> Iterator[str]:
+    for subdir in MAILDIR_SUBDIRS:
+        directory = os.path.join(path, subdir)
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if not name.startswith("."):
+                    yield os.path.join(directory, name)
+
+
+def _eml_files(path: str) -> Iterator[str]:
+    for directory, subdirs, names in os.walk(path):
+        subdirs.sort()
+        for name in sorted(names):
+            if name.lower().endswith(EML_EXTENSION):
+                yield os.path.join(directory, name)
+
+
+def is_maildir(path: str) -> bool:
+    return all(os.path.isdir(os.path.join(path, name)) for name in MAILDIR_SUBDIRS)
+
+
+def list_offline_messages(paths: Iterable[str]) -> Iterator[MessageRef]:
+    """
+    Yields the location of every message in paths. Each path can be an mbox
+    file, a .eml file, a Maildir directory or a directory with .eml files
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = _maildir_files(path) if is_maildir(path) else _eml_files(path)
+            for file_name in files:
+                yield file_name, 0, -1
+        elif path.lower().endswith(EML_EXTENSION):
+            yield path, 0, -1
+        else:
+            for start, end in mbox_offsets(path):
+                yield path, start, end
+
+
+def read_message(ref: MessageRef) -> bytes:
+    path, start, end = ref
+    if end < 0:
+        with open(path, "rb") as f:
+            return f.read()
+    global _close_registered_pid
+    mbox = _mboxes.get(path)
+    if mbox is None:
+        if _close_registered_pid != os.getpid():
+            # Unlike atexit, also called when a worker process of the pool exits
+            Finalize(None, close_mboxes, exitpriority=0)
+            _close_registered_pid = os.getpid()
+        mbox = _mboxes[path] = _map_file(path)
+    return unquote_from(mbox[start:end])
+
+
+def close_mboxes() -> None:
+    """Closes the memory maps of the mbox files opened by this process"""
+    while _mboxes:
+        _, mbox = _mboxes.popitem()
+        if mbox is not None:
+            mbox.close()
+
+
+def unquote_from(raw_message: bytes) -> bytes:
+    """Removes the '>' added to the lines starting with 'From ' in the mbox"""
+    if b">From " not in raw_message:
+        return raw_message
+    return QUOTED_FROM.sub(rb"\1", raw_message)
+
+
+def parse_messages(refs: list[MessageRef]) -> tuple[int, list[Transaction]]:
+    """
+    Processes the messages, runs in the worker processes.
+    Returns the amount of bank emails and their transactions.
+    """
+    processed = 0
+    transactions: list[Transaction] = []
+    for ref in refs:
+        try:
+            raw_message = read_message(ref)
+        except OSError as e:
+            print(f"Error reading {ref[0]}. Error: {e}")
+            continue
+        if process_email(Email.from_mime(raw_message), transactions):
+            processed += 1
+    return processed, transactions
+
+
+def process_offline(
+    paths: Iterable[str],
+    transactions_to_export: list[Transaction] | TransactionStore,
+    processes: int = DEFAULT_PROCESSES,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """
+    Processes every email of the offline sources in paths, appending the
+    transactions to transactions_to_export in the same order as the emails.
+    """
+    messages_len = 0
+    processed_len = 0
+    refs = list_offline_messages(paths)
+    try:
+        for chunk, (processed, transactions) in map_in_processes(
+            parse_messages, refs, chunk_size, processes
+        ):
+            messages_len += len(chunk)
+            processed_len += processed
+            for transaction in transactions:
+                transactions_to_export.append(transaction)
+            print(f"Parsing emails: {messages_len}", end="\r", flush=True)
+    finally:
+        # The worker processes close theirs when they exit
+        close_mboxes()
+
+    print(f"Finished parsing {messages_len} emails, {processed_len} from banks\n")
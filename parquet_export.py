@@ -0,0 +1,260 @@
+"""
+Export of the transactions to a Parquet dataset partitioned by month, and the
+matching reader. The dataset can be queried again by date range without
+processing the emails. Requires pyarrow.
+
+Layout: <root>/month=YYYY-MM/<file>.parquet, with the columns of SCHEMA.
+"""
+
+import os
+from array import array
+from datetime import datetime
+from typing import Iterable
+
+import instrumentation
+from models.transaction import Transaction, TransactionType
+from models.transaction_store import NO_OFFSET, Categorical, TransactionStore
+
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pyarrow = None
+
+DEFAULT_PARQUET_DIR = "transactions_parquet"
+PARTITION_COLUMN = "month"
+# Identify a transaction of an email without message id when merging with the
+# rows already in the dataset
+KEY_COLUMNS = ["date_time", "bank_name", "card_num", "amount_crc", "amount_usd"]
+
+if pyarrow is not None:
+    _DICTIONARY = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    SCHEMA = pyarrow.schema(
+        [
+            # Wall clock time of the transaction, utc_offset in minutes is null
+            # when the date had no timezone
+            ("date_time", pyarrow.timestamp("s")),
+            ("utc_offset", pyarrow.int32()),
+            ("amount_crc", pyarrow.float64()),
+            ("amount_usd", pyarrow.float64()),
+            ("amount_raw", pyarrow.string()),
+            ("description", pyarrow.string()),
+            ("bank_name", _DICTIONARY),
+            ("category", _DICTIONARY),
+            ("card_num", _DICTIONARY),
+            ("type", _DICTIONARY),
+            # Null in the datasets written before it was added
+            ("message_id", pyarrow.string()),
+        ]
+    )
+    # Parquet has no second precision timestamps, they are read back as ms
+    # unless the dataset is opened with this schema
+    DATASET_SCHEMA = SCHEMA.append(pyarrow.field(PARTITION_COLUMN, pyarrow.string()))
+    PARTITIONING = ds.partitioning(
+        pyarrow.schema([(PARTITION_COLUMN, pyarrow.string())]), flavor="hive"
+    )
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        raise ImportError("pyarrow is required for the Parquet export")
+
+
+def _from_array(values: array, arrow_type):
+    """Arrow array sharing the memory of values (no copy)"""
+    return pyarrow.Array.from_buffers(
+        arrow_type, len(values), [None, pyarrow.py_buffer(values)]
+    )
+
+
+def _to_array(arrow_array, typecode: str, null_value=0) -> array:
+    """Copies a primitive arrow array to a typed array, nulls become null_value"""
+    if arrow_array.null_count:
+        arrow_array = arrow_array.fill_null(null_value)
+    values = array(typecode)
+    start = arrow_array.offset * values.itemsize
+    end = start + len(arrow_array) * values.itemsize
+    values.frombytes(memoryview(arrow_array.buffers()[1])[start:end])
+    return values
+
+
+def _dictionary_column(column: Categorical, convert=None):
+    values = column.values if convert is None else [convert(v) for v in column.values]
+    indices = _from_array(column.codes, pyarrow.uint32()).cast(pyarrow.int32())
+    return pyarrow.DictionaryArray.from_arrays(
+        indices, pyarrow.array(values, pyarrow.string())
+    )
+
+
+def store_to_table(store: TransactionStore):
+    """Arrow table with the columns of SCHEMA plus the month partition column"""
+    _require_pyarrow()
+    date_time = _from_array(store.timestamp, pyarrow.timestamp("s"))
+    utc_offset = _from_array(store.utc_offset, pyarrow.int32())
+    utc_offset = pc.if_else(pc.equal(utc_offset, NO_OFFSET), None, utc_offset)
+    columns = [
+        date_time,
+        utc_offset,
+        _from_array(store.amount_crc, pyarrow.float64()),
+        _from_array(store.amount_usd, pyarrow.float64()),
+        pyarrow.array(store.amount_raw, pyarrow.string()),
+        pyarrow.array(store.description, pyarrow.string()),
+        _dictionary_column(store.bank_name),
+        _dictionary_column(store.category),
+        _dictionary_column(store.card_num),
+        _dictionary_column(store.type, lambda value: getattr(value, "value", value)),
+        pyarrow.array(store.message_id, pyarrow.string()),
+        pc.strftime(date_time, "%Y-%m"),
+    ]
+    return pyarrow.Table.from_arrays(columns, schema=DATASET_SCHEMA)
+
+
+def _open_dataset(root: str):
+    return ds.dataset(
+        root, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING
+    )
+
+
+def _row_keys(table):
+    """
+    Key of every row: the message id, or the KEY_COLUMNS for the rows without
+    one (written before it was stored, or by sources without ids)
+    """
+    fields = [
+        pc.cast(table.column(name), pyarrow.string()).fill_null("")
+        for name in KEY_COLUMNS
+    ]
+    fallback = pc.binary_join_element_wise(*fields, "|")
+    message_id = table.column("message_id").fill_null("")
+    return pc.if_else(pc.equal(message_id, ""), fallback, message_id)
+
+
+def merge_with_dataset(table, root: str = DEFAULT_PARQUET_DIR):
+    """
+    Adds to table the rows of the dataset at root in the months of table, so
+    rewriting those months keeps their history. When a transaction is in both,
+    the row of table is kept.
+    """
+    if not os.path.isdir(root):
+        return table
+    months = pc.unique(table.column(PARTITION_COLUMN))
+    existing = _open_dataset(root).to_table(
+        filter=ds.field(PARTITION_COLUMN).isin(months)
+    )
+    if existing.num_rows == 0:
+        return table
+    combined = pyarrow.concat_tables([existing, table]).unify_dictionaries()
+    combined = combined.combine_chunks()
+    # The last row of every key wins, the ones of table come after the existing
+    rows = pyarrow.table(
+        {"key": _row_keys(combined), "row": pyarrow.array(range(len(combined)))}
+    )
+    last_rows = rows.group_by("key").aggregate([("row", "max")]).column("row_max")
+    return combined.take(last_rows).sort_by("date_time")
+
+
+def export_to_parquet(
+    transactions: TransactionStore | Iterable[Transaction],
+    root: str = DEFAULT_PARQUET_DIR,
+) -> None:
+    """
+    Writes the transactions to the dataset at root. The months present in
+    transactions are rewritten with their rows merged with the ones already
+    in the dataset (merge_with_dataset), the other months are not touched.
+    """
+    _require_pyarrow()
+    if not isinstance(transactions, TransactionStore):
+        transactions = TransactionStore.from_transactions(transactions)
+    print("Exporting", len(transactions), "transactions to", root)
+    if len(transactions) == 0:
+        print("No data to export")
+        return
+
+    with instrumentation.timer("export", "parquet"):
+        table = merge_with_dataset(store_to_table(transactions), root)
+        ds.write_dataset(
+            table,
+            root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            existing_data_behavior="delete_matching",
+        )
+    print("Finished exporting!\n")
+
+
+def _month(value: datetime) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def _categorical(arrow_column, convert=None) -> Categorical:
+    column = Categorical()
+    arrow_column = arrow_column.combine_chunks()
+    if not pyarrow.types.is_dictionary(arrow_column.type):
+        arrow_column = arrow_column.dictionary_encode()
+    values = arrow_column.dictionary.to_pylist()
+    if convert is not None:
+        values = [convert(value) for value in values]
+    # Codes of the values of the dictionary, several can map to the same value
+    codes = array("I", [column.code(value) for value in values])
+    if column.values == values:
+        column.codes = _to_array(arrow_column.indices.cast(pyarrow.uint32()), "I")
+    else:
+        indices = arrow_column.indices.to_pylist()
+        column.codes = array("I", [codes[index] for index in indices])
+    return column
+
+
+def _transaction_type(value):
+    try:
+        return TransactionType(value)
+    except ValueError:
+        return value
+
+
+def read_parquet(
+    root: str = DEFAULT_PARQUET_DIR,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> TransactionStore:
+    """
+    Loads the transactions with start <= date_time < end (wall clock time) from
+    the dataset at root. Only the files of the months in the range are read,
+    and the rows are filtered while reading.
+    """
+    _require_pyarrow()
+    dataset = _open_dataset(root)
+    timestamp_type = SCHEMA.field("date_time").type
+    conditions = []
+    # The month conditions skip the partitions out of the range without opening
+    # them, the date_time ones are checked against the row group statistics
+    if start is not None:
+        start = pyarrow.scalar(start.replace(tzinfo=None), timestamp_type)
+        conditions.append(ds.field(PARTITION_COLUMN) >= _month(start.as_py()))
+        conditions.append(ds.field("date_time") >= start)
+    if end is not None:
+        end = pyarrow.scalar(end.replace(tzinfo=None), timestamp_type)
+        conditions.append(ds.field(PARTITION_COLUMN) <= _month(end.as_py()))
+        conditions.append(ds.field("date_time") < end)
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+    table = dataset.to_table(columns=SCHEMA.names, filter=condition)
+    table = table.sort_by("date_time")
+
+    store = TransactionStore()
+    timestamps = table.column("date_time").combine_chunks().cast(pyarrow.int64())
+    store.timestamp = _to_array(timestamps, "q")
+    store.utc_offset = _to_array(
+        table.column("utc_offset").combine_chunks(), "i", NO_OFFSET
+    )
+    store.amount_crc = _to_array(table.column("amount_crc").combine_chunks(), "d")
+    store.amount_usd = _to_array(table.column("amount_usd").combine_chunks(), "d")
+    store.amount_raw = table.column("amount_raw").to_pylist()
+    store.description = table.column("description").to_pylist()
+    store.message_id = table.column("message_id").fill_null("").to_pylist()
+    store.bank_name = _categorical(table.column("bank_name"))
+    store.category = _categorical(table.column("category"))
+    store.card_num = _categorical(table.column("card_num"))
+    store.type = _categorical(table.column("type"), _transaction_type)
+    return store
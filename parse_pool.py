@@ -0,0 +1,123 @@
+"""
+Pool of worker processes for the CPU bound part of the processing (decoding,
+html parsing, regex extraction and classification), so it scales with the
+cores instead of running on the same thread as the downloads.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import instrumentation
+from models.html_parsing import get_text_backend, set_text_backend
+from models.transaction import classifier
+
+DEFAULT_PROCESSES = os.cpu_count() or 1
+# Items sent to a worker in each call, big enough to amortize the pickling
+DEFAULT_CHUNK_SIZE = 100
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _init_worker(
+    text_backend: str, instrumentation_settings: tuple, category_cache: str | None
+) -> None:
+    # The worker processes do not inherit the settings of the parent when
+    # they are spawned
+    set_text_backend(text_backend)
+    instrumentation.configure(*instrumentation_settings)
+    if category_cache is not None:
+        classifier.cache.load(category_cache)
+    classifier.cache.track_added = True
+
+
+def new_process_pool(processes: int) -> ProcessPoolExecutor:
+    """Process pool whose workers use the same settings as this process"""
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(
+            get_text_backend(),
+            instrumentation.settings(),
+            classifier.cache.path,
+        ),
+    )
+
+
+def _run_in_worker(function: Callable, *args) -> tuple:
+    """
+    Calls function in a worker process and returns its result, the category
+    cache hits, misses, fingerprint and new entries of the call, and the
+    measures taken during the call (None when the instrumentation is disabled)
+    """
+    cache = classifier.cache
+    hits, misses = cache.hits, cache.misses
+    if instrumentation.enabled:
+        value, measures = instrumentation.collect(function, *args)
+    else:
+        value, measures = function(*args), None
+    fingerprint, added = cache.take_added()
+    counters = (cache.hits - hits, cache.misses - misses, fingerprint, added)
+    return value, counters, measures
+
+
+def submit(executor: ProcessPoolExecutor, function: Callable, *args) -> Future:
+    """
+    executor.submit that also brings back the category cache counters and new
+    entries and the measures of the worker, see result
+    """
+    return executor.submit(_run_in_worker, function, *args)
+
+
+def result(future: Future):
+    """
+    Result of a future returned by submit, merging the worker category cache
+    and measures into the ones of this process
+    """
+    value, (hits, misses, fingerprint, added), measures = future.result()
+    classifier.cache.add_counts(hits, misses)
+    classifier.cache.add_entries(fingerprint, added)
+    if measures is not None:
+        instrumentation.merge(measures)
+    return value
+
+
+def map_in_processes(
+    function: Callable[[list[T]], R],
+    items: Iterable[T],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    processes: int = DEFAULT_PROCESSES,
+) -> Iterator[tuple[list[T], R]]:
+    """
+    Calls function with consecutive chunks of items in worker processes and
+    yields (chunk, result) in the same order as items. function must be defined
+    at module level and the chunks and results must be picklable.
+
+    items is consumed lazily and only a bounded amount of chunks is submitted
+    ahead of the consumer. With a single process everything runs in this one.
+    """
+    chunk_size = max(1, chunk_size)
+    items = iter(items)
+    if processes <= 1:
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return
+            yield chunk, function(chunk)
+
+    max_in_flight = processes * 2
+    in_flight: deque = deque()
+    with new_process_pool(processes) as executor:
+        while True:
+            while len(in_flight) < max_in_flight:
+                chunk = list(islice(items, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append((chunk, submit(executor, function, chunk)))
+            if not in_flight:
+                return
+            chunk, future = in_flight.popleft()
+            yield chunk, result(future)
@@ -0,0 +1,328 @@
+"""
+Asyncio pipeline processing the Gmail messages in stages connected by bounded
+queues:
+
+    list ids -> fetch (batch requests) -> parse (decode, extract, classify) -> sink
+
+Every stage has its own amount of workers. The Google client calls run in a
+thread pool and the parsing in a thread or process pool, so the stages overlap:
+the first transactions reach the sink while the listing is still paging. A
+bounded amount of chunks is in flight at any time, so the memory used does not
+depend on the amount of messages. The transactions reach the sink in the same
+order as the messages.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Iterable
+
+from email_processing import needs_body, parse_gmail_chunk, parse_gmail_message
+from gmail_client import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_WORKERS,
+    FORMAT_FULL,
+    MAX_BATCH_MODIFY_IDS,
+    RateLimiter,
+    fetch_messages,
+    fetch_messages_two_phase,
+    mark_as_read,
+)
+from message_cache import OUTCOME_IGNORED, OUTCOME_PROCESSED, MessageCache
+from models.email import Email, has_gmail_body
+from models.transaction import Transaction
+from parse_pool import new_process_pool, result, submit
+
+# Chunks waiting between two stages
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_PARSE_WORKERS = 1
+
+
+@dataclass
+class PipelineStats:
+    messages: int = 0
+    # Transactions appended to the sink, reported by run_pipeline
+    transactions: int = 0
+    # Seconds since the start until the first transaction reached the sink
+    first_transaction: float | None = None
+    # Seconds spent by each stage in its blocking calls, summed over workers
+    stage_seconds: dict[str, float] = field(
+        default_factory=lambda: {"list": 0.0, "fetch": 0.0, "parse": 0.0, "sink": 0.0}
+    )
+    unmarked: list[str] = field(default_factory=list)
+
+
+def _metadata_needs_body(msg_data: dict) -> bool:
+    return needs_body(Email.from_gmail_message(msg_data, decode_body=False))
+
+
+def _parse_chunk(
+    items: list[tuple[str, dict | None]],
+) -> list[tuple[bool | None, list[Transaction]]]:
+    """Same as parse_gmail_chunk without converting the transactions to records"""
+    results = []
+    for _, msg_data in items:
+        if msg_data is None:
+            results.append((None, []))
+        else:
+            results.append(parse_gmail_message(msg_data))
+    return results
+
+
+class Pipeline:
+    """
+    One run of the pipeline. messages are the message dicts returned by
+    list_messages or list_history_messages, consumed lazily. service_factory
+    builds the Gmail service of every fetch thread.
+
+    batch_size is the size of the chunks moving through the stages (one Gmail
+    batch request each), fetch_workers the threads sending batch requests,
+    parse_workers the chunks parsed at the same time (in processes when
+    processes > 1) and queue_size the chunks waiting between stages.
+    """
+
+    def __init__(
+        self,
+        service_factory: Callable[[], object],
+        messages: Iterable[dict],
+        transactions_to_export,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        fetch_workers: int = DEFAULT_WORKERS,
+        parse_workers: int = DEFAULT_PARSE_WORKERS,
+        processes: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        limiter: RateLimiter | None = None,
+        cache: MessageCache | None = None,
+        metadata_first: bool = False,
+        mark_read: bool = False,
+    ):
+        self.service_factory = service_factory
+        self.messages = messages
+        self.transactions_to_export = transactions_to_export
+        self.batch_size = max(1, batch_size)
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = max(1, parse_workers, processes)
+        self.processes = processes
+        self.queue_size = max(1, queue_size)
+        self.limiter = limiter
+        self.cache = cache
+        self.metadata_first = metadata_first
+        self.mark_read = mark_read
+        self.stats = PipelineStats()
+        self._thread_data = threading.local()
+
+    def run(self) -> PipelineStats:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> PipelineStats:
+        self._started = time.perf_counter()
+        ids_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        fetched_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        parsed_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        # Chunks between the list stage and the sink. Bounds the chunks waiting
+        # to be reordered in the sink when one of them is slow
+        self._window = asyncio.Semaphore(
+            self.queue_size * 3 + self.fetch_workers + self.parse_workers
+        )
+
+        # One extra thread for the listing
+        self._io_executor = ThreadPoolExecutor(max_workers=self.fetch_workers + 1)
+        if self.processes > 1:
+            self._parse_executor = new_process_pool(self.processes)
+        else:
+            self._parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers)
+
+        tasks = [
+            asyncio.create_task(self._list_stage(ids_queue)),
+            asyncio.create_task(
+                self._run_workers(
+                    self.fetch_workers,
+                    lambda: self._fetch_stage(ids_queue, fetched_queue),
+                    fetched_queue,
+                    self.parse_workers,
+                )
+            ),
+            asyncio.create_task(
+                self._run_workers(
+                    self.parse_workers,
+                    lambda: self._parse_stage(fetched_queue, parsed_queue),
+                    parsed_queue,
+                    1,
+                )
+            ),
+            asyncio.create_task(self._sink_stage(parsed_queue)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self._io_executor.shutdown(wait=True, cancel_futures=True)
+            self._parse_executor.shutdown(wait=True, cancel_futures=True)
+        return self.stats
+
+    async def _timed(self, stage: str, executor, function, *args):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, function, *args)
+        finally:
+            self.stats.stage_seconds[stage] += time.perf_counter() - started
+
+    async def _timed_in_process(self, stage: str, function, *args):
+        # submit and result also bring back the cache counters and the
+        # instrumentation of the worker
+        started = time.perf_counter()
+        try:
+            future = submit(self._parse_executor, function, *args)
+            await asyncio.wrap_future(future)
+            return result(future)
+        finally:
+            self.stats.stage_seconds[stage] += time.perf_counter() - started
+
+    async def _run_workers(self, count: int, worker, out_queue, consumers: int):
+        await asyncio.gather(*(worker() for _ in range(count)))
+        # Tells every worker of the next stage that there is nothing else
+        for _ in range(consumers):
+            await out_queue.put(None)
+
+    def _take_ids(self, messages) -> list[str]:
+        return [msg["id"] for msg in islice(messages, self.batch_size)]
+
+    async def _list_stage(self, ids_queue: asyncio.Queue) -> None:
+        # The pages are requested from a single thread, the service used by
+        # messages is only used by this stage
+        messages = iter(self.messages)
+        sequence = 0
+        while True:
+            await self._window.acquire()
+            chunk = await self._timed(
+                "list", self._io_executor, self._take_ids, messages
+            )
+            if not chunk:
+                self._window.release()
+                break
+            await ids_queue.put((sequence, chunk))
+            sequence += 1
+        for _ in range(self.fetch_workers):
+            await ids_queue.put(None)
+
+    def _thread_service(self):
+        # The Gmail service is not thread safe, each thread builds its own
+        if not hasattr(self._thread_data, "service"):
+            self._thread_data.service = self.service_factory()
+        return self._thread_data.service
+
+    def _fetch_chunk(self, ids: list[str]) -> list[tuple[str, dict | None]]:
+        service = self._thread_service()
+
+        def fetch(ids, message_format: str = FORMAT_FULL):
+            return fetch_messages(
+                service, ids, self.batch_size, self.limiter, message_format
+            )
+
+        if self.metadata_first:
+            return list(
+                fetch_messages_two_phase(ids, fetch, _metadata_needs_body, len(ids))
+            )
+        return list(fetch(ids))
+
+    async def _fetch_stage(self, ids_queue, fetched_queue) -> None:
+        while True:
+            item = await ids_queue.get()
+            if item is None:
+                return
+            sequence, chunk = item
+            # The cache is only used from the event loop thread, sqlite
+            # connections cannot be shared between threads
+            cached = self.cache.get_many(chunk) if self.cache is not None else {}
+            missing = [msg_id for msg_id in chunk if msg_id not in cached]
+            fetched = {}
+            if missing:
+                fetched = dict(
+                    await self._timed(
+                        "fetch", self._io_executor, self._fetch_chunk, missing
+                    )
+                )
+                if self.cache is not None:
+                    for msg_id, msg_data in fetched.items():
+                        if msg_data is not None and has_gmail_body(msg_data):
+                            self.cache.put(msg_id, msg_data)
+            items = [
+                (msg_id, cached[msg_id] if msg_id in cached else fetched.get(msg_id))
+                for msg_id in chunk
+            ]
+            await fetched_queue.put((sequence, items))
+
+    async def _parse_stage(self, fetched_queue, parsed_queue) -> None:
+        while True:
+            item = await fetched_queue.get()
+            if item is None:
+                return
+            sequence, items = item
+            if self.processes > 1:
+                results = await self._timed_in_process(
+                    "parse", parse_gmail_chunk, items
+                )
+                results = [
+                    (success, [Transaction.from_record(r) for r in records])
+                    for success, records in results
+                ]
+            else:
+                results = await self._timed(
+                    "parse", self._parse_executor, _parse_chunk, items
+                )
+            ids = [msg_id for msg_id, _ in items]
+            await parsed_queue.put((sequence, ids, results))
+
+    async def _sink_stage(self, parsed_queue) -> None:
+        # Chunks arrive in any order, they are written in the order of sequence
+        pending: dict[int, tuple] = {}
+        next_sequence = 0
+        to_mark_as_read: list[str] = []
+        while True:
+            item = await parsed_queue.get()
+            if item is None:
+                break
+            sequence, ids, results = item
+            pending[sequence] = (ids, results)
+            while next_sequence in pending:
+                ids, results = pending.pop(next_sequence)
+                next_sequence += 1
+                started = time.perf_counter()
+                for msg_id, (success, transactions) in zip(ids, results):
+                    self.stats.messages += 1
+                    if success is None:
+                        continue
+                    for transaction in transactions:
+                        self.transactions_to_export.append(transaction)
+                    if transactions and self.stats.first_transaction is None:
+                        self.stats.first_transaction = started - self._started
+                    self.stats.transactions += len(transactions)
+                    if self.cache is not None:
+                        self.cache.set_outcome(
+                            msg_id, OUTCOME_PROCESSED if success else OUTCOME_IGNORED
+                        )
+                    if success and self.mark_read:
+                        to_mark_as_read.append(msg_id)
+                self.stats.stage_seconds["sink"] += time.perf_counter() - started
+                print(f"Parsing emails: {self.stats.messages}", end="\r", flush=True)
+                self._window.release()
+                if len(to_mark_as_read) >= MAX_BATCH_MODIFY_IDS:
+                    await self._mark_as_read(to_mark_as_read)
+                    to_mark_as_read = []
+        if to_mark_as_read:
+            await self._mark_as_read(to_mark_as_read)
+
+    async def _mark_as_read(self, ids: list[str]) -> None:
+        loop = asyncio.get_running_loop()
+        unmarked = await loop.run_in_executor(
+            self._io_executor,
+            lambda: mark_as_read(self._thread_service(), ids, self.limiter),
+        )
+        self.stats.unmarked.extend(unmarked)
@@ -0,0 +1,201 @@
+"""
+Summary reports of the extracted transactions: monthly totals per category and
+bank, top merchants and card breakdown. The group-by operations run vectorized
+with numpy when it is installed, with a pure python fallback.
+"""
+
+import csv
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Sequence
+
+from models.transaction import Transaction
+from models.transaction_store import EPOCH, TransactionStore
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_TOP_MERCHANTS = 25
+SECONDS_PER_DAY = 86400
+
+
+@dataclass
+class ReportTable:
+    name: str
+    headers: list[str]
+    rows: list[list]
+
+
+def _month_codes(store: TransactionStore):
+    """Months since 1970-01 of the wall clock time of every transaction"""
+    if numpy is not None:
+        seconds = numpy.frombuffer(store.timestamp, dtype=numpy.int64)
+        months = seconds.astype("datetime64[s]").astype("datetime64[M]")
+        return months.astype(numpy.int64)
+
+    # Most transactions share their day with others, each day is converted once
+    day_codes: dict[int, int] = {}
+    codes = []
+    for seconds in store.timestamp:
+        day = seconds // SECONDS_PER_DAY
+        code = day_codes.get(day)
+        if code is None:
+            date = EPOCH + timedelta(days=day)
+            code = day_codes[day] = (date.year - 1970) * 12 + date.month - 1
+        codes.append(code)
+    return codes
+
+
+def _month_label(code: int) -> str:
+    return f"{1970 + code // 12:04d}-{code % 12 + 1:02d}"
+
+
+def _intern(values: Sequence) -> tuple[list[int], list]:
+    """Returns the code of every value and the distinct values"""
+    index: dict = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return codes, list(index)
+
+
+def _aggregate(key_columns: list, amount_crc, amount_usd) -> list[tuple]:
+    """
+    Groups the rows by the combination of the integer key columns.
+    Returns (key tuple, count, total crc, total usd) for every group.
+    """
+    if not key_columns or len(amount_crc) == 0:
+        return []
+
+    if numpy is not None:
+        columns = [numpy.asarray(col, dtype=numpy.int64) for col in key_columns]
+        minimums = [int(col.min()) for col in columns]
+        sizes = [int(col.max()) - low + 1 for col, low in zip(columns, minimums)]
+        # Mixed radix encoding of the key columns in a single integer key
+        key = numpy.zeros(len(columns[0]), dtype=numpy.int64)
+        for column, low, size in zip(columns, minimums, sizes):
+            key = key * size + (column - low)
+        groups, inverse = numpy.unique(key, return_inverse=True)
+        counts = numpy.bincount(inverse)
+        crc = numpy.bincount(
+            inverse, weights=numpy.frombuffer(amount_crc, dtype=numpy.float64)
+        )
+        usd = numpy.bincount(
+            inverse, weights=numpy.frombuffer(amount_usd, dtype=numpy.float64)
+        )
+
+        decoded = []
+        remaining = groups
+        for low, size in reversed(list(zip(minimums, sizes))):
+            decoded.append(remaining % size + low)
+            remaining = remaining // size
+        decoded.reverse()
+        keys = zip(*(values.tolist() for values in decoded))
+        return list(zip(keys, counts.tolist(), crc.tolist(), usd.tolist()))
+
+    totals: dict[tuple, list] = {}
+    for row, key in enumerate(zip(*key_columns)):
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = [0, 0.0, 0.0]
+        total[0] += 1
+        total[1] += amount_crc[row]
+        total[2] += amount_usd[row]
+    return [(key, count, crc, usd) for key, (count, crc, usd) in totals.items()]
+
+
+def _as_store(transactions) -> TransactionStore:
+    if isinstance(transactions, TransactionStore):
+        return transactions
+    return TransactionStore.from_transactions(transactions)
+
+
+def monthly_totals(store: TransactionStore) -> ReportTable:
+    groups = _aggregate(
+        [_month_codes(store), store.category.codes, store.bank_name.codes],
+        store.amount_crc,
+        store.amount_usd,
+    )
+    rows = [
+        [
+            _month_label(month),
+            store.category.values[category],
+            store.bank_name.values[bank],
+            count,
+            round(float(crc), 2),
+            round(float(usd), 2),
+        ]
+        for (month, category, bank), count, crc, usd in groups
+    ]
+    rows.sort(key=lambda row: (row[0], row[1], row[2]))
+    return ReportTable(
+        "Monthly totals",
+        ["Month", "Category", "Bank", "Transactions", "Total CRC", "Total USD"],
+        rows,
+    )
+
+
+def top_merchants(
+    store: TransactionStore, limit: int = DEFAULT_TOP_MERCHANTS
+) -> ReportTable:
+    codes, descriptions = _intern(
+        [(description or "").strip().upper() for description in store.description]
+    )
+    groups = _aggregate([codes], store.amount_crc, store.amount_usd)
+    # The merchants with more transactions first
+    groups.sort(key=lambda group: (-group[1], -group[2], -group[3]))
+    rows = [
+        [descriptions[code], count, round(float(crc), 2), round(float(usd), 2)]
+        for (code,), count, crc, usd in groups[:limit]
+    ]
+    return ReportTable(
+        "Top merchants",
+        ["Description", "Transactions", "Total CRC", "Total USD"],
+        rows,
+    )
+
+
+def card_breakdown(store: TransactionStore) -> ReportTable:
+    groups = _aggregate(
+        [store.bank_name.codes, store.card_num.codes],
+        store.amount_crc,
+        store.amount_usd,
+    )
+    rows = [
+        [
+            store.bank_name.values[bank],
+            store.card_num.values[card],
+            count,
+            round(float(crc), 2),
+            round(float(usd), 2),
+        ]
+        for (bank, card), count, crc, usd in groups
+    ]
+    rows.sort(key=lambda row: (str(row[0]), str(row[1])))
+    return ReportTable(
+        "Card breakdown",
+        ["Bank", "Card", "Transactions", "Total CRC", "Total USD"],
+        rows,
+    )
+
+
+def build_reports(
+    transactions: TransactionStore | Sequence[Transaction],
+) -> list[ReportTable]:
+    store = _as_store(transactions)
+    return [monthly_totals(store), top_merchants(store), card_breakdown(store)]
+
+
+def export_reports_csv(reports: list[ReportTable]) -> list[str]:
+    """Writes every report to its own csv file. Returns the file names"""
+    timestamp = datetime.today().strftime("%Y-%m-%d")
+    file_names = []
+    for report in reports:
+        name = report.name.replace(" ", "-")
+        file_name = f"Report-{timestamp}-{name}.csv"
+        with open(file_name, "w", newline="", encoding="utf-8") as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(report.headers)
+            csv_writer.writerows(report.rows)
+        file_names.append(file_name)
+    return file_names
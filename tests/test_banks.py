@@ -0,0 +1,212 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from banks import PROCESSOR_SPECS, find_processor
+from banks.registry import ProcessorRegistry
+from models.email import Email
+from models.transaction import TransactionType
+
+
+def email_from(sender: str) -> Email:
+    email = Email()
+    email.sender = sender
+    return email
+
+
+@pytest.mark.parametrize(
+    "sender, bank",
+    [
+        ("Davibank <alertas@scotiabank.com>", "Davibank"),
+        ("Scotiabank <alertas@scotiabank.com>", "Scotiabank"),
+        ("Scotiabank <alertas@mail.scotiabank.com>", "Scotiabank"),
+        ("BAC Credomatic <notificacion@notificacionesbaccr.com>", "BAC"),
+        ("BCR <mensajero@bancobcr.com>", "BCR"),
+        ("BCRTarjEstCta <alertas@otro-dominio.com>", "BCR"),
+    ],
+)
+def test_emails_are_routed_to_their_bank(sender, bank):
+    assert find_processor(email_from(sender)).name == bank
+
+
+def test_other_emails_have_no_processor():
+    assert find_processor(email_from("Amazon <store-news@amazon.com>")) is None
+
+
+def test_routing_matches_trying_every_processor_in_order():
+    registry = ProcessorRegistry(PROCESSOR_SPECS)
+    for sender in [
+        "Davibank <alertas@scotiabank.com>",
+        "Scotiabank <davibank@scotiabank.com>",
+        "BAC <notificacion@notificacionesbaccr.com>",
+        "Davibank <davibank@bancobcr.com>",
+    ]:
+        email = email_from(sender)
+        expected = next((p for p in registry.processors() if p.identify(email)), None)
+        assert registry.find(email) is expected, sender
+
+
+RECEIVED = (
+    "by 2002:a05:6a10:1234 with SMTP id x12csp; Mon, 02 Sep 2024 10:31:07 -0600 (CST)"
+)
+EMAIL_DATE = datetime(2024, 9, 2, 10, 31, 7, tzinfo=timezone(timedelta(hours=-6)))
+
+
+def bac_html(date: str, amount: str) -> str:
+    return (
+        "<html><body><table>\n"
+        "<tr><td>Hola, a continuación el detalle de la transacción</td></tr>\n"
+        "<tr><td>Comercio:</td>\n<td> AUTO MERCADO ESCAZU </td></tr>\n"
+        "<tr><td>Ciudad y país:</td>\n<td>SAN JOSE, Costa Rica</td></tr>\n"
+        f"<tr><td>Fecha:</td>\n<td>{date}</td></tr>\n"
+        "<tr><td>VISA</td>\n<td>************4321\nAutorización:</td>\n"
+        "<td>123456</td></tr>\n"
+        f"<tr><td>Monto:</td>\n<td>{amount}</td></tr>\n"
+        "</table></body></html>"
+    )
+
+
+def card_alert_html(bank: str, time: str, amount: str) -> str:
+    return (
+        "<html><body><p>"
+        f"{bank} le notifica que la transacción realizada en UBER TRIP, el día "
+        f"02/09/2024 a las {time}, con la tarjeta terminada en 5678 con "
+        f"referencia 987654 por {amount}, fue aprobada.</p>"
+        "<p>Si no reconoce esta transacción comuníquese con nosotros.</p>"
+        "</body></html>"
+    )
+
+
+def gmail_message(sender: str, subject: str, html: str) -> dict:
+    return {
+        "id": "18f0a1b2c3d4e5f6",
+        "payload": {
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "Subject", "value": subject},
+                {"name": "X-Received", "value": RECEIVED},
+            ],
+            "body": {
+                "size": len(html),
+                "data": base64.urlsafe_b64encode(html.encode("utf-8")).decode(),
+            },
+        },
+    }
+
+
+BAC_SENDER = "Notificación de transacción BAC <notificacionesbaccr@baccredomatic.com>"
+BAC_SUBJECT = "Notificación de transacción PURCHASE"
+SCOTIABANK_SENDER = "Alertas Scotiabank <alertas@scotiabank.com>"
+DAVIBANK_SENDER = "Alertas Davibank <alertas@davibank.com>"
+ALERT_SUBJECT = "Alerta transacción tarjeta"
+
+
+@pytest.mark.parametrize(
+    "sender, subject, html, expected",
+    [
+        # Spanish month with the time
+        (
+            BAC_SENDER,
+            BAC_SUBJECT,
+            bac_html("Ago 15, 2024, 14:05", "CRC 12,500.00"),
+            dict(
+                bank_name="BAC",
+                description="AUTO MERCADO ESCAZU",
+                amount_raw="CRC 12,500.00",
+                amount_crc=12500.0,
+                amount_usd=0.0,
+                card_num="4321",
+                date_time=datetime(2024, 8, 15, 14, 5),
+            ),
+        ),
+        # Only the date, with the Spanish month that differs from English
+        (
+            BAC_SENDER,
+            BAC_SUBJECT,
+            bac_html("Dic 3, 2023", "USD 45.99"),
+            dict(
+                bank_name="BAC",
+                description="AUTO MERCADO ESCAZU",
+                amount_raw="USD 45.99",
+                amount_crc=0.0,
+                amount_usd=45.99,
+                card_num="4321",
+                date_time=datetime(2023, 12, 3),
+            ),
+        ),
+        # No date in the body, the date of the email is used
+        (
+            BAC_SENDER,
+            BAC_SUBJECT,
+            bac_html("ayer", "CRC 1.500,50"),
+            dict(
+                bank_name="BAC",
+                amount_raw="CRC 1.500,50",
+                amount_crc=1500.5,
+                amount_usd=0.0,
+                date_time=EMAIL_DATE,
+            ),
+        ),
+        (
+            SCOTIABANK_SENDER,
+            ALERT_SUBJECT,
+            card_alert_html("Scotiabank", "10:30 AM", "CRC 8,750.00"),
+            dict(
+                bank_name="Scotiabank",
+                description="UBER TRIP",
+                amount_raw="CRC 8,750.00",
+                amount_crc=8750.0,
+                amount_usd=0.0,
+                card_num="5678",
+                date_time=datetime(2024, 9, 2, 10, 30),
+            ),
+        ),
+        # Time without AM/PM, only the date is parsed
+        (
+            DAVIBANK_SENDER,
+            ALERT_SUBJECT,
+            card_alert_html("Davibank", "22:15", "USD 12.00"),
+            dict(
+                bank_name="Davibank",
+                description="UBER TRIP",
+                amount_raw="USD 12.00",
+                amount_crc=0.0,
+                amount_usd=12.0,
+                card_num="5678",
+                date_time=datetime(2024, 9, 2),
+            ),
+        ),
+        # Amount without a known currency
+        (
+            DAVIBANK_SENDER,
+            ALERT_SUBJECT,
+            card_alert_html("Davibank", "09:05 PM", "EUR 30.00"),
+            dict(
+                bank_name="Davibank",
+                amount_raw="EUR 30.00",
+                amount_crc=0.0,
+                amount_usd=0.0,
+                date_time=datetime(2024, 9, 2, 21, 5),
+            ),
+        ),
+    ],
+)
+def test_bank_emails_are_parsed_into_transactions(sender, subject, html, expected):
+    email = Email.from_gmail_message(gmail_message(sender, subject, html))
+    processor = find_processor(email)
+    assert processor.name == expected["bank_name"]
+    assert processor.supports(email)
+    ts = processor.process(email)
+    assert ts.type == TransactionType.CARD_MOVEMENT
+    for name, value in expected.items():
+        assert getattr(ts, name) == value, name
+
+
+def test_other_subjects_of_the_banks_are_not_transactions():
+    email = Email.from_gmail_message(
+        gmail_message(SCOTIABANK_SENDER, "Estado de cuenta", "<p>Estado</p>")
+    )
+    processor = find_processor(email)
+    assert not processor.supports(email)
+    assert processor.process(email) is None
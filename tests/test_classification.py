@@ -0,0 +1,187 @@
+import random
+import sys
+import threading
+from datetime import datetime
+
+from models.classification import (
+    DEFAULT_CLASSIFICATION_FILE,
+    CategoryCache,
+    Classifier,
+    CompiledClassification,
+    normalize_description,
+    parse_classification,
+    read_classification,
+)
+from models.transaction import Transaction, TransactionType
+from models.transaction_store import TransactionStore
+
+DESCRIPTIONS = [f"AUTO MERCADO {i}" for i in range(200)] + [
+    f"FARMACIA FISCHEL {i}" for i in range(200)
+]
+
+
+def transaction(description: str, category: str) -> Transaction:
+    return Transaction(
+        type=TransactionType.CARD_MOVEMENT,
+        amount_crc=1000.0,
+        amount_usd=0.0,
+        description=description,
+        date_time=datetime(2024, 9, 2, 10, 30),
+        card_num="1234",
+        bank_name="BAC",
+        category=category,
+    )
+
+
+def compile_rules(text: str) -> CompiledClassification:
+    return CompiledClassification(parse_classification(text.splitlines()))
+
+
+def nested_loop_category(classification_list: dict, description: str) -> str:
+    """Previous classification, every word of every category tried in order"""
+    description = normalize_description(description)
+    for category, (include_words, exclude_words) in classification_list.items():
+        if any(" " + word + " " in description for word in exclude_words):
+            continue
+        for word in include_words:
+            if " " + word + " " in description:
+                return category
+    return ""
+
+
+# Overlapping and prefix keywords, exclusions checked before the includes and
+# descriptions matching several categories, where the first in the file wins
+OVERLAPPING_RULES = """
+class: Groceries
+include: mas x menos, mas, super, am pm
+exclude: super lisa, uber
+class: Restaurant
+include: super lisa, pizza, pizza hut, am
+class: Transportation
+include: uber, uber rides, parqueo, am pm
+exclude: eats
+class: Food delivery
+include: uber eats, rides
+class: Empty
+include:
+"""
+DESCRIPTIONS_TO_COMPARE = [
+    "MAS X MENOS SAN PEDRO",
+    "mas x menoss",
+    "SUPER LISA",
+    "super lisa uber",
+    "PIZZA HUT ESCAZU",
+    "pizza",
+    "pizzahut",
+    "UBER *RIDES",
+    "UBER EATS",
+    "uber rides eats",
+    "AM PM CURRIDABAT",
+    "am",
+    "ampm",
+    "PARQUEO-MUNICIPAL",
+    "super.uber.pizza",
+    "",
+    "UNKNOWN MERCHANT",
+]
+
+
+def test_compiled_rules_match_the_nested_loop_on_overlapping_keywords():
+    classification_list = parse_classification(OVERLAPPING_RULES.splitlines())
+    rules = CompiledClassification(classification_list)
+    for description in DESCRIPTIONS_TO_COMPARE:
+        assert rules.classify(description) == nested_loop_category(
+            classification_list, description
+        ), description
+    assert rules.classify("super lisa") == "Restaurant"
+    assert rules.classify("uber rides") == "Transportation"
+    assert rules.classify("uber eats") == "Food Delivery"
+    assert rules.classify("am pm") == "Groceries"
+
+
+def test_compiled_rules_match_the_nested_loop_on_random_descriptions():
+    lists = [
+        parse_classification(OVERLAPPING_RULES.splitlines()),
+        read_classification(DEFAULT_CLASSIFICATION_FILE),
+    ]
+    generator = random.Random(11)
+    for classification_list in lists:
+        rules = CompiledClassification(classification_list)
+        words = sorted(
+            {
+                part
+                for include, exclude in classification_list.values()
+                for word in include + exclude
+                for part in word.split()
+            }
+        ) + ["x", "*", ".", "-", "cr", "sjo"]
+        for _ in range(2000):
+            description = " ".join(
+                generator.choice(words) for _ in range(generator.randint(1, 6))
+            )
+            if generator.random() < 0.3:
+                description = description.upper()
+            assert rules.classify(description) == nested_loop_category(
+                classification_list, description
+            ), description
+
+
+def test_concurrent_classifications_during_a_reload_never_mix_the_rules():
+    old = compile_rules(
+        "class: Groceries\ninclude: auto mercado\nclass: Health\ninclude: fischel"
+    )
+    new = compile_rules(
+        "class: Supermarket\ninclude: auto mercado\nclass: Pharmacy\ninclude: fischel"
+    )
+    cache = CategoryCache(maxsize=64)
+    errors = []
+
+    def classify(rules: CompiledClassification) -> None:
+        try:
+            for _ in range(20):
+                for description in DESCRIPTIONS:
+                    category = cache.classify(rules, description)
+                    assert category == rules.classify(description), description
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=classify, args=(rules,))
+        for rules in (old, new, old, new)
+    ]
+    # Switch threads as often as possible to interleave the classifications
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    rules = old if cache.fingerprint == old.fingerprint else new
+    for description in DESCRIPTIONS:
+        assert cache.classify(rules, description) == rules.classify(description)
+
+
+def test_reclassify_writes_the_categories_of_a_transaction_store(tmp_path):
+    path = tmp_path / "classification.txt"
+    path.write_text("class: Groceries\ninclude: auto mercado\n")
+    classifier = Classifier(str(path), check_interval=0)
+    store = TransactionStore.from_transactions(
+        transaction(description, "")
+        for description in ["AUTO MERCADO 1", "FARMACIA FISCHEL", "AUTO MERCADO 2"]
+    )
+
+    assert classifier.reclassify(store) == 2
+    assert [ts.category for ts in store] == ["Groceries", "", "Groceries"]
+
+    path.write_text(
+        "class: Groceries\ninclude: auto mercado\n\nclass: Health\ninclude: fischel\n"
+    )
+    classifier.reload()
+    assert classifier.reclassify(store) == 1
+    assert [ts.category for ts in store] == ["Groceries", "Health", "Groceries"]
+    assert classifier.reclassify(store) == 0
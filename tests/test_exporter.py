@@ -0,0 +1,80 @@
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from exporter import CsvSink, TransactionSink, XlsSink, XlsxSink
+from models.transaction import Transaction, TransactionType
+
+# First bytes of the compound files of the .xls workbooks
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+
+def transaction(i: int) -> Transaction:
+    return Transaction(
+        type=TransactionType.CARD_MOVEMENT,
+        amount_crc=float(i),
+        amount_usd=0.0,
+        description=f"SODA LA TIA {i}",
+        date_time=datetime(2024, 9, 2, 10, 30),
+        card_num="1234",
+        bank_name="BAC",
+        amount_raw=f"CRC {i}",
+    )
+
+
+def test_sinks_must_implement_the_file_operations():
+    class IncompleteSink(TransactionSink):
+        def _open(self) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteSink("out.csv", flush_every=1)
+
+
+def test_csv_sink_leaves_the_flushed_rows_before_closing(tmp_path):
+    file_name = str(tmp_path / "out.csv")
+    sink = CsvSink(file_name, flush_every=2)
+    sink.extend(transaction(i) for i in range(5))
+    with open(file_name, encoding="utf-8") as f:
+        # Header and the first two flushes, the last row is still pending
+        assert len(f.read().splitlines()) == 5
+    sink.close()
+    with open(file_name, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 6
+
+
+def test_xls_sink_replaces_the_previous_save(tmp_path):
+    pytest.importorskip("xlwt")
+    file_name = str(tmp_path / "out.xls")
+    sink = XlsSink(file_name, flush_every=3)
+    sink.extend(transaction(i) for i in range(4))
+    # Saved at the first flush, without the temporary file
+    assert os.listdir(tmp_path) == ["out.xls"]
+    with open(file_name, "rb") as f:
+        content = f.read()
+    assert content.startswith(OLE2_SIGNATURE)
+    assert b"SODA LA TIA 2" in content and b"SODA LA TIA 3" not in content
+    sink.close()
+    assert os.listdir(tmp_path) == ["out.xls"]
+    with open(file_name, "rb") as f:
+        assert b"SODA LA TIA 3" in f.read()
+
+
+def test_xlsx_sink_keeps_the_previous_workbook_until_closed(tmp_path):
+    file_name = str(tmp_path / "out.xlsx")
+    with XlsxSink(file_name) as sink:
+        sink.append(transaction(0))
+    sink = XlsxSink(file_name)
+    sink.extend(transaction(i) for i in range(1, 4))
+    # A crash now leaves the previous workbook and the unfinished temporary file
+    assert sorted(os.listdir(tmp_path)) == ["out.xlsx", "out.xlsx.tmp"]
+    with zipfile.ZipFile(file_name) as workbook:
+        sheet = workbook.read("xl/worksheets/sheet1.xml")
+    assert b"SODA LA TIA 0" in sheet and b"SODA LA TIA 1" not in sheet
+    sink.close()
+    assert os.listdir(tmp_path) == ["out.xlsx"]
+    with zipfile.ZipFile(file_name) as workbook:
+        sheet = workbook.read("xl/worksheets/sheet1.xml")
+    assert b"SODA LA TIA 0" not in sheet and b"SODA LA TIA 3" in sheet
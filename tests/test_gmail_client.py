@@ -0,0 +1,407 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import gmail_client
+import main
+from benchmarks.corpus import FakeGmailService
+from gmail_client import (
+    FORMAT_FULL,
+    FORMAT_METADATA,
+    MAX_BACKOFF_SECONDS,
+    MAX_RETRIES,
+    RateLimiter,
+    _fetch_batch,
+    backoff_delay,
+    execute_with_backoff,
+    fetch_messages,
+    fetch_messages_concurrently,
+    fetch_messages_two_phase,
+    list_history_messages,
+    list_messages,
+    mark_as_read,
+)
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), b"error")
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """Records the backoff sleeps instead of waiting"""
+    recorded: list[float] = []
+    monkeypatch.setattr(gmail_client.time, "sleep", recorded.append)
+    return recorded
+
+
+class FailingRequest:
+    def __init__(self, errors: list[int], result=None):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise http_error(self.errors.pop(0))
+        return self.result
+
+
+class Request:
+    def __init__(self, function):
+        self.function = function
+
+    def execute(self):
+        return self.function()
+
+
+class FailingBatchRequest:
+    def __init__(self, service: "FailingGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        service = self.service
+        service.batch_sizes.append(len(self.requests))
+        if service.batch_errors:
+            raise http_error(service.batch_errors.pop(0))
+        for request_id, request in self.requests:
+            errors = service.item_errors.get(request.msg_id)
+            if errors:
+                self.callback(request_id, None, http_error(errors.pop(0)))
+            else:
+                self.callback(request_id, request.function(), None)
+
+
+class FailingGmailService(FakeGmailService):
+    """
+    FakeGmailService whose batch items fail with the statuses of item_errors
+    (message id -> statuses of the next attempts), whose whole batches fail
+    with batch_errors, and that records the list and batchModify requests
+    """
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.item_errors: dict[str, list[int]] = {}
+        self.batch_errors: list[int] = []
+        self.batch_sizes: list[int] = []
+        self.page_sizes: list[int] = []
+        self.modified: list[list[str]] = []
+        self.failing_modify_id: str | None = None
+        self.history_pages: dict[str | None, dict] = {}
+        self.history_error: int | None = None
+
+    def list(self, userId="me", q=None, maxResults=100, pageToken=None, **kwargs):
+        self.page_sizes.append(maxResults)
+        return super().list(userId, q, maxResults, pageToken, **kwargs)
+
+    def get(self, userId="me", id=None, format="full", **kwargs):
+        request = super().get(userId, id, format, **kwargs)
+        request.msg_id = id
+        return request
+
+    def new_batch_http_request(self, callback=None):
+        return FailingBatchRequest(self, callback)
+
+    def batchModify(self, userId="me", body=None):
+        ids = list(body["ids"])
+        self.modified.append(ids)
+        if self.failing_modify_id in ids:
+            return FailingRequest([400])
+        return super().batchModify(userId, body)
+
+    def history(self):
+        return FakeHistory(self)
+
+
+class FakeHistory:
+    def __init__(self, service: FailingGmailService):
+        self.service = service
+
+    def list(self, userId="me", startHistoryId=None, pageToken=None, **kwargs):
+        if self.service.history_error is not None:
+            return FailingRequest([self.service.history_error])
+        page = self.service.history_pages[pageToken]
+        return Request(lambda: page)
+
+
+def test_list_messages_follows_the_pages():
+    service = FailingGmailService(1200)
+    ids = [msg["id"] for msg in list_messages(service, "label:Bancos")]
+    assert ids == [str(i) for i in range(1200)]
+    assert service.page_sizes == [500, 500, 500]
+
+
+@pytest.mark.parametrize(
+    "limit, page_sizes",
+    [(700, [500, 200]), (500, [500]), (30, [30]), (0, [])],
+)
+def test_list_messages_requests_only_the_limit(limit, page_sizes):
+    service = FailingGmailService(1200)
+    ids = [msg["id"] for msg in list_messages(service, "", limit=limit)]
+    assert ids == [str(i) for i in range(limit)]
+    assert service.page_sizes == page_sizes
+
+
+def test_list_messages_is_lazy():
+    service = FailingGmailService(1200)
+    messages = list_messages(service, "", page_size=100)
+    next(messages)
+    assert service.page_sizes == [100]
+
+
+def test_fetch_batch_retries_the_rate_limited_items(sleeps):
+    service = FailingGmailService(10)
+    service.item_errors = {"2": [429], "5": [503, 429]}
+    chunk = [str(i) for i in range(8)]
+    responses = _fetch_batch(service, chunk)
+    assert [response["id"] for response in responses] == chunk
+    # Only the failed items are sent again
+    assert service.batch_sizes == [8, 2, 1]
+    assert len(sleeps) == 2
+
+
+def test_fetch_batch_skips_the_missing_messages(sleeps, capsys):
+    service = FailingGmailService(10)
+    service.item_errors = {"3": [404]}
+    responses = _fetch_batch(service, ["1", "3", "4"])
+    assert responses[0]["id"] == "1" and responses[2]["id"] == "4"
+    assert responses[1] is None
+    assert service.batch_sizes == [3]
+    assert sleeps == []
+    assert "Error fetching email 3" in capsys.readouterr().out
+
+
+def test_fetch_batch_gives_up_after_the_max_retries(sleeps, capsys):
+    service = FailingGmailService(10)
+    service.item_errors = {"1": [429] * (MAX_RETRIES + 1)}
+    responses = _fetch_batch(service, ["0", "1"])
+    assert responses[0]["id"] == "0" and responses[1] is None
+    assert len(service.batch_sizes) == MAX_RETRIES + 1
+    assert "Error fetching email 1" in capsys.readouterr().out
+
+
+def test_fetch_batch_retries_a_failed_batch_request(sleeps):
+    service = FailingGmailService(10)
+    service.batch_errors = [500]
+    responses = _fetch_batch(service, ["0", "1"])
+    assert [response["id"] for response in responses] == ["0", "1"]
+    assert service.batch_sizes == [2, 2]
+
+    service.batch_errors = [403]
+    with pytest.raises(HttpError):
+        _fetch_batch(service, ["0", "1"])
+
+
+def test_fetch_messages_keeps_the_order_in_every_mode(sleeps):
+    service = FailingGmailService(300)
+    service.item_errors = {"7": [429], "150": [404]}
+    ids = [str(i) for i in range(0, 300, 3)] + ["7", "150"]
+    sequential = list(fetch_messages(service, ids, batch_size=7))
+    assert [msg_id for msg_id, _ in sequential] == ids
+    assert [msg_id for msg_id, msg_data in sequential if msg_data is None] == ["150"]
+
+    service.item_errors = {"7": [429], "150": [404]}
+    concurrent = fetch_messages_concurrently(
+        lambda: service, ids, batch_size=7, workers=4
+    )
+    assert list(concurrent) == sequential
+
+
+def test_fetch_messages_two_phase_downloads_only_the_needed_bodies():
+    service = FailingGmailService(300)
+    requested: list[tuple[list[str], str]] = []
+
+    def fetch(ids, message_format):
+        ids = list(ids)
+        requested.append((ids, message_format))
+        return fetch_messages(service, ids, 10, None, message_format)
+
+    ids = [str(i) for i in range(25)]
+    needs_body = lambda msg_data: int(msg_data["id"]) % 3 == 0
+    fetched = list(fetch_messages_two_phase(iter(ids), fetch, needs_body, window=10))
+
+    assert [msg_id for msg_id, _ in fetched] == ids
+    for msg_id, msg_data in fetched:
+        assert ("body" in msg_data["payload"]) == (int(msg_id) % 3 == 0)
+    assert requested[0][1] == FORMAT_METADATA
+    # The full messages are requested once per window
+    assert [ids for ids, message_format in requested[1:]] == [
+        ["0", "3", "6", "9"],
+        ["12", "15", "18"],
+        ["21", "24"],
+    ]
+    assert all(message_format == FORMAT_FULL for _, message_format in requested[1:])
+
+
+def test_execute_with_backoff_retries_the_retriable_errors(sleeps):
+    request = FailingRequest([429, 503], result={"ok": True})
+    assert execute_with_backoff(request) == {"ok": True}
+    assert request.calls == 3
+    assert 1 <= sleeps[0] < 2 and 2 <= sleeps[1] < 3
+
+    request = FailingRequest([400])
+    with pytest.raises(HttpError):
+        execute_with_backoff(request)
+    assert request.calls == 1
+
+    request = FailingRequest([429] * (MAX_RETRIES + 1))
+    with pytest.raises(HttpError):
+        execute_with_backoff(request)
+    assert request.calls == MAX_RETRIES + 1
+
+
+def test_backoff_delay_grows_exponentially_up_to_the_maximum():
+    for attempt in range(10):
+        base = min(2**attempt, MAX_BACKOFF_SECONDS)
+        assert base <= backoff_delay(attempt) < base + 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_waits_for_the_units(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gmail_client, "time", clock)
+    limiter = RateLimiter(units_per_second=100)
+    # The bucket starts full
+    limiter.acquire(100)
+    assert clock.sleeps == []
+    limiter.acquire(50)
+    assert clock.sleeps == [pytest.approx(0.5)]
+    # Bigger than the bucket, consumed in several refills
+    limiter.acquire(250)
+    assert clock.now - 100.0 == pytest.approx(3.0)
+
+
+def test_execute_with_backoff_spends_the_units_of_every_attempt(sleeps, monkeypatch):
+    acquired: list[float] = []
+    limiter = RateLimiter()
+    monkeypatch.setattr(limiter, "acquire", acquired.append)
+    execute_with_backoff(FailingRequest([429], result={}), 5, limiter)
+    assert acquired == [5, 5]
+
+
+def test_mark_as_read_sends_chunks_and_returns_the_failed_ids(sleeps, capsys):
+    service = FailingGmailService(0)
+    ids = [str(i) for i in range(2500)]
+    assert mark_as_read(service, ids) == []
+    assert [len(chunk) for chunk in service.modified] == [1000, 1000, 500]
+    assert [i for chunk in service.modified for i in chunk] == ids
+
+    service.modified = []
+    service.failing_modify_id = "1500"
+    assert mark_as_read(service, ids) == ids[1000:2000]
+    assert len(service.modified) == 3
+    assert "Error marking 1000 emails as READ" in capsys.readouterr().out
+
+
+def history_record(msg_id: str, kind: str = "messagesAdded", labels=()) -> dict:
+    change = {"message": {"id": msg_id, "threadId": msg_id}}
+    if kind == "labelsAdded":
+        change["labelIds"] = list(labels)
+    return {kind: [change]}
+
+
+def test_list_history_messages_follows_the_pages_without_repeating():
+    service = FailingGmailService(0)
+    service.history_pages = {
+        None: {
+            "history": [
+                history_record("1"),
+                history_record("2", "labelsAdded", ["Label_7"]),
+                history_record("3", "labelsAdded", ["STARRED"]),
+            ],
+            "nextPageToken": "p2",
+        },
+        "p2": {"history": [history_record("1"), history_record("4")]},
+    }
+    messages = list_history_messages(service, "100", "Label_7")
+    assert [msg["id"] for msg in messages] == ["1", "2", "4"]
+
+
+def test_list_history_messages_raises_right_away_when_expired():
+    service = FailingGmailService(0)
+    service.history_error = 404
+    with pytest.raises(HttpError) as error:
+        list_history_messages(service, "100", "Label_7")
+    assert gmail_client.is_history_expired(error.value)
+
+
+def test_get_messages_falls_back_to_the_search_query(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = FailingGmailService(20)
+    service.history_pages = {None: {"history": [history_record("5")]}}
+
+    # Without a saved history id
+    messages = main.get_messages(service, main.OperationMode.DEV, None, "Label_7")
+    assert len(list(messages)) == 20
+
+    main.save_history_id("100")
+    messages = main.get_messages(service, main.OperationMode.DEV, None, "Label_7")
+    assert [msg["id"] for msg in messages] == ["5"]
+
+    service.history_error = 404
+    messages = main.get_messages(service, main.OperationMode.DEV, None, "Label_7")
+    assert len(list(messages)) == 20
+
+
+class LabeledGmailService(FailingGmailService):
+    def labels(self):
+        return FakeLabels(self)
+
+    def getProfile(self, userId="me"):
+        return Request(lambda: {"historyId": "4242"})
+
+
+class FakeLabels:
+    def __init__(self, service: FailingGmailService):
+        self.service = service
+
+    def list(self, userId="me"):
+        labels = {"labels": [{"id": "Label_7", "name": main.BANK_LABEL}]}
+        return Request(lambda: labels)
+
+
+def run_incremental(monkeypatch, service) -> None:
+    monkeypatch.setattr(main, "get_credentials", lambda: None)
+    monkeypatch.setattr(main, "build", lambda *args, **kwargs: service)
+    monkeypatch.setattr(main.sys, "argv", ["main.py", "-i", "--csv", "--no-cache"])
+    main.main()
+
+
+def test_history_id_is_saved_after_the_export(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run_incremental(monkeypatch, LabeledGmailService(30))
+    with open(main.SYNC_STATE_FILE) as f:
+        assert json.load(f) == {"historyId": "4242"}
+    assert (tmp_path / "Emails_output.csv").exists()
+
+
+def test_history_id_is_not_saved_when_the_export_fails(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main, "finish_export", fail)
+    with pytest.raises(OSError):
+        run_incremental(monkeypatch, LabeledGmailService(30))
+    assert not (tmp_path / main.SYNC_STATE_FILE).exists()
@@ -0,0 +1,56 @@
+import pytest
+
+from models.html_parsing import (
+    available_backends,
+    html_to_soup,
+    html_to_text,
+    set_text_backend,
+)
+
+ACCENTED_HTML = (
+    "<html><body><table><tr><td>Comercio:</td><td>PANADERÍA SAN JOSÉ</td></tr>"
+    "<tr><td>Monto:</td><td>₡ 2.500,00</td></tr></table>"
+    "<script>var señal = 1;</script><p>Gracias por usar su tarjeta, ñandú</p>"
+    "</body></html>"
+)
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    set_text_backend("auto")
+
+
+def texts(raw_html: bytes) -> dict[str, str]:
+    results = {}
+    for backend in available_backends():
+        set_text_backend(backend)
+        results[backend] = html_to_text(raw_html)
+    return results
+
+
+def test_backends_return_the_same_text_for_an_accented_utf8_body():
+    results = texts(ACCENTED_HTML.encode("utf-8"))
+    for backend, text in results.items():
+        assert "PANADERÍA SAN JOSÉ" in text, backend
+        assert "ñandú" in text, backend
+        assert "señal" not in text, backend
+    assert len(set(results.values())) == 1, results
+
+
+def test_backends_use_the_declared_charset():
+    raw_html = ACCENTED_HTML.replace("₡", "CRC").replace(
+        "<html>", '<html><head><meta charset="iso-8859-1"></head>'
+    )
+    results = texts(raw_html.encode("iso-8859-1"))
+    for backend, text in results.items():
+        assert "PANADERÍA SAN JOSÉ" in text, backend
+    assert len(set(results.values())) == 1, results
+
+
+def test_table_trees_keep_the_accents_with_every_backend():
+    for backend in available_backends():
+        set_text_backend(backend)
+        soup = html_to_soup(ACCENTED_HTML.encode("utf-8"))
+        cells = [td.text for td in soup.find_all("td")]
+        assert cells[1] == "PANADERÍA SAN JOSÉ", backend
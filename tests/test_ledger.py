@@ -0,0 +1,128 @@
+from datetime import datetime
+
+from ledger import WRITE_EVERY, Ledger
+from models.classification import Classifier
+from models.email import Email
+from models.transaction import Transaction, TransactionType
+
+
+def transaction(message_id: str, amount: float, **kwargs) -> Transaction:
+    fields = dict(
+        type=TransactionType.CARD_MOVEMENT,
+        amount_crc=amount,
+        amount_usd=0.0,
+        description="SODA LA TIA",
+        date_time=datetime(2024, 9, 2, 10, 30),
+        card_num="1234",
+        bank_name="BAC",
+        message_id=message_id,
+    )
+    fields.update(kwargs)
+    return Transaction(**fields)
+
+
+def run(path: str, transactions: list[Transaction]) -> Ledger:
+    ledger = Ledger(path)
+    for ts in transactions:
+        ledger.append(ts)
+    ledger.close()
+    return ledger
+
+
+def rows(path: str) -> list[Transaction]:
+    ledger = Ledger(path)
+    try:
+        return list(ledger.query())
+    finally:
+        ledger.close()
+
+
+def test_processing_again_does_not_add_duplicates(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    run(path, [transaction("<a@bank>", 100.0), transaction("<b@bank>", 200.0)])
+    second = run(path, [transaction("<a@bank>", 100.0), transaction("<b@bank>", 200.0)])
+
+    assert second.changed == 0
+    assert len(rows(path)) == 2
+
+
+def test_a_parser_fix_replaces_the_rows_of_the_message(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    run(path, [transaction("<a@bank>", 100.0), transaction("<b@bank>", 200.0)])
+    # The amount of the first message was parsed wrong
+    second = run(path, [transaction("<a@bank>", 1000.0)])
+
+    assert second.removed == 1
+    assert sorted((ts.message_id, ts.amount_crc) for ts in rows(path)) == [
+        ("<a@bank>", 1000.0),
+        ("<b@bank>", 200.0),
+    ]
+
+
+def test_the_transactions_of_a_message_are_flushed_together(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    transactions = [
+        transaction(f"<{i}@bank>", float(i)) for i in range(WRITE_EVERY - 1)
+    ]
+    transactions += [
+        transaction("<many@bank>", 1.0),
+        transaction("<many@bank>", 2.0),
+        transaction("<many@bank>", 3.0),
+    ]
+    run(path, transactions)
+    second = run(path, transactions)
+
+    assert second.changed == 0
+    assert second.removed == 0
+    assert len(rows(path)) == WRITE_EVERY + 2
+
+
+def test_gmail_and_offline_messages_share_the_message_id():
+    raw = (
+        b"Message-ID: <abc@bank.example>\r\n"
+        b"From: BAC <notificacion@notificacionesbaccr.com>\r\n"
+        b"Subject: Notificacion de transaccion\r\n"
+        b"Content-Type: text/html; charset=utf-8\r\n\r\n<p>Hola</p>"
+    )
+    offline = Email.from_mime(raw)
+    api = Email.from_gmail_message(
+        {
+            "id": "18c2f0a1b2c3d4e5",
+            "payload": {
+                "headers": [
+                    {"name": "From", "value": offline.sender},
+                    {"name": "Subject", "value": offline.subject},
+                    {"name": "Message-Id", "value": "<abc@bank.example>"},
+                ]
+            },
+        },
+        decode_body=False,
+    )
+
+    assert api.message_id == offline.message_id == "<abc@bank.example>"
+
+
+def test_reclassify_updates_the_ledger_rows_and_their_version(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    run(
+        path,
+        [
+            transaction("<a@bank>", 100.0, description="AUTO MERCADO"),
+            transaction("<b@bank>", 200.0, description="FARMACIA FISCHEL"),
+        ],
+    )
+    ledger = Ledger(path)
+    exported, version = ledger.changes_since("csv")
+    assert len(list(exported)) == 2
+    ledger.mark_exported("csv", version)
+    rules = tmp_path / "classification.txt"
+    rules.write_text("class: Health\ninclude: fischel\n")
+
+    assert Classifier(str(rules)).reclassify(ledger) == 1
+    changes, _ = ledger.changes_since("csv")
+    assert [(ts.message_id, ts.category) for ts in changes] == [("<b@bank>", "Health")]
+    ledger.close()
+    assert sorted((ts.message_id, ts.category) for ts in rows(path)) == [
+        ("<a@bank>", ""),
+        ("<b@bank>", "Health"),
+    ]
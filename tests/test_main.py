@@ -0,0 +1,84 @@
+import pytest
+
+import main
+from benchmarks.corpus import FakeGmailService
+from gmail_client import MAX_BATCH_MODIFY_IDS, list_messages
+from main import OperationMode
+
+CORPUS_SIZE = 300
+
+
+class RecordingGmailService(FakeGmailService):
+    """FakeGmailService that keeps the ids of every batchModify request"""
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.marked_as_read: list[list[str]] = []
+
+    def batchModify(self, userId="me", body=None):
+        with self._lock:
+            self.marked_as_read.append(list(body["ids"]))
+        return super().batchModify(userId, body)
+
+
+def run(mode: str, workers: int = 1, processes: int = 1, metadata_first=False):
+    service = RecordingGmailService(CORPUS_SIZE)
+    transactions = []
+    messages = list_messages(service, "label:Bancos", page_size=70)
+    options = dict(
+        batch_size=20,
+        workers=workers,
+        processes=processes,
+        metadata_first=metadata_first,
+    )
+    if mode == "pipeline":
+        main.run_pipeline(
+            lambda: service, transactions, messages, OperationMode.GUI, **options
+        )
+    else:
+        main.process_messages(
+            service,
+            transactions,
+            messages,
+            OperationMode.GUI,
+            service_factory=lambda: service,
+            **options,
+        )
+    return transactions, service.marked_as_read
+
+
+@pytest.fixture(scope="module")
+def sequential():
+    return run("sequential")
+
+
+def test_sequential_run_marks_the_bank_emails_as_read(sequential):
+    transactions, marked_as_read = sequential
+    ids = [msg_id for chunk in marked_as_read for msg_id in chunk]
+    assert 0 < len(transactions) <= len(ids) < CORPUS_SIZE
+    assert len(ids) == len(set(ids))
+    assert all(len(chunk) <= MAX_BATCH_MODIFY_IDS for chunk in marked_as_read)
+
+
+@pytest.mark.parametrize(
+    "mode, workers, processes, metadata_first",
+    [
+        ("sequential", 1, 1, True),
+        ("sequential", 4, 1, False),
+        ("sequential", 1, 2, False),
+        ("sequential", 4, 2, True),
+        ("pipeline", 1, 1, False),
+        ("pipeline", 4, 1, False),
+        ("pipeline", 4, 2, False),
+        ("pipeline", 4, 1, True),
+    ],
+)
+def test_every_mode_exports_the_same_transactions(
+    sequential, mode, workers, processes, metadata_first
+):
+    expected_transactions, expected_marked = sequential
+    transactions, marked_as_read = run(mode, workers, processes, metadata_first)
+    assert transactions == expected_transactions
+    assert [msg_id for chunk in marked_as_read for msg_id in chunk] == [
+        msg_id for chunk in expected_marked for msg_id in chunk
+    ]
@@ -0,0 +1,121 @@
+import sqlite3
+import zlib
+
+import message_cache
+from benchmarks.corpus import synthetic_message
+from message_cache import OUTCOME_PROCESSED, MessageCache, fetch_messages_cached
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+def new_cache(tmp_path, monkeypatch, **kwargs) -> tuple[MessageCache, FakeTime]:
+    clock = FakeTime()
+    monkeypatch.setattr(message_cache, "time", clock)
+    return MessageCache(str(tmp_path / "message_cache.db"), **kwargs), clock
+
+
+def test_payloads_round_trip_compressed(tmp_path, monkeypatch):
+    cache, _ = new_cache(tmp_path, monkeypatch)
+    msg_data = synthetic_message("3")
+    cache.put("3", msg_data)
+    cache.set_outcome("3", OUTCOME_PROCESSED)
+    assert cache.get_many(["3", "4"]) == {"3": msg_data}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    with sqlite3.connect(str(tmp_path / "message_cache.db")) as conn:
+        payload, size, sender, outcome = conn.execute(
+            "SELECT payload, size, sender, outcome FROM messages WHERE id = '3'"
+        ).fetchone()
+    assert size == len(payload)
+    assert zlib.decompress(payload).startswith(b'{"id": "3"')
+    assert sender == msg_data["payload"]["headers"][2]["value"]
+    assert outcome == OUTCOME_PROCESSED
+
+    # The entries survive reopening the file
+    cache = MessageCache(str(tmp_path / "message_cache.db"))
+    assert cache.get_many(["3"]) == {"3": msg_data}
+    cache.close()
+
+
+def test_old_entries_are_evicted(tmp_path, monkeypatch):
+    cache, clock = new_cache(tmp_path, monkeypatch, max_age_days=10)
+    cache.put("1", synthetic_message("1"))
+    clock.now += 6 * 24 * 3600
+    cache.put("2", synthetic_message("2"))
+    clock.now += 5 * 24 * 3600
+    # Reading an entry does not make it younger
+    assert set(cache.get_many(["1", "2"])) == {"1", "2"}
+    assert cache.evict() == 1
+    assert set(cache.get_many(["1", "2"])) == {"2"}
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_over_the_size(tmp_path, monkeypatch):
+    cache, clock = new_cache(tmp_path, monkeypatch, max_age_days=None)
+    for msg_id in ["1", "2", "3", "4"]:
+        clock.now += 1
+        cache.put(msg_id, synthetic_message(msg_id))
+    clock.now += 1
+    cache.get_many(["1"])
+    sizes = dict(cache._conn.execute("SELECT id, size FROM messages").fetchall())
+    # Room for the entries read or written last: 1 and 4
+    cache.max_size_mb = (sizes["1"] + sizes["4"]) / (1024 * 1024)
+    assert cache.evict() == 2
+    assert set(cache.get_many(["1", "2", "3", "4"])) == {"1", "4"}
+    cache.close()
+
+
+def test_partial_hits_are_returned_in_the_order_of_the_ids(tmp_path, monkeypatch):
+    cache, _ = new_cache(tmp_path, monkeypatch)
+    for msg_id in ["1", "4", "5", "9"]:
+        cache.put(msg_id, synthetic_message(msg_id))
+    requested: list[str] = []
+
+    def fetch(ids):
+        for msg_id in ids:
+            requested.append(msg_id)
+            # 8 fails to download, 7 is only the metadata
+            if msg_id == "8":
+                yield msg_id, None
+            elif msg_id == "7":
+                yield msg_id, synthetic_message(msg_id, "metadata")
+            else:
+                yield msg_id, synthetic_message(msg_id)
+
+    ids = [str(i) for i in range(10)]
+    results = list(fetch_messages_cached(cache, iter(ids), fetch))
+
+    assert [msg_id for msg_id, _ in results] == ids
+    assert requested == ["0", "2", "3", "6", "7", "8"]
+    assert results[8] == ("8", None)
+    assert results[4] == ("4", synthetic_message("4"))
+    assert results[7] == ("7", synthetic_message("7", "metadata"))
+    # Only the full payloads are stored
+    assert set(cache.get_many(ids)) == {"0", "1", "2", "3", "4", "5", "6", "9"}
+    cache.close()
+
+
+def test_ids_missing_from_the_fetch_results_are_none(tmp_path, monkeypatch):
+    cache, _ = new_cache(tmp_path, monkeypatch)
+    cache.put("1", synthetic_message("1"))
+
+    def fetch(ids):
+        ids = list(ids)
+        yield ids[0], synthetic_message(ids[0])
+
+    results = list(fetch_messages_cached(cache, ["0", "1", "2", "3"], fetch))
+    assert [msg_id for msg_id, _ in results] == ["0", "1", "2", "3"]
+    assert [msg_data is None for _, msg_data in results] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+    cache.close()
@@ -0,0 +1,99 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+import pytest
+
+from banks.base_bank_processor import BaseBankProcessor
+from models.email import Email, header_date
+import offline_source
+from offline_source import list_offline_messages, process_offline, read_message
+
+MBOX = (
+    b"From MAILER-DAEMON Mon Sep  2 10:30:00 2024\n"
+    b"Message-ID: <first@bank.example>\n"
+    b"Subject: First\n\n"
+    b">From the bank\n"
+    b">>From a quoted reply\n"
+    b"> From is not quoted\n\n"
+    b"From MAILER-DAEMON Mon Sep  2 11:30:00 2024\n"
+    b"Message-ID: <second@bank.example>\n"
+    b"Subject: Second\n\n"
+    b"Hola\n"
+)
+
+
+def test_mbox_messages_are_unquoted(tmp_path):
+    path = tmp_path / "Bancos.mbox"
+    path.write_bytes(MBOX)
+
+    messages = [read_message(ref) for ref in list_offline_messages([str(path)])]
+
+    assert len(messages) == 2
+    assert messages[0].endswith(
+        b"\n\nFrom the bank\n>From a quoted reply\n> From is not quoted\n\n"
+    )
+    assert messages[1].endswith(b"\n\nHola\n")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("Mon, 2 Sep 2024 10:30:00 -0600 (CST)", "Mon, 02 Sep 2024 10:30:00 -0600"),
+        ("2 Sep 2024 10:30:00 -0600", "Mon, 02 Sep 2024 10:30:00 -0600"),
+        ("Mon, 02 Sep 2024 16:30 GMT", "Mon, 02 Sep 2024 16:30:00 +0000"),
+        ("Mon, 2 Sep 2024 16:30:00 -0000", "Mon, 02 Sep 2024 16:30:00 +0000"),
+    ],
+)
+def test_date_headers_are_normalized(value, expected):
+    assert header_date(value) == expected
+    BaseBankProcessor.get_default_date_time(header_date(value))
+
+
+def test_offline_emails_without_x_received_use_the_date_header():
+    email = Email.from_mime(
+        b"Date: 2 Sep 2024 10:30:00 -0600\nSubject: Hola\n\n<p>Hola</p>"
+    )
+    assert email.date_str == "Mon, 02 Sep 2024 10:30:00 -0600"
+
+
+def write_mbox(tmp_path) -> str:
+    path = tmp_path / "Bancos.mbox"
+    path.write_bytes(MBOX)
+    return str(path)
+
+
+def test_process_offline_closes_the_mboxes(tmp_path):
+    path = write_mbox(tmp_path)
+    read_message(next(list_offline_messages([path])))
+    mbox = offline_source._mboxes[path]
+
+    process_offline([path], [], processes=1)
+
+    assert mbox.closed
+    assert offline_source._mboxes == {}
+
+
+def read_and_report_at_exit(path: str, report: str) -> None:
+    read_message(next(list_offline_messages([path])))
+    mbox = offline_source._mboxes[path]
+
+    def write_report():
+        with open(report, "w") as f:
+            f.write(str(mbox.closed))
+
+    # Runs after the finalizers of priority 0 when the process exits
+    Finalize(None, write_report, exitpriority=-1)
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_worker_processes_close_the_mboxes_when_they_exit(tmp_path, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{method} is not available")
+    path = write_mbox(tmp_path)
+    report = str(tmp_path / "closed.txt")
+    context = multiprocessing.get_context(method)
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        executor.submit(read_and_report_at_exit, path, report).result()
+    with open(report) as f:
+        assert f.read() == "True"
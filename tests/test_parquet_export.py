@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from models.transaction import Transaction, TransactionType
+
+pyarrow = pytest.importorskip("pyarrow")
+
+from parquet_export import export_to_parquet, read_parquet
+
+
+def transaction(date_time: datetime, amount: float, message_id: str = "", **kwargs):
+    fields = dict(
+        type=TransactionType.CARD_MOVEMENT,
+        amount_crc=amount,
+        amount_usd=0.0,
+        description="SODA LA TIA",
+        date_time=date_time,
+        card_num="1234",
+        bank_name="BAC",
+        amount_raw=f"CRC {amount}",
+        category="Comida",
+        message_id=message_id,
+    )
+    fields.update(kwargs)
+    return Transaction(**fields)
+
+
+def test_export_twice_in_the_same_month_keeps_the_previous_rows(tmp_path):
+    root = str(tmp_path / "dataset")
+    export_to_parquet(
+        [
+            transaction(datetime(2024, 9, 2, 10), 100.0, "a"),
+            transaction(datetime(2024, 9, 10, 10), 200.0, "b"),
+        ],
+        root,
+    )
+    export_to_parquet(
+        [
+            transaction(datetime(2024, 9, 20, 10), 300.0, "c"),
+            transaction(datetime(2024, 10, 3, 10), 400.0, "d"),
+        ],
+        root,
+    )
+
+    store = read_parquet(root)
+    assert [ts.message_id for ts in store] == ["a", "b", "c", "d"]
+    assert list(store.amount_crc) == [100.0, 200.0, 300.0, 400.0]
+
+
+def test_export_again_replaces_the_rows_of_the_same_transaction(tmp_path):
+    root = str(tmp_path / "dataset")
+    export_to_parquet(
+        [
+            transaction(datetime(2024, 9, 2, 10), 100.0, "a"),
+            transaction(datetime(2024, 9, 5, 10), 150.0),
+        ],
+        root,
+    )
+    export_to_parquet(
+        [
+            transaction(datetime(2024, 9, 2, 10), 100.0, "a", category="Salud"),
+            transaction(datetime(2024, 9, 5, 10), 150.0, category="Salud"),
+            transaction(datetime(2024, 9, 6, 10), 50.0, "e"),
+        ],
+        root,
+    )
+
+    store = read_parquet(root)
+    assert len(store) == 3
+    assert [ts.category for ts in store] == ["Salud", "Salud", "Comida"]
+    assert store[0].message_id == "a"
+    assert store[1].message_id == ""
@@ -0,0 +1,62 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import parse_pool
+from models.classification import CategoryCache
+from models.html_parsing import get_text_backend
+from models.transaction import classifier
+from parse_pool import map_in_processes
+
+DESCRIPTIONS = [f"AUTO MERCADO {i % 50}" for i in range(400)]
+
+
+def classify_chunk(descriptions: list[str]) -> list[str]:
+    return [classifier.classify(description) for description in descriptions]
+
+
+def category_cache_size() -> int:
+    return len(classifier.cache)
+
+
+def test_category_cache_counters_of_the_workers_are_merged():
+    hits, misses = classifier.cache.hits, classifier.cache.misses
+
+    results = list(
+        map_in_processes(classify_chunk, DESCRIPTIONS, chunk_size=50, processes=2)
+    )
+
+    assert sum(len(categories) for _, categories in results) == 400
+    classified = classifier.cache.hits - hits + classifier.cache.misses - misses
+    assert classified == 400
+
+
+def test_category_cache_entries_of_the_workers_are_saved(tmp_path):
+    path = str(tmp_path / "category_cache.json")
+    classifier.cache.clear()
+    classifier.cache.load(path)
+    try:
+        list(map_in_processes(classify_chunk, DESCRIPTIONS, chunk_size=50, processes=2))
+        classifier.cache.save(path)
+    finally:
+        classifier.cache.path = None
+
+    reloaded = CategoryCache()
+    reloaded.load(path)
+    assert len(reloaded) == 50
+    assert reloaded.fingerprint == classifier.rules.fingerprint
+
+
+def test_spawned_workers_load_the_category_cache_file(tmp_path):
+    path = str(tmp_path / "category_cache.json")
+    saved = CategoryCache()
+    for description in DESCRIPTIONS:
+        saved.classify(classifier.rules, description)
+    saved.save(path)
+
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=parse_pool._init_worker,
+        initargs=(get_text_backend(), (False, False), path),
+    ) as executor:
+        assert executor.submit(category_cache_size).result() == 50
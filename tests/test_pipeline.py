@@ -0,0 +1,19 @@
+from benchmarks.corpus import FakeGmailService
+from gmail_client import list_messages
+from pipeline import Pipeline
+
+
+def test_stats_count_the_messages_and_transactions_of_the_sink():
+    service = FakeGmailService(120)
+    transactions = []
+    stats = Pipeline(
+        lambda: service,
+        list_messages(service, ""),
+        transactions,
+        batch_size=25,
+        fetch_workers=2,
+    ).run()
+    assert stats.messages == 120
+    assert 0 < stats.transactions == len(transactions)
+    assert stats.first_transaction is not None
+    assert stats.unmarked == []
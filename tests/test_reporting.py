@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import reporting
+from models.transaction import Transaction, TransactionType
+from models.transaction_store import TransactionStore
+
+MERCHANTS = ["AUTO MERCADO", "SODA LA TIA", "FARMACIA FISCHEL", "UBER TRIP"]
+CATEGORIES = ["Groceries", "Food", "Health", ""]
+BANKS = ["BAC", "Scotiabank", "Davibank"]
+CARDS = ["1234", "5678", ""]
+
+
+def transactions(count: int = 300) -> list[Transaction]:
+    result = []
+    for i in range(count):
+        date_time = datetime(2023, 11, 20, 23, 30) + timedelta(days=i % 90, hours=i)
+        if i % 4 == 0:
+            date_time = date_time.replace(tzinfo=timezone(timedelta(hours=-6)))
+        result.append(
+            Transaction(
+                type=TransactionType.CARD_MOVEMENT,
+                amount_crc=round(1000 + i * 37.25, 2) if i % 5 else 0.0,
+                amount_usd=round(i * 0.75, 2) if i % 5 == 0 else 0.0,
+                # Same merchant written in different case and spacing
+                description=f" {MERCHANTS[i % 4].lower() if i % 3 else MERCHANTS[i % 4]} ",
+                date_time=date_time,
+                card_num=CARDS[i % 3],
+                bank_name=BANKS[i % 3],
+                category=CATEGORIES[(i // 2) % 4],
+            )
+        )
+    return result
+
+
+def test_numpy_and_pure_python_reports_are_identical(monkeypatch):
+    pytest.importorskip("numpy")
+    store = TransactionStore.from_transactions(transactions())
+    with_numpy = reporting.build_reports(store)
+    monkeypatch.setattr(reporting, "numpy", None)
+    pure_python = reporting.build_reports(store)
+    assert [report.name for report in with_numpy] == [
+        "Monthly totals",
+        "Top merchants",
+        "Card breakdown",
+    ]
+    for numpy_report, python_report in zip(with_numpy, pure_python):
+        assert numpy_report.headers == python_report.headers
+        assert numpy_report.rows == python_report.rows
+
+
+def test_monthly_totals_use_the_wall_clock_month(monkeypatch):
+    monkeypatch.setattr(reporting, "numpy", None)
+    store = TransactionStore.from_transactions(transactions(2))
+    rows = reporting.monthly_totals(store).rows
+    # 2023-11-20 23:30 -06:00 and 2023-11-22 00:30
+    assert [row[0] for row in rows] == ["2023-11", "2023-11"]
+    assert sum(row[3] for row in rows) == 2
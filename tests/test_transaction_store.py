@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from models.transaction import Transaction, TransactionType
+from models.transaction_store import Categorical, TransactionStore
+
+
+def transaction(i: int, **fields) -> Transaction:
+    values = dict(
+        type=TransactionType.CARD_MOVEMENT if i % 2 else TransactionType.SINPE_MOVIL,
+        amount_crc=1000.5 + i,
+        amount_usd=i * 0.25,
+        description=f"SODA LA TIA {i}",
+        date_time=datetime(2024, 9, 2, 10, 30, 15) + timedelta(days=i),
+        card_num="1234" if i % 2 else "5678",
+        bank_name="BAC" if i % 3 else "Scotiabank",
+        amount_raw=f"CRC {1000.5 + i}",
+        category="Food" if i % 2 else "",
+        message_id=f"<{i}@bank.example>",
+    )
+    values.update(fields)
+    return Transaction(**values)
+
+
+def test_append_and_rows_round_trip_the_transactions():
+    originals = [
+        transaction(0),
+        transaction(
+            1, date_time=datetime(2024, 1, 31, 23, 59, 59, tzinfo=timezone.utc)
+        ),
+        transaction(
+            2,
+            date_time=datetime(
+                2023, 12, 31, 20, 0, tzinfo=timezone(timedelta(hours=-6))
+            ),
+        ),
+        transaction(3, date_time=datetime(1969, 12, 31, 18, 0)),
+    ]
+    store = TransactionStore()
+    assert len(store) == 0
+    for ts in originals:
+        store.append(ts)
+    assert len(store) == 4
+    assert list(store) == originals
+    assert store[-1] == originals[3]
+    assert store[2].date_time.utcoffset() == timedelta(hours=-6)
+    assert store[0].date_time.tzinfo is None
+    with pytest.raises(IndexError):
+        store[4]
+
+
+def test_extend_in_chunks_keeps_the_order():
+    originals = [transaction(i) for i in range(25)]
+    store = TransactionStore()
+    store.extend(originals, chunk_size=4)
+    assert len(store) == 25
+    assert list(store) == originals
+
+
+def test_datetimes_keep_second_precision():
+    store = TransactionStore.from_transactions(
+        [transaction(0, date_time=datetime(2024, 9, 2, 10, 30, 15, 999999))]
+    )
+    assert store[0].date_time == datetime(2024, 9, 2, 10, 30, 15)
+
+
+def test_categorical_columns_store_every_value_once():
+    store = TransactionStore.from_transactions(transaction(i) for i in range(10))
+    assert store.bank_name.values == ["Scotiabank", "BAC"]
+    assert store.type.values == [
+        TransactionType.SINPE_MOVIL,
+        TransactionType.CARD_MOVEMENT,
+    ]
+    assert list(store.category.codes) == [0, 1] * 5
+    assert [store.category[row] for row in range(10)] == ["", "Food"] * 5
+
+
+def test_categorical_round_trip():
+    column = Categorical()
+    values = ["Food", "", "Health", "Food", None, "Health"]
+    column.extend(values[:3])
+    for value in values[3:]:
+        column.append(value)
+    assert len(column) == 6
+    assert [column[row] for row in range(6)] == values
+    assert column.values == ["Food", "", "Health", None]
+    assert column.code("Health") == 2
+
+
+def test_as_numpy_shares_the_columns():
+    numpy = pytest.importorskip("numpy")
+    store = TransactionStore.from_transactions(transaction(i) for i in range(3))
+    columns = store.as_numpy()
+    assert columns["amount_crc"].tolist() == [1000.5, 1001.5, 1002.5]
+    assert columns["category"].dtype == numpy.uint32
+    assert [columns["category_values"][code] for code in columns["category"]] == [
+        "",
+        "Food",
+        "",
+    ]
+    store.amount_crc[0] = 7.0
+    assert columns["amount_crc"][0] == 7.0
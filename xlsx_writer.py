@@ -0,0 +1,319 @@
+"""
+Minimal streaming writer of .xlsx workbooks using only the standard library.
+
+The rows of each sheet are written straight into the zip file as they arrive,
+so the memory used does not depend on the amount of rows. Strings are written
+inline (no shared strings table), numbers as numeric cells and dates and
+datetimes as Excel serial numbers with a date format.
+"""
+
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, Sequence
+from xml.sax.saxutils import escape
+
+# Rows per sheet allowed by Excel, including the header
+MAX_SHEET_ROWS = 1_048_576
+MAX_SHEET_NAME = 31
+EXCEL_EPOCH = datetime(1899, 12, 30)
+SECONDS_PER_DAY = 86400
+# Fast deflate level, the files are a bit bigger but compress several times faster
+COMPRESS_LEVEL = 1
+# Rows kept in memory between writes to the zip file
+ROWS_PER_WRITE = 500
+
+# Indexes of the cell formats (cellXfs) defined in STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_DATE = 1
+STYLE_DATETIME = 2
+STYLE_AMOUNT = 3
+
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy-mm-dd hh:mm"/>'
+    "</numFmts>"
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    "</borders>"
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+    "</cellStyleXfs>"
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0"'
+    ' applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0"'
+    ' applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0"'
+    ' applyNumberFormat="1"/>'
+    "</cellXfs>"
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/>'
+    "</cellStyles>"
+    "</styleSheet>"
+)
+
+SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    "<sheetData>"
+)
+SHEET_FOOTER = "</sheetData></worksheet>"
+
+# Characters not allowed in XML 1.0 documents
+_ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_INVALID_SHEET_NAME_CHARS = re.compile(r"[\[\]:*?/\\]")
+_STYLE_ATTRS = [
+    "",
+    f' s="{STYLE_DATE}"',
+    f' s="{STYLE_DATETIME}"',
+    f' s="{STYLE_AMOUNT}"',
+]
+
+
+def _xml_text(text: str) -> str:
+    if _ILLEGAL_XML_CHARS.search(text):
+        text = _ILLEGAL_XML_CHARS.sub("", text)
+    if "&" in text or "<" in text or ">" in text:
+        text = escape(text)
+    return text
+
+
+@lru_cache(maxsize=None)
+def column_letter(index: int) -> str:
+    """Letter of the column at the 0 based index: 0 -> A, 26 -> AA"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def excel_serial(value: date | datetime) -> float:
+    """Days since the Excel epoch of the wall clock time of value"""
+    if isinstance(value, datetime):
+        delta = value.replace(tzinfo=None) - EXCEL_EPOCH
+        return delta.days + (delta.seconds + delta.microseconds / 1e6) / SECONDS_PER_DAY
+    return (value - EXCEL_EPOCH.date()).days
+
+
+def _sheet_name(name: str, used: set[str]) -> str:
+    name = _INVALID_SHEET_NAME_CHARS.sub("_", name)[:MAX_SHEET_NAME] or "Sheet"
+    unique = name
+    suffix = 2
+    while unique.lower() in used:
+        tail = f" ({suffix})"
+        unique = name[: MAX_SHEET_NAME - len(tail)] + tail
+        suffix += 1
+    used.add(unique.lower())
+    return unique
+
+
+class XlsxWriter:
+    """
+    Writes an .xlsx workbook sheet by sheet.
+
+    add_sheet starts a new sheet (finishing the previous one) and write_row
+    appends a row to it. When a sheet reaches max_rows it continues on a new
+    sheet named '<name> (2)', '<name> (3)'... repeating the header row. The
+    file is only a valid workbook after close.
+
+    Cell values: str, int, float, bool, date, datetime or None (empty cell).
+    styles optionally gives the style index (STYLE_*) of every column, for
+    example STYLE_AMOUNT for the money columns.
+    """
+
+    def __init__(self, file_name: str, max_rows: int = MAX_SHEET_ROWS):
+        self.file_name = file_name
+        self.max_rows = max_rows
+        self._zip = zipfile.ZipFile(
+            file_name, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL
+        )
+        self._sheets: list[str] = []
+        self._used_names: set[str] = set()
+        self._stream = None
+        self._buffer: list[str] = []
+        self._name = ""
+        self._header: Sequence | None = None
+        self._styles: Sequence[int] | None = None
+        self._row = 0
+        self._part = 1
+
+    def add_sheet(
+        self,
+        name: str,
+        header: Sequence | None = None,
+        styles: Sequence[int] | None = None,
+    ) -> None:
+        self._name = name
+        self._header = header
+        self._styles = styles
+        self._part = 1
+        self._start_sheet(name)
+
+    def _start_sheet(self, name: str) -> None:
+        self._finish_sheet()
+        self._sheets.append(_sheet_name(name, self._used_names))
+        part_name = f"xl/worksheets/sheet{len(self._sheets)}.xml"
+        # force_zip64 since the size of the sheet is not known beforehand
+        self._stream = self._zip.open(part_name, "w", force_zip64=True)
+        self._stream.write(SHEET_HEADER.encode("utf-8"))
+        self._row = 0
+        if self._header is not None:
+            self._write(self._header, None)
+
+    def _finish_sheet(self) -> None:
+        if self._stream is not None:
+            self._write_buffer()
+            self._stream.write(SHEET_FOOTER.encode("utf-8"))
+            self._stream.close()
+            self._stream = None
+
+    def write_row(self, values: Sequence) -> None:
+        if self._stream is None:
+            self.add_sheet("Sheet1")
+        if self._row >= self.max_rows:
+            self._part += 1
+            self._start_sheet(f"{self._name} ({self._part})")
+        self._write(values, self._styles)
+
+    def write_rows(self, rows: Iterable[Sequence]) -> None:
+        for values in rows:
+            self.write_row(values)
+
+    def _write(self, values: Sequence, styles: Sequence[int] | None) -> None:
+        self._row += 1
+        row = self._row
+        cells = [f'<row r="{row}">']
+        for j, value in enumerate(values):
+            kind = type(value)
+            style = styles[j] if styles is not None and j < len(styles) else 0
+            style_attr = _STYLE_ATTRS[style] if style < len(_STYLE_ATTRS) else ""
+            if kind is str:
+                if not value:
+                    continue
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}" t="inlineStr"{style_attr}>'
+                    f'<is><t xml:space="preserve">{_xml_text(value)}</t></is></c>'
+                )
+            elif kind is float or kind is int:
+                if kind is float and not math.isfinite(value):
+                    continue
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}"{style_attr}><v>{value!r}</v></c>'
+                )
+            elif value is None:
+                continue
+            elif kind is bool:
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}" t="b"{style_attr}><v>{int(value)}</v></c>'
+                )
+            elif isinstance(value, (date, datetime)):
+                if not style:
+                    style = (
+                        STYLE_DATETIME if isinstance(value, datetime) else STYLE_DATE
+                    )
+                    style_attr = _STYLE_ATTRS[style]
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}"{style_attr}>'
+                    f"<v>{excel_serial(value)!r}</v></c>"
+                )
+            elif isinstance(value, (int, float)):
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}"{style_attr}><v>{float(value)!r}</v></c>'
+                )
+            else:
+                cells.append(
+                    f'<c r="{column_letter(j)}{row}" t="inlineStr"{style_attr}>'
+                    f'<is><t xml:space="preserve">{_xml_text(str(value))}</t></is></c>'
+                )
+        cells.append("</row>")
+        self._buffer.append("".join(cells))
+        # Fewer and bigger writes to the compressor
+        if len(self._buffer) >= ROWS_PER_WRITE:
+            self._write_buffer()
+
+    def _write_buffer(self) -> None:
+        if self._buffer:
+            self._stream.write("".join(self._buffer).encode("utf-8"))
+            self._buffer = []
+
+    def close(self) -> None:
+        if self._zip is None:
+            return
+        if not self._sheets:
+            self.add_sheet("Sheet1")
+        self._finish_sheet()
+        self._write_package()
+        self._zip.close()
+        self._zip = None
+
+    def __enter__(self) -> "XlsxWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def _write_package(self) -> None:
+        sheet_ids = range(1, len(self._sheets) + 1)
+        overrides = "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in sheet_ids
+        )
+        self._zip.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType='
+            '"application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f"{overrides}</Types>",
+        )
+        self._zip.writestr(
+            "_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>",
+        )
+        sheets = "".join(
+            f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+            for i, name in zip(sheet_ids, self._sheets)
+        )
+        self._zip.writestr(
+            "xl/workbook.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+            ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f"<sheets>{sheets}</sheets></workbook>",
+        )
+        relationships = "".join(
+            f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/worksheet"'
+            f' Target="worksheets/sheet{i}.xml"/>'
+            for i in sheet_ids
+        )
+        styles_id = len(self._sheets) + 1
+        self._zip.writestr(
+            "xl/_rels/workbook.xml.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f"{relationships}"
+            f'<Relationship Id="rId{styles_id}" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            "</Relationships>",
+        )
+        self._zip.writestr("xl/styles.xml", STYLES_XML)